@@ -18,6 +18,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hello_world.settings")
 
 django.setup()
 
+from hello_world.core.channel_layers import startup_health_check  # noqa: E402
+
+startup_health_check()
+
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
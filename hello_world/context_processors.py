@@ -15,3 +15,12 @@ def auth_pages(request):
     return {
         'show_content_always': show_content_always
     }
+
+
+def user_profile(request):
+    """Expose the request-scoped UserProfile without extra queries"""
+    from hello_world.core.middleware import get_request_profile
+
+    return {
+        'user_profile': get_request_profile(request)
+    }
@@ -259,4 +259,42 @@ class WoundFollowUpAdmin(admin.ModelAdmin):
         ('Next Steps', {
             'fields': ('next_followup_date', 'notes')
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(RoleBroadcast)
+class RoleBroadcastAdmin(admin.ModelAdmin):
+    list_display = ('title', 'role', 'notification_type', 'priority', 'created_at', 'expires_at')
+    list_filter = ('role', 'notification_type', 'priority')
+    search_fields = ('title', 'message')
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    """Dead-letter view for the notification dispatcher"""
+    list_display = ('group_name', 'status', 'attempts', 'next_attempt_at', 'created_at', 'last_error')
+    list_filter = ('status',)
+    search_fields = ('group_name', 'last_error')
+    readonly_fields = ('group_name', 'payload', 'claim_token', 'created_at')
+    actions = ['requeue']
+
+    @admin.action(description='Requeue selected messages')
+    def requeue(self, request, queryset):
+        from .dispatch import dispatcher
+        count = dispatcher.requeue(queryset)
+        self.message_user(request, f'{count} message(s) requeued.')
+
+
+@admin.register(SearchIndexBacklog)
+class SearchIndexBacklogAdmin(admin.ModelAdmin):
+    """Retries and dead letters of the search indexer"""
+    list_display = ('target', 'object_id', 'kind', 'status', 'attempts', 'next_attempt_at', 'last_error')
+    list_filter = ('status', 'target')
+    search_fields = ('object_id', 'last_error')
+    readonly_fields = ('kind', 'target', 'object_id', 'claim_token', 'created_at')
+    actions = ['requeue']
+
+    @admin.action(description='Requeue selected updates')
+    def requeue(self, request, queryset):
+        from .search_indexing import search_indexer
+        count = search_indexer.requeue(queryset)
+        self.message_user(request, f'{count} update(s) requeued.')
@@ -6,6 +6,7 @@ from datetime import timedelta
 from django.utils import timezone
 from .models import *
 from .serializers import *
+from .services import NotificationService, WoundStatisticsService
 
 class PatientViewSet(viewsets.ModelViewSet):
     queryset = Patient.objects.all()
@@ -37,21 +38,14 @@ class WoundCareViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Get wound care statistics"""
-        total_cases = self.queryset.count()
-        active_cases = self.queryset.filter(status='active').count()
-        resolved_cases = self.queryset.filter(status='resolved').count()
-        pending_cases = self.queryset.filter(status='pending').count()
-
-        # Recent cases (last 30 days)
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        recent_cases = self.queryset.filter(assessment_date__gte=thirty_days_ago).count()
+        stats = WoundStatisticsService.get_stats()
 
         return Response({
-            'total_cases': total_cases,
-            'active_cases': active_cases,
-            'resolved_cases': resolved_cases,
-            'pending_cases': pending_cases,
-            'recent_cases': recent_cases,
+            'total_cases': stats['all_cases'],
+            'active_cases': stats['active_cases'],
+            'resolved_cases': stats['resolved_cases'],
+            'pending_cases': stats['pending_cases'],
+            'recent_cases': stats['recent_cases'],
         })
 
 class AppointmentViewSet(viewsets.ModelViewSet):
@@ -62,4 +56,33 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 class PrescriptionViewSet(viewsets.ModelViewSet):
     queryset = Prescription.objects.select_related('patient', 'doctor')
     serializer_class = PrescriptionSerializer
-    permission_classes = [permissions.IsAuthenticated]
\ No newline at end of file
+    permission_classes = [permissions.IsAuthenticated]
+
+class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = NotificationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        """Notifications, plus the unread role broadcasts and the total unread count"""
+        response = super().list(request, *args, **kwargs)
+        broadcasts = NotificationService.unread_broadcasts(request.user)[:NotificationService.SYNC_BACKLOG_SIZE]
+        response.data = {
+            **(response.data if isinstance(response.data, dict) else {'results': response.data}),
+            'broadcasts': RoleBroadcastSerializer(broadcasts, many=True).data,
+            'unread_count': NotificationService.unread_count(request.user),
+        }
+        return response
+
+    @action(detail=False, methods=['post'], url_path='mark-read')
+    def mark_read(self, request):
+        """Mark a batch of notifications (and role broadcasts) as read"""
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = NotificationService.mark_read(request.user, **serializer.validated_data)
+        return Response({
+            'updated': updated,
+            'unread_count': NotificationService.unread_count(request.user),
+        })
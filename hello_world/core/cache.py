@@ -0,0 +1,339 @@
+"""
+Two-tier cache backend: an in-process LRU in front of a shared cache.
+
+Reads are served from a small per-worker LRU (L1) when possible and fall
+through to the shared backend (L2, Redis or a file cache) otherwise.
+
+Keys are grouped by their prefix, the part before the first colon
+('notifications:unread:12' is in group 'notifications'). Every write bumps
+its group's generation counter in L2; each worker compares the
+generations of the groups it holds with the shared ones at most once per
+GENERATION_CHECK_INTERVAL seconds and drops the L1 entries of the groups
+that changed. A write in one gunicorn worker therefore becomes visible in
+the others within that interval, without an L2 round trip on every hit,
+and a busy counter only invalidates its own group.
+
+L1 keeps a pickled copy, so callers mutating a returned object do not
+change the cached one, and never keeps an entry past its L2 expiry: each
+value's absolute expiry time is stored next to it in L2.
+"""
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_MISSING = object()
+
+
+class LocalLRU:
+    """Thread-safe LRU with per-entry expiry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return _MISSING
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, group=None):
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._data[key] = (value, expires_at, group)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, _MISSING) is not _MISSING
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def clear_group(self, group):
+        with self._lock:
+            for key in [key for key, entry in self._data.items() if entry[2] == group]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend combining a per-process LRU with a shared cache alias.
+
+    OPTIONS:
+        SHARED_ALIAS: name of the CACHES entry used as L2 (default 'shared')
+        LOCAL_MAX_ENTRIES: L1 capacity (default 1000)
+        LOCAL_TIMEOUT: upper bound in seconds an entry lives in L1 (default 30)
+        GENERATION_CHECK_INTERVAL: seconds between generation polls (default 1)
+    """
+
+    GENERATION_KEY = 'tiered-cache:generation:{}'
+    EXPIRES_KEY = 'tiered-cache:expires:{}'
+    EPOCH_KEY = 'tiered-cache:epoch'  # changed by clear()
+
+    def __init__(self, location, params):
+        options = dict(params.get('OPTIONS', {}))
+        self.shared_alias = options.pop('SHARED_ALIAS', 'shared')
+        self.local_timeout = options.pop('LOCAL_TIMEOUT', 30)
+        self.generation_check_interval = options.pop('GENERATION_CHECK_INTERVAL', 1)
+        local_max_entries = options.pop('LOCAL_MAX_ENTRIES', 1000)
+        super().__init__({**params, 'OPTIONS': options})
+
+        self._local = LocalLRU(local_max_entries)
+        self._generations = {}  # group -> generation last seen in L2
+        self._epoch = None
+        self._generation_checked_at = 0.0
+        self._generation_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'l1_hits': 0, 'l1_misses': 0,
+            'l2_hits': 0, 'l2_misses': 0,
+            'l2_errors': 0, 'invalidations': 0,
+        }
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    # Metrics
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Hit/miss counters per tier for this process"""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        for tier in ('l1', 'l2'):
+            lookups = snapshot[f'{tier}_hits'] + snapshot[f'{tier}_misses']
+            snapshot[f'{tier}_hit_rate'] = snapshot[f'{tier}_hits'] / lookups if lookups else 0.0
+        snapshot['l1_size'] = len(self._local)
+        return snapshot
+
+    # Cross-worker invalidation
+
+    @staticmethod
+    def _group(key):
+        return str(key).split(':', 1)[0]
+
+    def _apply_generation(self, group, generation):
+        """Record ``group``'s shared generation, dropping its L1 entries if it moved"""
+        known = self._generations.get(group, _MISSING)
+        if known is not _MISSING and known != generation:
+            self._local.clear_group(group)
+            self._count('invalidations')
+        self._generations[group] = generation
+
+    def _sync_generation(self):
+        now = time.monotonic()
+        if now - self._generation_checked_at < self.generation_check_interval:
+            return
+        with self._generation_lock:
+            if now - self._generation_checked_at < self.generation_check_interval:
+                return
+            self._generation_checked_at = now
+            groups = list(self._generations)
+            keys = [self.GENERATION_KEY.format(group) for group in groups]
+            try:
+                shared = self.shared.get_many(keys + [self.EPOCH_KEY])
+            except Exception:
+                self._count('l2_errors')
+                return
+            epoch = shared.get(self.EPOCH_KEY)
+            if epoch != self._epoch:
+                if self._epoch is not None:
+                    self._local.clear()
+                    self._count('invalidations')
+                self._epoch = epoch
+            for group, key in zip(groups, keys):
+                self._apply_generation(group, shared.get(key, 0))
+
+    def _register_group(self, group):
+        """First use of ``group`` in this process: read its generation before any of its values"""
+        if group in self._generations:
+            return
+        try:
+            generation = self.shared.get(self.GENERATION_KEY.format(group), 0)
+        except Exception:
+            self._count('l2_errors')
+            return
+        with self._generation_lock:
+            self._generations.setdefault(group, generation)
+
+    def _bump_generation(self, group):
+        key = self.GENERATION_KEY.format(group)
+        try:
+            try:
+                generation = self.shared.incr(key)
+            except ValueError:
+                # Key missing (first write or evicted): start a new epoch
+                generation = 1
+                if not self.shared.add(key, generation, timeout=None):
+                    generation = self.shared.incr(key)
+        except Exception:
+            self._count('l2_errors')
+            return
+        with self._generation_lock:
+            known = self._generations.get(group)
+            if known is not None and generation != known + 1:
+                # Another worker wrote to the group since our last poll
+                self._local.clear_group(group)
+                self._count('invalidations')
+            self._generations[group] = generation
+
+    def _shared_timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _store_local(self, local_key, value, timeout, group):
+        """Keep a pickled copy for at most LOCAL_TIMEOUT and no longer than ``timeout``"""
+        if timeout is None:
+            timeout = self.local_timeout
+        elif timeout <= 0:
+            self._local.delete(local_key)
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._local.set(local_key, data, min(timeout, self.local_timeout), group)
+
+    def _expires_at(self, timeout):
+        """Absolute expiry stored next to a value; None when it never expires"""
+        return None if timeout is None else time.time() + timeout
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self._sync_generation()
+
+        data = self._local.get(local_key)
+        if data is not _MISSING:
+            self._count('l1_hits')
+            return pickle.loads(data)
+        self._count('l1_misses')
+
+        group = self._group(key)
+        self._register_group(group)
+        expires_key = self.EXPIRES_KEY.format(key)
+        try:
+            found = self.shared.get_many([key, expires_key], version=version)
+        except Exception:
+            self._count('l2_errors')
+            return default
+        if key not in found:
+            self._count('l2_misses')
+            return default
+        self._count('l2_hits')
+        value = found[key]
+        expires_at = found.get(expires_key)
+        self._store_local(local_key, value, None if expires_at is None else expires_at - time.time(), group)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self._shared_timeout(timeout)
+        try:
+            self.shared.set_many({key: value, self.EXPIRES_KEY.format(key): self._expires_at(timeout)},
+                                 timeout=timeout, version=version)
+        except Exception:
+            self._count('l2_errors')
+        group = self._group(key)
+        self._bump_generation(group)
+        self._store_local(local_key, value, timeout, group)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self._shared_timeout(timeout)
+        try:
+            added = self.shared.add(key, value, timeout=timeout, version=version)
+            if added:
+                self.shared.set(self.EXPIRES_KEY.format(key), self._expires_at(timeout),
+                                timeout=timeout, version=version)
+        except Exception:
+            self._count('l2_errors')
+            return False
+        if added:
+            group = self._group(key)
+            self._bump_generation(group)
+            self._store_local(local_key, value, timeout, group)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self._shared_timeout(timeout)
+        self._local.delete(local_key)
+        try:
+            touched = self.shared.touch(key, timeout=timeout, version=version)
+            if touched:
+                self.shared.set(self.EXPIRES_KEY.format(key), self._expires_at(timeout),
+                                timeout=timeout, version=version)
+        except Exception:
+            self._count('l2_errors')
+            return False
+        if touched:
+            # Other workers may hold the value past a shortened expiry
+            self._bump_generation(self._group(key))
+        return touched
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self._local.delete(local_key)
+        try:
+            deleted = self.shared.delete(key, version=version)
+            self.shared.delete(self.EXPIRES_KEY.format(key), version=version)
+        except Exception:
+            self._count('l2_errors')
+            deleted = False
+        self._bump_generation(self._group(key))
+        return deleted
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def incr(self, key, delta=1, version=None):
+        """
+        Increment in L2 and drop the local copy. Only as atomic as the
+        shared backend's incr: Redis INCR is, the file cache fallback is
+        a read-modify-write that can lose concurrent increments.
+        """
+        local_key = self.make_and_validate_key(key, version=version)
+        self._local.delete(local_key)
+        value = self.shared.incr(key, delta, version=version)
+        self._bump_generation(self._group(key))
+        return value
+
+    def clear(self):
+        self._local.clear()
+        try:
+            self.shared.clear()
+            # Generation counters went with everything else; a new epoch
+            # tells other workers to drop their whole L1
+            self.shared.set(self.EPOCH_KEY, uuid.uuid4().hex, timeout=None)
+        except Exception:
+            self._count('l2_errors')
+        with self._generation_lock:
+            self._generations.clear()
+            self._epoch = None
+            self._generation_checked_at = 0.0
+
+    def invalidate_local(self):
+        """Drop this process's L1 and force a generation re-check"""
+        self._local.clear()
+        self._generation_checked_at = 0.0
@@ -0,0 +1,283 @@
+"""
+Change feed for the live wound and appointment WebSocket feeds.
+
+Saves of the models in FEEDS are turned into compact diffs: pre_save
+reads the stored values of the tracked fields of an existing row (one
+query per update, nothing when instances are merely loaded), and
+post_save publishes only the fields that differ (all of them for new
+rows), plus every field the live feed filters use (``id``, ``patient_id``,
+``doctor_id``, ``status``), so a client filtering on status also receives
+updates that leave the status unchanged. Treatments and follow-ups are published as updates
+of their wound, so clients merge everything per wound id.
+
+Events are handed over with transaction.on_commit, so rolled back edits
+are never published. A worker thread collects them for WINDOW seconds,
+merges events for the same object and sends one ``<type>_batch`` message
+per group and BATCH_SIZE objects through the notification outbox. A bulk
+edit of a thousand wounds is a handful of channel-layer messages rather
+than a thousand.
+
+QuerySet.update() and bulk_update() bypass model signals and are not
+published.
+"""
+import functools
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'WINDOW': 0.05,
+    'BATCH_SIZE': 200,
+    'QUEUE_SIZE': 10000,
+}
+
+
+# Identity functions return every field LIVE_TOPICS (consumers.py) filters on
+
+def _wound_identity(instance):
+    return {'id': instance.pk, 'patient_id': instance.patient_id, 'status': instance.status}
+
+
+def _wound_child_identity(instance):
+    # Usually free: views create treatments and follow-ups from a loaded wound
+    wound = instance.wound
+    return {'id': instance.wound_id, 'patient_id': wound.patient_id, 'status': wound.status}
+
+
+def _appointment_identity(instance):
+    return {
+        'id': instance.pk, 'patient_id': instance.patient_id,
+        'doctor_id': instance.doctor_id, 'status': instance.status,
+    }
+
+
+# Model label -> group, event type, identifying and filter keys, tracked fields
+# (attname -> payload key) and whether deletions are published
+FEEDS = {
+    'core.WoundCare': {
+        'group': 'wound_care_updates',
+        'type': 'wound_update',
+        'identity': _wound_identity,
+        'fields': {
+            'wound_id': 'wound_id',
+            'status': 'status',
+            'pain_level': 'pain_level',
+            'signs_of_infection': 'signs_of_infection',
+            'has_edema': 'has_edema',
+            'length_cm': 'length_cm',
+            'width_cm': 'width_cm',
+            'depth_cm': 'depth_cm',
+            'surface_area_cm2': 'surface_area_cm2',
+            'next_visit_date': 'next_visit_date',
+        },
+        'deletions': True,
+    },
+    'core.WoundTreatment': {
+        'group': 'wound_care_updates',
+        'type': 'wound_update',
+        'identity': _wound_child_identity,
+        'fields': {
+            'treatment_date': 'last_treatment_at',
+            'treatment_type': 'last_treatment_type',
+            'pain_after': 'pain_after_treatment',
+            'bleeding': 'treatment_bleeding',
+        },
+        'deletions': False,
+    },
+    'core.WoundFollowUp': {
+        'group': 'wound_care_updates',
+        'type': 'wound_update',
+        'identity': _wound_child_identity,
+        'fields': {
+            'followup_date': 'last_followup_at',
+            'wound_status': 'followup_status',
+            'pain_level': 'followup_pain_level',
+            'signs_of_infection': 'followup_signs_of_infection',
+            'next_followup_date': 'next_followup_date',
+        },
+        'deletions': False,
+    },
+    'core.Appointment': {
+        'group': 'appointment_updates',
+        'type': 'appointment_update',
+        'identity': _appointment_identity,
+        'fields': {
+            'status': 'status',
+            'date': 'date',
+            'appointment_type': 'appointment_type',
+            'clinic_id': 'clinic_id',
+        },
+        'deletions': True,
+    },
+}
+
+SNAPSHOT_ATTR = '_change_feed_snapshot'
+
+_encoder = DjangoJSONEncoder()
+
+
+def _json_value(value):
+    """Outbox payloads are JSON: dates become ISO strings, decimals strings"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return _encoder.default(value)
+
+
+class ChangeFeedPublisher:
+    """Turns model saves into batched live feed messages"""
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'events': 0, 'merged': 0, 'messages': 0, 'dropped': 0, 'last_batch_size': 0}
+
+    @property
+    def options(self):
+        return {**DEFAULT_OPTIONS, **getattr(settings, 'CHANGE_FEED', {})}
+
+    # Capture
+
+    @staticmethod
+    def snapshot(instance):
+        """Remember the stored values of the tracked fields of a row about to be updated"""
+        if instance._state.adding or instance.pk is None:
+            return
+        fields = list(FEEDS[instance._meta.label]['fields'])
+        row = (
+            type(instance)._base_manager.using(instance._state.db)
+            .filter(pk=instance.pk).values(*fields).first()
+        )
+        instance.__dict__[SNAPSHOT_ATTR] = row or {}
+
+    def record_save(self, instance, created):
+        feed = FEEDS[instance._meta.label]
+        previous = instance.__dict__.pop(SNAPSHOT_ATTR, {})
+        if created:
+            previous = {}
+        values = instance.__dict__
+        changes = {
+            key: _json_value(values[attname])
+            for attname, key in feed['fields'].items()
+            if attname in values and (attname not in previous or previous[attname] != values[attname])
+        }
+        if not changes:
+            return
+        event = {**feed['identity'](instance), **changes}
+        transaction.on_commit(functools.partial(self._offer, feed['group'], feed['type'], event))
+
+    def record_delete(self, instance):
+        feed = FEEDS[instance._meta.label]
+        if not feed['deletions']:
+            return
+        event = {**feed['identity'](instance), 'deleted': True}
+        transaction.on_commit(functools.partial(self._offer, feed['group'], feed['type'], event))
+
+    def _offer(self, group_name, event_type, event):
+        self.start()
+        try:
+            self._queue.put_nowait((group_name, event_type, event))
+        except queue.Full:
+            # Live feeds are best effort; clients refetch on reconnect
+            self._count('dropped')
+
+    # Worker
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._queue is None:
+                self._queue = queue.Queue(maxsize=self.options['QUEUE_SIZE'])
+            self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            events = self._collect()
+            close_old_connections()
+            try:
+                self.publish(events)
+            except Exception:
+                logger.exception('Change feed batch of %d events failed', len(events))
+                connection.close()
+
+    def _collect(self):
+        """Block for the first event, then gather more for up to WINDOW seconds"""
+        options = self.options
+        events = [self._queue.get()]
+        deadline = time.monotonic() + options['WINDOW']
+        limit = options['BATCH_SIZE'] * 10
+        while len(events) < limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                events.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return events
+
+    def publish(self, events):
+        """
+        Merge (group, type, event) triples per object and queue the batches
+        for delivery; returns the number of channel-layer messages.
+        """
+        from .dispatch import dispatcher
+
+        merged = {}
+        for group_name, event_type, event in events:
+            key = (group_name, event_type, event['id'])
+            pending = merged.get(key)
+            if pending is None or pending.get('deleted') or event.get('deleted'):
+                # A delete replaces earlier updates; an update after a delete
+                # (a re-created row) starts afresh rather than staying deleted
+                merged[key] = dict(event)
+            else:
+                pending.update(event)
+
+        batches = {}
+        for (group_name, event_type, _), event in merged.items():
+            batches.setdefault((group_name, event_type), []).append(event)
+
+        batch_size = self.options['BATCH_SIZE']
+        messages = [
+            (group_name, {'type': f'{event_type}_batch', 'updates': updates[start:start + batch_size]})
+            for (group_name, event_type), updates in batches.items()
+            for start in range(0, len(updates), batch_size)
+        ]
+        if messages:
+            dispatcher.enqueue(messages)
+
+        with self._stats_lock:
+            self._stats['events'] += len(events)
+            self._stats['merged'] += len(events) - len(merged)
+            self._stats['messages'] += len(messages)
+            self._stats['last_batch_size'] = len(events)
+        return len(messages)
+
+    # Metrics
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        snapshot['worker_alive'] = self._thread is not None and self._thread.is_alive()
+        return snapshot
+
+
+change_feed = ChangeFeedPublisher()
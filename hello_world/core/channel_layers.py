@@ -0,0 +1,346 @@
+"""
+Channel layer shared by all processes on one host, backed by SQLite.
+
+InMemoryChannelLayer only delivers within a single process, so with several
+gunicorn/daphne workers a notification published by one worker never
+reaches sockets held by another. This layer keeps messages and group
+membership in a SQLite file (WAL mode) that every worker opens, so
+single-box deployments get cross-process delivery without Redis.
+
+Process-specific channels (``specific.<client>!<id>``, one per consumer)
+are drained by one poller task per process that claims all of that
+process's messages with a single DELETE ... RETURNING and hands them to
+in-memory buffers, the same shape as channels_redis' receive buffer.
+Polling starts at a couple of milliseconds after traffic and backs off
+exponentially to ``poll_interval`` when idle, which bounds delivery
+latency; ``measure_latency`` reports the observed figure.
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import sqlite3
+import string
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    body TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_channel ON channel_messages (channel, id);
+CREATE INDEX IF NOT EXISTS channel_messages_expires ON channel_messages (expires);
+CREATE TABLE IF NOT EXISTS channel_groups (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    joined REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+);
+"""
+
+
+def _encode(message):
+    def default(value):
+        if isinstance(value, (bytes, bytearray)):
+            return {'__bytes__': base64.b64encode(value).decode('ascii')}
+        raise TypeError(f'{type(value).__name__} is not serializable for the channel layer')
+    return json.dumps(message, default=default, separators=(',', ':'))
+
+
+def _decode(body):
+    def object_hook(value):
+        if len(value) == 1 and '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        return value
+    return json.loads(body, object_hook=object_hook)
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """
+    CONFIG:
+        path: SQLite file shared by the worker processes (required)
+        expiry: seconds an undelivered message lives (default 60)
+        group_expiry: seconds a group membership lives (default 86400)
+        capacity: queued messages per channel before ChannelFull (default 100)
+        poll_interval: longest idle polling interval in seconds (default 0.025)
+    """
+
+    extensions = ['groups', 'flush']
+    CLEANUP_INTERVAL = 30
+    MIN_POLL_INTERVAL = 0.002
+
+    def __init__(self, path, expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, poll_interval=0.025, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = path
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.client_prefix = uuid.uuid4().hex[:12]
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sqlite-channel-layer')
+        self._buffers = {}
+        self._poller = None
+        self._last_cleanup = 0.0
+
+    # Storage
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _insert(self, channels, body, strict):
+        """
+        Queue ``body`` on each channel in one write transaction. Full channels
+        raise ChannelFull when ``strict`` and are skipped otherwise.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            placeholders = ','.join('?' * len(channels))
+            queued = dict(conn.execute(
+                f'SELECT channel, COUNT(*) FROM channel_messages '
+                f'WHERE channel IN ({placeholders}) AND expires >= ? GROUP BY channel',
+                [*channels, now],
+            ).fetchall())
+            rows = []
+            for channel in channels:
+                if queued.get(channel, 0) >= self.get_capacity(channel):
+                    if strict:
+                        raise ChannelFull(channel)
+                    continue
+                rows.append((channel, body, now + self.expiry))
+            conn.executemany('INSERT INTO channel_messages (channel, body, expires) VALUES (?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._maybe_cleanup(now)
+
+    def _claim(self, low, high):
+        """Atomically take every queued message for channels in [low, high)"""
+        conn = self._connection()
+        # Cheap read first: an empty DELETE would still take the write lock
+        if conn.execute('SELECT 1 FROM channel_messages WHERE channel >= ? AND channel < ? LIMIT 1',
+                        (low, high)).fetchone() is None:
+            return []
+        rows = conn.execute(
+            'DELETE FROM channel_messages WHERE channel >= ? AND channel < ? RETURNING id, channel, body, expires',
+            (low, high),
+        ).fetchall()
+        now = time.time()
+        return [(channel, _decode(body)) for _, channel, body, expires in sorted(rows) if expires >= now]
+
+    def _claim_one(self, channel):
+        conn = self._connection()
+        row = conn.execute(
+            'DELETE FROM channel_messages WHERE id = ('
+            'SELECT id FROM channel_messages WHERE channel = ? AND expires >= ? ORDER BY id LIMIT 1'
+            ') RETURNING body',
+            (channel, time.time()),
+        ).fetchone()
+        return _decode(row[0]) if row else None
+
+    def _maybe_cleanup(self, now):
+        if now - self._last_cleanup < self.CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        conn = self._connection()
+        # Channels with expired messages are gone (crashed worker or closed
+        # socket); drop their memberships the way InMemoryChannelLayer does
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM channel_groups WHERE channel IN '
+                         '(SELECT channel FROM channel_messages WHERE expires < ?)', (now,))
+            conn.execute('DELETE FROM channel_messages WHERE expires < ?', (now,))
+            conn.execute('DELETE FROM channel_groups WHERE joined < ?', (now - self.group_expiry,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+        await self._run(self._insert, [channel], _encode(message), True)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        if '!' not in channel:
+            # Shared named channel: poll it directly
+            delay = self.MIN_POLL_INTERVAL
+            while True:
+                message = await self._run(self._claim_one, channel)
+                if message is not None:
+                    return message
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.poll_interval)
+
+        assert self.non_local_name(channel) == self._local_prefix, 'Channel belongs to another process'
+        queue = self._buffers.setdefault(channel, asyncio.Queue())
+        self._ensure_poller()
+        try:
+            return await queue.get()
+        finally:
+            if queue.empty() and self._buffers.get(channel) is queue:
+                del self._buffers[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{prefix}{self.client_prefix}!{suffix}'
+
+    @property
+    def _local_prefix(self):
+        return f'specific.{self.client_prefix}!'
+
+    def _ensure_poller(self):
+        loop = asyncio.get_running_loop()
+        if self._poller is None or self._poller.done() or self._poller.get_loop() is not loop:
+            self._poller = loop.create_task(self._poll())
+
+    async def _poll(self):
+        low = self._local_prefix
+        high = low[:-1] + chr(ord('!') + 1)
+        delay = self.MIN_POLL_INTERVAL
+        while self._buffers:
+            try:
+                messages = await self._run(self._claim, low, high)
+            except sqlite3.Error:
+                logger.exception('SQLite channel layer poll failed')
+                messages = []
+                await asyncio.sleep(1)
+            for channel, message in messages:
+                queue = self._buffers.setdefault(channel, asyncio.Queue())
+                if queue.qsize() < self.get_capacity(channel):
+                    queue.put_nowait(message)
+            # Stay hot while traffic flows, back off when idle
+            delay = self.MIN_POLL_INTERVAL if messages else min(delay * 2, self.poll_interval)
+            await asyncio.sleep(delay)
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+
+        def add():
+            self._connection().execute(
+                'INSERT OR REPLACE INTO channel_groups (group_name, channel, joined) VALUES (?, ?, ?)',
+                (group, channel, time.time()),
+            )
+        await self._run(add)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+
+        def discard():
+            self._connection().execute(
+                'DELETE FROM channel_groups WHERE group_name = ? AND channel = ?', (group, channel),
+            )
+        await self._run(discard)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+        body = _encode(message)
+
+        def send():
+            channels = [row[0] for row in self._connection().execute(
+                'SELECT channel FROM channel_groups WHERE group_name = ? AND joined >= ?',
+                (group, time.time() - self.group_expiry),
+            )]
+            if channels:
+                self._insert(channels, body, False)
+        await self._run(send)
+
+    # Flush extension
+
+    async def flush(self):
+        def flush():
+            conn = self._connection()
+            conn.execute('DELETE FROM channel_messages')
+            conn.execute('DELETE FROM channel_groups')
+        await self._run(flush)
+        self._buffers = {}
+
+    async def close(self):
+        pass
+
+
+# Health check
+
+async def measure_latency(channel_layer, samples=20, timeout=5):
+    """
+    Publish ``samples`` messages to a fresh channel of ``channel_layer`` and
+    time each until it is received. Returns p50/p95/max in milliseconds.
+    """
+    channel = await channel_layer.new_channel()
+    latencies = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        await channel_layer.send(channel, {'type': 'health.ping'})
+        await asyncio.wait_for(channel_layer.receive(channel), timeout)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return summarize_latencies(latencies)
+
+
+def summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'samples': 0}
+    return {
+        'samples': len(latencies),
+        'p50_ms': round(latencies[len(latencies) // 2], 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+
+
+def startup_health_check():
+    """
+    Log which channel layer is in use and its publish-to-deliver latency.
+    Called once when the ASGI application loads; never raises.
+    """
+    from asgiref.sync import async_to_sync
+    from channels.layers import InMemoryChannelLayer, get_channel_layer
+
+    try:
+        channel_layer = get_channel_layer()
+        backend = type(channel_layer).__name__
+        if isinstance(channel_layer, InMemoryChannelLayer):
+            logger.warning('Channel layer %s delivers within this process only; '
+                           'notifications will not reach sockets held by other workers', backend)
+        result = async_to_sync(measure_latency)(channel_layer, samples=5)
+        logger.info('Channel layer %s healthy: publish-to-deliver p50 %.1f ms, max %.1f ms',
+                    backend, result['p50_ms'], result['max_ms'])
+    except Exception:
+        logger.exception('Channel layer health check failed; real-time notifications may not be delivered')
@@ -0,0 +1,177 @@
+"""
+Circuit breaker for optional backends such as Elasticsearch.
+
+A backend that is down should cost nothing, not a connection timeout per
+request. The breaker counts failures in a shared cache, so every worker
+sees the same state:
+
+- closed: calls go through; FAILURE_THRESHOLD failures within
+  FAILURE_WINDOW seconds open the circuit.
+- open: calls are refused immediately for RESET_TIMEOUT seconds.
+- half-open: after that, one worker (whichever wins a cache.add) runs the
+  health probe with PROBE_TIMEOUT. A healthy backend closes the circuit
+  and the call goes through; otherwise it stays open for another
+  RESET_TIMEOUT. Other workers keep refusing calls during the probe.
+
+State lives in the 'shared' cache alias rather than the default tiered
+cache, so a trip is visible to other workers at once and does not flush
+their local caches.
+"""
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULT_OPTIONS = {
+    'FAILURE_THRESHOLD': 3,
+    'FAILURE_WINDOW': 60,
+    'RESET_TIMEOUT': 30,
+    'PROBE_TIMEOUT': 1.0,
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Shared open/closed state for one backend.
+
+    ``probe`` is called with the probe timeout in seconds and returns
+    whether the backend is healthy; ``options`` is a callable returning
+    overrides of DEFAULT_OPTIONS, read on every use so settings overrides
+    apply.
+    """
+
+    def __init__(self, name, probe, options=None, cache_alias='shared'):
+        self.name = name
+        self.probe = probe
+        self._options = options or dict
+        self.cache_alias = cache_alias
+        self._stats_lock = threading.Lock()
+        self._stats = {'allowed': 0, 'short_circuited': 0, 'failures': 0, 'trips': 0, 'probes': 0, 'probe_failures': 0}
+
+    @property
+    def options(self):
+        return {**DEFAULT_OPTIONS, **self._options()}
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, suffix):
+        return f'circuit:{self.name}:{suffix}'
+
+    # State
+
+    def state(self):
+        opened_at = self.cache.get(self._key('opened_at'))
+        if opened_at is None:
+            return CLOSED
+        if time.time() - opened_at < self.options['RESET_TIMEOUT']:
+            return OPEN
+        return HALF_OPEN
+
+    def allow(self):
+        """Whether a call to the backend should be attempted now"""
+        state = self.state()
+        if state == HALF_OPEN:
+            allowed = self._try_probe()
+        else:
+            allowed = state == CLOSED
+        self._count('allowed' if allowed else 'short_circuited')
+        return allowed
+
+    def record_success(self):
+        # Cheap when closed: a single delete of a missing key
+        self.cache.delete(self._key('failures'))
+
+    def record_failure(self, error=None):
+        options = self.options
+        cache = self.cache
+        self._count('failures')
+        key = self._key('failures')
+        if cache.add(key, 1, options['FAILURE_WINDOW']):
+            failures = 1
+        else:
+            try:
+                failures = cache.incr(key)
+            except ValueError:
+                # Expired between add() and incr()
+                cache.set(key, 1, options['FAILURE_WINDOW'])
+                failures = 1
+        if failures >= options['FAILURE_THRESHOLD']:
+            self.trip(error)
+
+    def trip(self, error=None):
+        """Open the circuit (again) for RESET_TIMEOUT seconds"""
+        options = self.options
+        cache = self.cache
+        # Kept well past RESET_TIMEOUT so the half-open state is observable
+        cache.set(self._key('opened_at'), time.time(), options['RESET_TIMEOUT'] * 10)
+        cache.set(self._key('last_error'), repr(error)[:500] if error is not None else None, None)
+        cache.delete(self._key('failures'))
+        self._count('trips')
+        logger.warning('Circuit %s opened: %r', self.name, error)
+
+    def reset(self):
+        cache = self.cache
+        cache.delete_many([self._key('opened_at'), self._key('failures'), self._key('probe')])
+        logger.info('Circuit %s closed', self.name)
+
+    def _try_probe(self):
+        options = self.options
+        cache = self.cache
+        if not cache.add(self._key('probe'), 1, options['PROBE_TIMEOUT'] + 5):
+            return False  # Another worker is probing
+        self._count('probes')
+        try:
+            healthy = self.probe(options['PROBE_TIMEOUT'])
+        except Exception as error:
+            healthy = False
+            probe_error = error
+        else:
+            probe_error = None
+        if healthy:
+            self.reset()
+            return True
+        self._count('probe_failures')
+        self.trip(probe_error or 'health probe failed')
+        cache.delete(self._key('probe'))
+        return False
+
+    # Metrics
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Shared state plus this process's counters"""
+        cache = self.cache
+        shared = cache.get_many([self._key('opened_at'), self._key('failures'), self._key('last_error')])
+        opened_at = shared.get(self._key('opened_at'))
+        state = self.state()
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return {
+            'name': self.name,
+            'state': state,
+            'open': state != CLOSED,
+            'recent_failures': shared.get(self._key('failures'), 0),
+            'opened_at': opened_at,
+            'retry_in': (
+                max(0.0, round(opened_at + self.options['RESET_TIMEOUT'] - time.time(), 1))
+                if opened_at is not None else None
+            ),
+            'last_error': shared.get(self._key('last_error')),
+            'process': counters,
+        }
@@ -1,10 +1,160 @@
+import asyncio
 import json
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Notification, WoundCare, Appointment
+from django.core.serializers.json import DjangoJSONEncoder
+from .dispatch import dispatcher
+from .models import Notification, UserProfile, WoundCare, Appointment
 from django.utils import timezone
 
+COALESCE_DEFAULTS = {
+    'WINDOW': 0.25,             # seconds updates are held and merged
+    'MAX_PENDING': 500,         # distinct objects buffered before a resync
+    'MAX_TRACKED': 1000,        # objects remembered per connection for deltas
+}
+
+
+class PushStats:
+    """Process-wide counters for coalesced update pushes"""
+
+    FIELDS = ('events', 'coalesced', 'frames', 'bytes', 'resyncs')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+push_stats = PushStats()
+
+
+class CoalescedStream:
+    """Buffered updates of one frame type on one connection"""
+
+    def __init__(self, frame_type):
+        self.frame_type = frame_type
+        self.pending = {}
+        self.last_sent = OrderedDict()
+        self.needs_resync = False
+        self.flush_task = None
+
+
+class CoalescingUpdateMixin:
+    """
+    Merge update events per object id and push them in batched frames.
+
+    Events for the same id arriving within WINDOW are merged into one entry.
+    Each connection remembers the last state it sent for an object and only
+    sends fields that changed, so a flush is a single frame
+    ``{"type": frame_type, "updates": [{"id": ..., <changed fields>}]}``.
+    A connection carrying several feeds keeps one stream per frame type.
+
+    The buffer is bounded by object count: past MAX_PENDING the stream
+    is downgraded to a ``{"resync": true}`` frame telling the client to
+    refetch. That is the only bound on memory for a slow client: send()
+    returns once the frame is queued, so how long it takes says nothing
+    about the client keeping up.
+    """
+    frame_type = None
+
+    def init_coalescing(self):
+        options = {**COALESCE_DEFAULTS, **getattr(settings, 'WEBSOCKET_COALESCE', {})}
+        self.coalesce_window = options['WINDOW']
+        self.max_pending = options['MAX_PENDING']
+        self.max_tracked = options['MAX_TRACKED']
+        self._streams = {}
+
+    @property
+    def send_queue_depth(self):
+        """Objects waiting to be flushed to this connection"""
+        return sum(len(stream.pending) for stream in self._streams.values())
+
+    def queue_update(self, data, frame_type=None):
+        frame_type = frame_type or self.frame_type
+        stream = self._streams.get(frame_type)
+        if stream is None:
+            stream = self._streams[frame_type] = CoalescedStream(frame_type)
+
+        push_stats.record('events')
+        key = data.get('id')
+        if key in stream.pending:
+            stream.pending[key].update(data)
+            push_stats.record('coalesced')
+        elif not stream.needs_resync:
+            stream.pending[key] = dict(data)
+            if len(stream.pending) > self.max_pending:
+                # Too far behind to catch up field by field
+                stream.pending.clear()
+                stream.last_sent.clear()
+                stream.needs_resync = True
+                push_stats.record('resyncs')
+        if stream.flush_task is None:
+            stream.flush_task = asyncio.ensure_future(self._flush_loop(stream))
+
+    def _build_frame(self, stream):
+        if stream.needs_resync:
+            stream.needs_resync = False
+            return {'type': stream.frame_type, 'resync': True}
+
+        updates = []
+        for key, data in stream.pending.items():
+            previous = stream.last_sent.pop(key, None)
+            if data.get('deleted'):
+                updates.append(data)
+                continue
+            if previous is None:
+                delta = data
+            else:
+                delta = {field: value for field, value in data.items() if previous.get(field) != value}
+                if not delta:
+                    stream.last_sent[key] = previous
+                    continue
+                delta['id'] = key
+            updates.append(delta)
+            stream.last_sent[key] = {**(previous or {}), **data}
+        stream.pending.clear()
+        while len(stream.last_sent) > self.max_tracked:
+            stream.last_sent.popitem(last=False)
+        return {'type': stream.frame_type, 'updates': updates} if updates else None
+
+    async def _flush_loop(self, stream):
+        try:
+            while True:
+                await asyncio.sleep(self.coalesce_window)
+                if not stream.pending and not stream.needs_resync:
+                    return
+                frame = self._build_frame(stream)
+                if frame is None:
+                    continue
+                text = json.dumps(frame, cls=DjangoJSONEncoder, separators=(',', ':'))
+                await self.send(text_data=text)
+                push_stats.record('frames')
+                push_stats.record('bytes', len(text))
+        finally:
+            stream.flush_task = None
+
+    def stop_coalescing(self, frame_type=None):
+        """Cancel pending flushes, for one frame type or all of them"""
+        streams = getattr(self, '_streams', {})
+        frame_types = list(streams) if frame_type is None else [frame_type]
+        for name in frame_types:
+            stream = streams.pop(name, None)
+            if stream is not None and stream.flush_task is not None:
+                stream.flush_task.cancel()
+
+
 class NotificationConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer for real-time notifications
@@ -12,14 +162,21 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
     async def connect(self):
         self.user = self.scope['user']
+        dispatcher.attach_loop(asyncio.get_running_loop())
         if self.user.is_authenticated:
             self.room_group_name = f'notifications_{self.user.id}'
+            self.joined_groups = [self.room_group_name]
 
-            # Join room group
-            await self.channel_layer.group_add(
-                self.room_group_name,
-                self.channel_name
-            )
+            # Role broadcasts go to one group per role
+            self.role = role = await database_sync_to_async(self._get_role)()
+            if role:
+                self.joined_groups.append(f'role_{role}')
+
+            for group_name in self.joined_groups:
+                await self.channel_layer.group_add(
+                    group_name,
+                    self.channel_name
+                )
 
             await self.accept()
 
@@ -30,45 +187,61 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 'timestamp': timezone.now().isoformat()
             }))
 
+            # Unread count and backlog, so clients need no extra HTTP calls
+            sync = await database_sync_to_async(self._unread_sync)(role)
+            await self.send(text_data=json.dumps(sync))
+
     async def disconnect(self, close_code):
-        # Leave room group
-        if hasattr(self, 'room_group_name'):
+        # Leave room and role groups
+        for group_name in getattr(self, 'joined_groups', []):
             await self.channel_layer.group_discard(
-                self.room_group_name,
+                group_name,
                 self.channel_name
             )
 
+    def _get_role(self):
+        return UserProfile.objects.filter(user=self.user).values_list('role', flat=True).first()
+
+    def _unread_sync(self, role):
+        from .services import NotificationService
+        return NotificationService.unread_sync_payload(self.user, role=role)
+
     async def receive(self, text_data):
         """
         Receive message from WebSocket
         """
-        text_data_json = json.loads(text_data)
+        try:
+            text_data_json = json.loads(text_data)
+        except ValueError:
+            await self.send(text_data=json.dumps({'type': 'error', 'errors': 'Invalid JSON'}))
+            return
+        if not isinstance(text_data_json, dict):
+            await self.send(text_data=json.dumps({'type': 'error', 'errors': 'Expected a JSON object'}))
+            return
         message_type = text_data_json.get('type', 'message')
 
         if message_type == 'mark_read':
-            notification_id = text_data_json.get('notification_id')
-            await self.mark_notification_read(notification_id)
+            response = await database_sync_to_async(self._mark_read)(text_data_json)
+            await self.send(text_data=json.dumps(response))
 
-    async def mark_notification_read(self, notification_id):
+    def _mark_read(self, data):
         """
-        Mark notification as read
+        Batch mark-as-read: notification_ids, broadcast_ids and/or
+        everything before a timestamp, as one UPDATE. The single-id
+        notification_id / broadcast_id forms are still accepted.
         """
-        if notification_id:
-            await database_sync_to_async(self._mark_read)(notification_id)
+        from .serializers import MarkReadSerializer
+        from .services import NotificationService
 
-    def _mark_read(self, notification_id):
-        """
-        Database operation to mark notification as read
-        """
-        try:
-            notification = Notification.objects.get(
-                id=notification_id,
-                recipient=self.user
-            )
-            notification.is_read = True
-            notification.save()
-        except Notification.DoesNotExist:
-            pass
+        serializer = MarkReadSerializer(data=data)
+        if not serializer.is_valid():
+            return {'type': 'error', 'errors': serializer.errors}
+        updated = NotificationService.mark_read(self.user, **serializer.validated_data)
+        return {
+            'type': 'marked_read',
+            'updated': updated,
+            'unread_count': NotificationService.unread_count(self.user, role=self.role),
+        }
 
     # Notification handlers
     async def send_notification(self, event):
@@ -77,13 +250,15 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         """
         await self.send(text_data=json.dumps(event['data']))
 
-class WoundCareConsumer(AsyncWebsocketConsumer):
+class WoundCareConsumer(CoalescingUpdateMixin, AsyncWebsocketConsumer):
     """
     WebSocket consumer for wound care updates
     """
+    frame_type = 'wound_updates'
 
     async def connect(self):
         self.user = self.scope['user']
+        dispatcher.attach_loop(asyncio.get_running_loop())
         if self.user.is_authenticated:
             # Join wound care updates group
             await self.channel_layer.group_add(
@@ -91,9 +266,11 @@ class WoundCareConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
+            self.init_coalescing()
             await self.accept()
 
     async def disconnect(self, close_code):
+        self.stop_coalescing()
         await self.channel_layer.group_discard(
             'wound_care_updates',
             self.channel_name
@@ -101,17 +278,26 @@ class WoundCareConsumer(AsyncWebsocketConsumer):
 
     async def wound_update(self, event):
         """
-        Send wound care update to WebSocket
+        Queue wound care update for the next coalesced frame
         """
-        await self.send(text_data=json.dumps(event['data']))
+        self.queue_update(event['data'])
+
+    async def wound_update_batch(self, event):
+        """
+        Queue a batch of wound care updates from the change feed
+        """
+        for data in event['updates']:
+            self.queue_update(data)
 
-class AppointmentConsumer(AsyncWebsocketConsumer):
+class AppointmentConsumer(CoalescingUpdateMixin, AsyncWebsocketConsumer):
     """
     WebSocket consumer for appointment updates
     """
+    frame_type = 'appointment_updates'
 
     async def connect(self):
         self.user = self.scope['user']
+        dispatcher.attach_loop(asyncio.get_running_loop())
         if self.user.is_authenticated:
             # Join appointment updates group
             await self.channel_layer.group_add(
@@ -119,9 +305,11 @@ class AppointmentConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
+            self.init_coalescing()
             await self.accept()
 
     async def disconnect(self, close_code):
+        self.stop_coalescing()
         await self.channel_layer.group_discard(
             'appointment_updates',
             self.channel_name
@@ -129,6 +317,225 @@ class AppointmentConsumer(AsyncWebsocketConsumer):
 
     async def appointment_update(self, event):
         """
-        Send appointment update to WebSocket
+        Queue appointment update for the next coalesced frame
         """
-        await self.send(text_data=json.dumps(event['data']))
\ No newline at end of file
+        self.queue_update(event['data'])
+
+    async def appointment_update_batch(self, event):
+        """
+        Queue a batch of appointment updates from the change feed
+        """
+        for data in event['updates']:
+            self.queue_update(data)
+
+# Topics of the multiplexed live feed. ``groups`` builds the channel-layer
+# groups a subscription joins, ``permissions`` lists UserProfile permissions
+# of which any one grants the topic (empty: every signed-in user) and
+# ``filters`` the event fields a subscription may filter on.
+LIVE_TOPICS = {
+    'notifications': {
+        'groups': lambda consumer: consumer.notification_groups(),
+        'permissions': (),
+        'filters': ('type', 'priority'),
+    },
+    'wound_updates': {
+        'groups': lambda consumer: ['wound_care_updates'],
+        'permissions': ('view_wound_case',),
+        'filters': ('id', 'patient_id', 'status'),
+    },
+    'appointment_updates': {
+        'groups': lambda consumer: ['appointment_updates'],
+        'permissions': ('view_appointment', 'view_schedule'),
+        'filters': ('id', 'patient_id', 'doctor_id', 'status'),
+    },
+}
+
+
+class LiveFeedConsumer(CoalescingUpdateMixin, NotificationConsumer):
+    """
+    One WebSocket for every live feed, multiplexed by topic.
+
+    Clients subscribe with ``{"type": "subscribe", "topics": {"wound_updates":
+    {"patient_id": [12]}}}`` (or a plain list of topic names, or
+    ``?topics=a,b`` on the URL to skip a round trip) and leave with
+    ``unsubscribe``. Each topic is checked against the user's UserProfile
+    permissions, read once at connect. Filters are applied server-side:
+    an event is delivered only if every filtered field is present in it
+    and holds one of the requested values. Every frame carries ``topic``.
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        dispatcher.attach_loop(asyncio.get_running_loop())
+        if not self.user.is_authenticated:
+            return
+
+        self.role, self.permissions = await database_sync_to_async(self._load_profile)()
+        self.subscriptions = {}
+        self.joined_groups = []
+        self.init_coalescing()
+        await self.accept()
+
+        allowed = [topic for topic in LIVE_TOPICS if self.can_subscribe(topic)]
+        await self.send(text_data=json.dumps({
+            'type': 'connection_established',
+            'message': 'Connected to live feed',
+            'topics': allowed,
+            'timestamp': timezone.now().isoformat()
+        }))
+
+        requested = parse_qs(self.scope.get('query_string', b'').decode()).get('topics')
+        if requested:
+            await self.subscribe([topic for value in requested for topic in value.split(',') if topic])
+
+    async def disconnect(self, close_code):
+        self.stop_coalescing()
+        for group_name in getattr(self, 'joined_groups', []):
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+
+    def _load_profile(self):
+        profile = UserProfile.objects.filter(user=self.user).only('role', 'custom_permissions').first()
+        if profile is None:
+            return None, frozenset()
+        return profile.role, profile.get_all_permissions()
+
+    def notification_groups(self):
+        groups = [f'notifications_{self.user.id}']
+        if self.role:
+            groups.append(f'role_{self.role}')
+        return groups
+
+    def can_subscribe(self, topic):
+        required = LIVE_TOPICS[topic]['permissions']
+        return not required or not self.permissions.isdisjoint(required)
+
+    # Subscriptions
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            await self.send(text_data=json.dumps({'type': 'error', 'errors': 'Invalid JSON'}))
+            return
+        message_type = data.get('type')
+
+        if message_type == 'subscribe':
+            await self.subscribe(data.get('topics'))
+        elif message_type == 'unsubscribe':
+            await self.unsubscribe(data.get('topics'))
+        elif message_type == 'mark_read':
+            response = await database_sync_to_async(self._mark_read)(data)
+            await self.send(text_data=json.dumps({**response, 'topic': 'notifications'}))
+
+    async def subscribe(self, topics):
+        if isinstance(topics, list) and all(isinstance(topic, str) for topic in topics):
+            topics = dict.fromkeys(topics, {})
+        if not isinstance(topics, dict) or not topics:
+            await self.send(text_data=json.dumps({'type': 'error', 'errors': 'topics must be a list or an object'}))
+            return
+
+        subscribed, denied = [], {}
+        for topic, filters in topics.items():
+            if topic not in LIVE_TOPICS:
+                denied[topic] = 'unknown_topic'
+                continue
+            if not self.can_subscribe(topic):
+                denied[topic] = 'permission_denied'
+                continue
+            parsed = self._parse_filters(topic, filters)
+            if parsed is None:
+                denied[topic] = 'invalid_filters'
+                continue
+
+            new = topic not in self.subscriptions
+            self.subscriptions[topic] = parsed
+            if new:
+                for group_name in LIVE_TOPICS[topic]['groups'](self):
+                    await self.channel_layer.group_add(group_name, self.channel_name)
+                    self.joined_groups.append(group_name)
+            subscribed.append(topic)
+
+        await self.send(text_data=json.dumps({
+            'type': 'subscribed',
+            'topics': subscribed,
+            'denied': denied,
+        }))
+        if 'notifications' in subscribed:
+            # Same catch-up frame the notification endpoint sends on connect
+            sync = await database_sync_to_async(self._unread_sync)(self.role)
+            await self.send(text_data=json.dumps({**sync, 'topic': 'notifications'}))
+
+    async def unsubscribe(self, topics):
+        if isinstance(topics, dict):
+            topics = list(topics)
+        if not isinstance(topics, list):
+            topics = list(self.subscriptions)
+        removed = []
+        for topic in topics:
+            if not isinstance(topic, str) or self.subscriptions.pop(topic, None) is None:
+                continue
+            for group_name in LIVE_TOPICS[topic]['groups'](self):
+                await self.channel_layer.group_discard(group_name, self.channel_name)
+                if group_name in self.joined_groups:
+                    self.joined_groups.remove(group_name)
+            self.stop_coalescing(topic)
+            removed.append(topic)
+        await self.send(text_data=json.dumps({'type': 'unsubscribed', 'topics': removed}))
+
+    @staticmethod
+    def _parse_filters(topic, filters):
+        """Normalise ``{field: value or [values]}`` to string sets; None if invalid"""
+        if not filters:
+            return {}
+        if not isinstance(filters, dict) or not set(filters) <= set(LIVE_TOPICS[topic]['filters']):
+            return None
+        parsed = {}
+        for field, values in filters.items():
+            if not isinstance(values, list):
+                values = [values]
+            if len(values) > 1000:
+                return None
+            # Events carry scalars; a nested list or object can never match
+            if not all(isinstance(value, (str, int, float)) for value in values):
+                return None
+            parsed[field] = {str(value) for value in values}
+        return parsed
+
+    def matches(self, topic, data):
+        filters = self.subscriptions.get(topic)
+        if filters is None:
+            return False
+        return all(
+            field in data and str(data[field]) in allowed
+            for field, allowed in filters.items()
+        )
+
+    # Event handlers
+
+    async def send_notification(self, event):
+        if self.matches('notifications', event['data']):
+            await self.send(text_data=json.dumps({**event['data'], 'topic': 'notifications'}))
+
+    async def wound_update(self, event):
+        if self.matches('wound_updates', event['data']):
+            self.queue_update(event['data'], 'wound_updates')
+
+    async def appointment_update(self, event):
+        if self.matches('appointment_updates', event['data']):
+            self.queue_update(event['data'], 'appointment_updates')
+
+    async def wound_update_batch(self, event):
+        for data in event['updates']:
+            if self.matches('wound_updates', data):
+                self.queue_update(data, 'wound_updates')
+
+    async def appointment_update_batch(self, event):
+        for data in event['updates']:
+            if self.matches('appointment_updates', data):
+                self.queue_update(data, 'appointment_updates')
+
+    def _build_frame(self, stream):
+        frame = super()._build_frame(stream)
+        if frame is not None:
+            frame['topic'] = stream.frame_type
+        return frame
@@ -3,6 +3,7 @@ from django.http import HttpResponseForbidden
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect
 from django.contrib import messages
+from .middleware import get_request_profile
 
 def require_permission(permission):
     """
@@ -13,15 +14,18 @@ def require_permission(permission):
         @wraps(view_func)
         @login_required
         def _wrapped_view(request, *args, **kwargs):
-            if not hasattr(request.user, 'userprofile'):
+            profile = get_request_profile(request)
+            if profile is None:
                 messages.error(request, 'User profile not found. Please contact administrator.')
                 return redirect('dashboard')
 
-            if request.user.userprofile.has_permission(permission):
+            if profile.has_permission(permission):
                 return view_func(request, *args, **kwargs)
             else:
                 messages.error(request, f'Access denied. Required permission: {permission}')
                 return redirect('dashboard')
+        # Picked up by RBACMiddleware's compiled route table
+        _wrapped_view.required_permission = permission
         return _wrapped_view
     return decorator
 
@@ -34,11 +38,12 @@ def require_role(role):
         @wraps(view_func)
         @login_required
         def _wrapped_view(request, *args, **kwargs):
-            if not hasattr(request.user, 'userprofile'):
+            profile = get_request_profile(request)
+            if profile is None:
                 messages.error(request, 'User profile not found. Please contact administrator.')
                 return redirect('dashboard')
 
-            if request.user.userprofile.role == role:
+            if profile.role == role:
                 return view_func(request, *args, **kwargs)
             else:
                 messages.error(request, f'Access denied. Required role: {role}')
@@ -55,12 +60,12 @@ def require_any_permission(*permissions):
         @wraps(view_func)
         @login_required
         def _wrapped_view(request, *args, **kwargs):
-            if not hasattr(request.user, 'userprofile'):
+            profile = get_request_profile(request)
+            if profile is None:
                 messages.error(request, 'User profile not found. Please contact administrator.')
                 return redirect('dashboard')
 
-            user_permissions = request.user.userprofile.get_all_permissions()
-            if any(perm in user_permissions for perm in permissions):
+            if profile.has_any_permission(permissions):
                 return view_func(request, *args, **kwargs)
             else:
                 messages.error(request, f'Access denied. Required permissions: {", ".join(permissions)}')
@@ -77,11 +82,12 @@ def require_module_access(module_name):
         @wraps(view_func)
         @login_required
         def _wrapped_view(request, *args, **kwargs):
-            if not hasattr(request.user, 'userprofile'):
+            profile = get_request_profile(request)
+            if profile is None:
                 messages.error(request, 'User profile not found. Please contact administrator.')
                 return redirect('dashboard')
 
-            if request.user.userprofile.can_access_module(module_name):
+            if profile.can_access_module(module_name):
                 return view_func(request, *args, **kwargs)
             else:
                 messages.error(request, f'Access denied. Cannot access module: {module_name}')
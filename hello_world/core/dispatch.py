@@ -0,0 +1,278 @@
+"""
+Asynchronous notification dispatch.
+
+Views never talk to the channel layer directly. Messages are written to
+the NotificationOutbox table as part of the caller's transaction and their
+ids are handed to an in-process worker thread after commit. The worker
+claims rows in batches, sends them concurrently over the channel layer
+and deletes what was delivered. Failed sends are retried with exponential
+backoff and end up as dead letters (visible in the admin) once
+MAX_ATTEMPTS is reached.
+
+Sends run on the ASGI server's event loop once a consumer has attached it
+(in-process channel layers keep their queues on that loop), otherwise on
+the worker's own loop.
+
+The in-memory queue is bounded: when it is full, ids are simply not
+queued and the worker's periodic outbox sweep picks the rows up instead,
+so a slow channel layer never blocks a request. The same sweep recovers
+rows left behind by a restart and rows whose retry is due.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'QUEUE_SIZE': 1000,
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 6,
+    'BACKOFF_BASE': 2,
+    'BACKOFF_MAX': 300,
+    'POLL_INTERVAL': 5,
+    'LEASE_SECONDS': 60,
+}
+
+
+class NotificationDispatcher:
+    """Outbox-backed worker that delivers channel-layer messages"""
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._loop = None
+        self._serving_loop = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'sent': 0, 'failed': 0, 'dead': 0, 'deferred': 0, 'batches': 0,
+            'last_batch_size': 0, 'last_batch_ms': 0.0,
+            'last_lag_ms': 0.0, 'max_lag_ms': 0.0,
+        }
+
+    @property
+    def options(self):
+        return {**DEFAULT_OPTIONS, **getattr(settings, 'NOTIFICATION_DISPATCH', {})}
+
+    # Producer side
+
+    def enqueue(self, messages):
+        """
+        Persist (group_name, message) pairs to the outbox and queue them
+        for delivery once the surrounding transaction commits.
+        """
+        from .models import NotificationOutbox
+
+        rows = NotificationOutbox.objects.bulk_create([
+            NotificationOutbox(group_name=group_name, payload=message)
+            for group_name, message in messages
+        ])
+        ids = [row.pk for row in rows]
+        if ids:
+            transaction.on_commit(lambda: self._offer(ids))
+        return rows
+
+    def _offer(self, ids):
+        self.start()
+        for pk in ids:
+            try:
+                self._queue.put_nowait(pk)
+            except queue.Full:
+                # Backpressure: the row stays in the outbox for the next sweep
+                self._count('deferred')
+
+    # Worker lifecycle
+
+    def attach_loop(self, loop):
+        """Deliver on ``loop``, the event loop running the WebSocket consumers"""
+        self._serving_loop = loop
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._queue is None:
+                self._queue = queue.Queue(maxsize=self.options['QUEUE_SIZE'])
+            self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        next_sweep = 0.0
+        while True:
+            ids = self._take_batch()
+            close_old_connections()
+            try:
+                if not ids or time.monotonic() >= next_sweep:
+                    ids += self._due_ids(exclude=ids)
+                    next_sweep = time.monotonic() + self.options['POLL_INTERVAL']
+                if ids:
+                    self.dispatch(ids)
+            except Exception:
+                logger.exception('Notification dispatch batch failed')
+                connection.close()
+                time.sleep(1)
+
+    def _take_batch(self):
+        """Wait up to POLL_INTERVAL for work, then drain up to BATCH_SIZE ids"""
+        options = self.options
+        try:
+            ids = [self._queue.get(timeout=options['POLL_INTERVAL'])]
+        except queue.Empty:
+            return []
+        while len(ids) < options['BATCH_SIZE']:
+            try:
+                ids.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return ids
+
+    def _due_ids(self, exclude=()):
+        from .models import NotificationOutbox
+
+        limit = self.options['BATCH_SIZE']
+        return list(
+            NotificationOutbox.objects
+            .filter(status__in=['pending', 'sending'], next_attempt_at__lte=timezone.now())
+            .exclude(pk__in=exclude)
+            .order_by('next_attempt_at')
+            .values_list('pk', flat=True)[:limit]
+        )
+
+    # Delivery
+
+    @staticmethod
+    async def _group_send_batch(messages):
+        channel_layer = get_channel_layer()
+        return await asyncio.gather(*(
+            channel_layer.group_send(group_name, message) for group_name, message in messages
+        ), return_exceptions=True)
+
+    def _send(self, messages):
+        serving_loop = self._serving_loop
+        if serving_loop is not None and serving_loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self._group_send_batch(messages), serving_loop)
+            return future.result(timeout=self.options['LEASE_SECONDS'])
+        if self._loop is not None and threading.current_thread() is self._thread:
+            return self._loop.run_until_complete(self._group_send_batch(messages))
+        return asyncio.run(self._group_send_batch(messages))
+
+    def dispatch(self, ids):
+        """
+        Claim the given outbox rows and deliver them; returns the number sent.
+
+        Claiming sets a lease (next_attempt_at) and a token in one UPDATE, so
+        workers in other processes sweeping the same rows skip them, and rows
+        of a worker that died mid-batch become due again when the lease ends.
+        """
+        from .models import NotificationOutbox
+
+        options = self.options
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        NotificationOutbox.objects.filter(
+            pk__in=ids, status__in=['pending', 'sending'], next_attempt_at__lte=now,
+        ).update(status='sending', claim_token=token,
+                 next_attempt_at=now + timedelta(seconds=options['LEASE_SECONDS']))
+        rows = list(NotificationOutbox.objects.filter(claim_token=token, status='sending'))
+        if not rows:
+            return 0
+
+        started = time.perf_counter()
+        results = self._send([(row.group_name, row.payload) for row in rows])
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        delivered, failed = [], []
+        for row, result in zip(rows, results):
+            (failed if isinstance(result, BaseException) else delivered).append((row, result))
+
+        if delivered:
+            NotificationOutbox.objects.filter(pk__in=[row.pk for row, _ in delivered]).delete()
+        if failed:
+            now = timezone.now()
+            for row, error in failed:
+                row.attempts += 1
+                row.claim_token = ''
+                row.last_error = repr(error)[:1000]
+                if row.attempts >= options['MAX_ATTEMPTS']:
+                    row.status = 'dead'
+                else:
+                    row.status = 'pending'
+                    delay = min(options['BACKOFF_BASE'] ** row.attempts, options['BACKOFF_MAX'])
+                    row.next_attempt_at = now + timedelta(seconds=delay)
+            NotificationOutbox.objects.bulk_update(
+                [row for row, _ in failed],
+                ['attempts', 'claim_token', 'last_error', 'status', 'next_attempt_at'],
+            )
+            logger.warning('Notification dispatch: %d of %d sends failed, last error: %s',
+                           len(failed), len(rows), failed[-1][1])
+
+        lag_ms = 0.0
+        if delivered:
+            oldest = min(row.created_at for row, _ in delivered)
+            lag_ms = (timezone.now() - oldest).total_seconds() * 1000
+        dead = sum(1 for row, _ in failed if row.status == 'dead')
+        with self._stats_lock:
+            self._stats['sent'] += len(delivered)
+            self._stats['failed'] += len(failed)
+            self._stats['dead'] += dead
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(rows)
+            self._stats['last_batch_ms'] = round(elapsed_ms, 1)
+            if delivered:
+                self._stats['last_lag_ms'] = round(lag_ms, 1)
+                self._stats['max_lag_ms'] = round(max(self._stats['max_lag_ms'], lag_ms), 1)
+        logger.debug('Notification dispatch: batch of %d in %.1f ms', len(rows), elapsed_ms)
+        return len(delivered)
+
+    def requeue(self, queryset):
+        """Reset dead letters for another round of attempts"""
+        ids = list(queryset.values_list('pk', flat=True))
+        count = queryset.model.objects.filter(pk__in=ids).update(
+            status='pending', attempts=0, claim_token='', next_attempt_at=timezone.now(),
+        )
+        transaction.on_commit(lambda: self._offer(ids))
+        return count
+
+    # Metrics
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Queue depth, outbox backlog and delivery lag for this process"""
+        from django.db.models import Count, Min, Q
+        from .models import NotificationOutbox
+
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        outbox = NotificationOutbox.objects.aggregate(
+            backlog=Count('pk', filter=Q(status__in=['pending', 'sending'])),
+            dead_letters=Count('pk', filter=Q(status='dead')),
+            oldest=Min('created_at', filter=Q(status__in=['pending', 'sending'])),
+        )
+        oldest = outbox.pop('oldest')
+        snapshot.update(outbox)
+        snapshot['oldest_pending_seconds'] = (
+            round((timezone.now() - oldest).total_seconds(), 1) if oldest else 0.0
+        )
+        snapshot['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        snapshot['queue_capacity'] = self.options['QUEUE_SIZE']
+        snapshot['worker_alive'] = self._thread is not None and self._thread.is_alive()
+        return snapshot
+
+
+dispatcher = NotificationDispatcher()
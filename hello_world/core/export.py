@@ -1,109 +1,349 @@
 import csv
+import tempfile
+from datetime import datetime
+from functools import partial
 from openpyxl import Workbook
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+from reportlab.lib.units import inch
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Frame, Table, TableStyle
 from reportlab.lib import colors
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.decorators import login_required
+from django.db.models import Case, Count, Max, Q, Value, When
+from django.db.models.functions import Concat, ExtractYear, Trim
+from .export_jobs import get_export_job, start_export_job
 from .models import Patient, WoundCare
 
+PATIENT_CSV_HEADER = [
+    'MRN', 'Full Name', 'Date of Birth', 'Age', 'Gender',
+    'Phone', 'Email', 'Address', 'Registration Date'
+]
+PATIENT_CSV_FIELDS = (
+    'medical_record_number', 'export_full_name', 'date_of_birth', 'export_age',
+    'gender', 'phone', 'email', 'address', 'registration_date',
+)
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object whose write() hands the line straight back to csv"""
+
+    def write(self, value):
+        return value
+
+
+def iter_patient_rows(queryset=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield CSV rows for active patients without instantiating models.
+
+    Rows are streamed from values_list().iterator(), with the full name and
+    age computed by the database; only gender labels and dates are mapped
+    in Python, so memory stays flat however large the registry grows.
+    """
+    if queryset is None:
+        queryset = Patient.objects.filter(is_active=True)
+    today = timezone.now().date()
+    birthday_ahead = (
+        Q(date_of_birth__month__gt=today.month)
+        | Q(date_of_birth__month=today.month, date_of_birth__day__gt=today.day)
+    )
+    rows = (
+        queryset
+        .annotate(
+            export_full_name=Trim(Concat('first_name', Value(' '), 'middle_name', Value(' '), 'last_name')),
+            export_age=Value(today.year) - ExtractYear('date_of_birth')
+            - Case(When(birthday_ahead, then=Value(1)), default=Value(0)),
+        )
+        .order_by('pk')
+        .values_list(*PATIENT_CSV_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    gender_labels = dict(Patient._meta.get_field('gender').choices)
+
+    for mrn, full_name, dob, age, gender, phone, email, address, registered in rows:
+        yield [
+            mrn,
+            full_name,
+            dob,
+            age,
+            gender_labels.get(gender, gender),
+            phone,
+            email or '',
+            address or '',
+            registered.date(),
+        ]
+
+
+def iter_patient_csv(queryset=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield encoded CSV lines, header first"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(PATIENT_CSV_HEADER)
+    for row in iter_patient_rows(queryset, chunk_size=chunk_size):
+        yield writer.writerow(row)
+
+
 @login_required
 def export_patients_csv(request):
     """Export patients to CSV"""
-    response = HttpResponse(content_type='text/csv')
+    response = StreamingHttpResponse(iter_patient_csv(), content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="patients.csv"'
+    return response
 
-    writer = csv.writer(response)
-    writer.writerow([
-        'MRN', 'Full Name', 'Date of Birth', 'Age', 'Gender',
-        'Phone', 'Email', 'Address', 'Registration Date'
-    ])
-
-    for patient in Patient.objects.filter(is_active=True):
-        writer.writerow([
-            patient.medical_record_number,
-            patient.full_name,
-            patient.date_of_birth,
-            patient.age,
-            patient.get_gender_display(),
-            patient.phone,
-            patient.email or '',
-            patient.address or '',
-            patient.registration_date.date(),
-        ])
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+WOUND_EXPORT_HEADER = [
+    'Case ID', 'Patient MRN', 'Patient Name', 'Wound Type', 'Body Part',
+    'Assessment Date', 'Status', 'Pain Level', 'Insurance Covered'
+]
+WOUND_EXPORT_FIELDS = (
+    'wound_id', 'patient__medical_record_number', 'patient__first_name',
+    'patient__middle_name', 'patient__last_name', 'wound_type__name',
+    'body_part__name', 'assessment_date', 'status', 'pain_level', 'insurance_covers',
+)
+
+
+def wound_export_params(request):
+    """Filter parameters accepted by the wound exports"""
+    return {
+        'date_from': request.GET.get('date_from', ''),
+        'date_to': request.GET.get('date_to', ''),
+        'status': request.GET.get('status', ''),
+        'clinic': request.GET.get('clinic', ''),
+    }
+
+
+def filter_wound_queryset(params):
+    """
+    Apply export filters. WoundCare has no clinic of its own, so the clinic
+    filter matches the facility of the clinician who assessed the wound.
+    """
+    queryset = WoundCare.objects.all()
+    for key, lookup in (('date_from', 'assessment_date__date__gte'),
+                        ('date_to', 'assessment_date__date__lte')):
+        if params.get(key):
+            try:
+                queryset = queryset.filter(**{lookup: datetime.strptime(params[key], '%Y-%m-%d').date()})
+            except ValueError:
+                pass
+    if params.get('status'):
+        queryset = queryset.filter(status=params['status'])
+    if params.get('clinic'):
+        try:
+            queryset = queryset.filter(assessed_by__userprofile__assigned_facility_id=int(params['clinic']))
+        except ValueError:
+            pass
+    return queryset
+
+
+def wound_export_version(params):
+    """
+    Row count of the wound export and a version of its data, which changes
+    when a case in it is added, removed or edited. Background artifacts are
+    keyed by the version as well as the filters, so a repeat after an edit
+    does not download the old file.
+    """
+    data = filter_wound_queryset(params).aggregate(rows=Count('pk'), updated=Max('updated_at'), last=Max('pk'))
+    return data['rows'], f"{data['rows']}:{data['last']}:{data['updated']}"
+
+
+def iter_wound_rows(params, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield wound export rows from plain tuples, oldest case first"""
+    status_labels = dict(WoundCare.WOUND_STATUS_CHOICES)
+    rows = (
+        filter_wound_queryset(params)
+        .order_by('pk')
+        .values_list(*WOUND_EXPORT_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    for (wound_id, mrn, first_name, middle_name, last_name, wound_type, body_part,
+         assessed_at, status, pain_level, insured) in rows:
+        yield [
+            wound_id,
+            mrn,
+            f"{first_name} {middle_name} {last_name}".strip(),
+            wound_type or '',
+            body_part or '',
+            assessed_at.date(),
+            status_labels.get(status, status),
+            pain_level,
+            'Yes' if insured else 'No',
+        ]
+
+
+def write_wounds_workbook(params, fileobj):
+    """
+    Write the wound export with openpyxl's write-only mode, which spools rows
+    to a temporary file instead of keeping every cell in memory.
+    Returns the number of data rows written.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Wound Cases")
+    ws.append(WOUND_EXPORT_HEADER)
+    count = 0
+    for row in iter_wound_rows(params):
+        ws.append(row)
+        count += 1
+    wb.save(fileobj)
+    return count
+
+
+def export_job_response(request, job):
+    """202 response pointing at the status and download URLs of a job"""
+    return JsonResponse({
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': reverse('export_job_status', args=[job['id']]),
+        'download_url': reverse('export_job_download', args=[job['id']]),
+    }, status=202)
 
-    return response
 
 @login_required
 def export_wounds_excel(request):
     """Export wound cases to Excel"""
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = 'attachment; filename="wound_cases.xlsx"'
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Wound Cases"
-
-    # Header row
-    headers = [
-        'Case ID', 'Patient MRN', 'Patient Name', 'Wound Type', 'Body Part',
-        'Assessment Date', 'Status', 'Pain Level', 'Insurance Covered'
-    ]
-    ws.append(headers)
-
-    # Data rows
-    for wound in WoundCare.objects.select_related('patient', 'wound_type', 'body_part'):
-        ws.append([
-            wound.wound_id,
-            wound.patient.medical_record_number,
-            wound.patient.full_name,
-            wound.wound_type.name if wound.wound_type else '',
-            wound.body_part.name if wound.body_part else '',
-            wound.assessment_date.date(),
-            wound.get_status_display(),
-            wound.pain_level,
-            'Yes' if wound.insurance_covers else 'No',
-        ])
-
-    wb.save(response)
-    return response
+    params = wound_export_params(request)
+    rows, version = wound_export_version(params)
+    if rows > settings.EXPORT_ASYNC_ROW_THRESHOLD:
+        job = start_export_job(
+            'wounds-xlsx', {**params, 'version': version}, partial(write_wounds_workbook, params),
+            'wound_cases.xlsx', XLSX_CONTENT_TYPE, user=request.user,
+        )
+        return export_job_response(request, job)
+
+    # Small exports: build into a temporary file and stream it in chunks;
+    # the file is removed when the response closes it.
+    tmp = tempfile.TemporaryFile()
+    write_wounds_workbook(params, tmp)
+    tmp.seek(0)
+    return FileResponse(tmp, as_attachment=True, filename='wound_cases.xlsx',
+                        content_type=XLSX_CONTENT_TYPE)
+
+
+@login_required
+def export_job_status(request, job_id):
+    """Report the state of a background export the user requested"""
+    job = get_export_job(job_id, user=request.user)
+    if job is None:
+        raise Http404('Export not found or expired.')
+    data = {key: job[key] for key in ('id', 'kind', 'status', 'rows', 'seconds', 'error')}
+    if job['status'] == 'done':
+        data['download_url'] = reverse('export_job_download', args=[job_id])
+    return JsonResponse(data)
+
+
+@login_required
+def export_job_download(request, job_id):
+    """Download the artifact of a finished background export the user requested"""
+    job = get_export_job(job_id, user=request.user)
+    if job is None:
+        raise Http404('Export not found or expired.')
+    if job['status'] != 'done':
+        return JsonResponse({'id': job_id, 'status': job['status']}, status=409)
+    return FileResponse(open(job['path'], 'rb'), as_attachment=True,
+                        filename=job['filename'], content_type=job['content_type'])
+
+
+PDF_HEADER = ['Case ID', 'Patient', 'Type', 'Status', 'Date', 'Insurance']
+PDF_COLUMN_WIDTHS = [70, 130, 90, 70, 60, 48]  # fills letter width minus 1in margins
+PDF_ROWS_PER_TABLE = 35  # one table per page; fixed widths skip reportlab's measuring pass
+PDF_MARGIN = inch
+
+# Built once and shared by every chunk
+PDF_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+
+def _pdf_table(rows):
+    # repeatRows keeps the header if a chunk still has to split
+    return Table([PDF_HEADER] + rows, colWidths=PDF_COLUMN_WIDTHS, style=PDF_TABLE_STYLE, repeatRows=1)
+
+
+def iter_wound_pdf_chunks(params, rows_per_table=PDF_ROWS_PER_TABLE):
+    """
+    Yield page-sized row chunks for the wound PDF report.
+
+    Rendering many small tables lays out in linear time, whereas a single
+    table with every row makes reportlab re-split one huge flowable page
+    after page.
+    """
+    chunk = []
+    for (wound_id, _mrn, patient_name, wound_type, _body_part,
+         assessed_on, status, _pain, insured) in iter_wound_rows(params):
+        chunk.append([wound_id, patient_name, wound_type or 'N/A', status, str(assessed_on), insured])
+        if len(chunk) == rows_per_table:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _draw_pdf_table(pdf, table):
+    """Draw one table from the top of a new page, splitting it over more pages if it overflows"""
+    width, height = letter
+    pending = [table]
+    while pending:
+        # The frame of a SimpleDocTemplate page with the default margins
+        frame = Frame(PDF_MARGIN, PDF_MARGIN, width - 2 * PDF_MARGIN, height - 2 * PDF_MARGIN)
+        table = pending.pop(0)
+        if not frame.add(table, pdf):
+            parts = frame.split(table, pdf)
+            if not parts:
+                raise ValueError('PDF table row taller than a page')
+            frame.add(parts[0], pdf)
+            pending[:0] = parts[1:]
+        pdf.showPage()
+
+
+def write_wounds_pdf(params, fileobj):
+    """
+    Render the wound PDF report into ``fileobj``; returns the row count.
+
+    Pages are drawn straight onto the canvas as their rows are read, so
+    only one page's table is in memory at a time; SimpleDocTemplate.build
+    would need the whole story as a list first.
+    """
+    pdf = Canvas(fileobj, pagesize=letter)
+    count = 0
+    for chunk in iter_wound_pdf_chunks(params):
+        _draw_pdf_table(pdf, _pdf_table(chunk))
+        count += len(chunk)
+    if not count:
+        _draw_pdf_table(pdf, _pdf_table([]))
+    pdf.save()
+    return count
+
 
 @login_required
 def export_wounds_pdf(request):
     """Export wound cases to PDF"""
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="wound_cases.pdf"'
-
-    doc = SimpleDocTemplate(response, pagesize=letter)
-    elements = []
-
-    # Data
-    data = [['Case ID', 'Patient', 'Type', 'Status', 'Date', 'Insurance']]
-
-    for wound in WoundCare.objects.select_related('patient', 'wound_type'):
-        data.append([
-            wound.wound_id,
-            wound.patient.full_name,
-            wound.wound_type.name if wound.wound_type else 'N/A',
-            wound.get_status_display(),
-            str(wound.assessment_date.date()),
-            'Yes' if wound.insurance_covers else 'No',
-        ])
-
-    table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-
-    elements.append(table)
-    doc.build(elements)
-    return response
\ No newline at end of file
+    params = wound_export_params(request)
+    rows, version = wound_export_version(params)
+    if rows > settings.EXPORT_ASYNC_ROW_THRESHOLD:
+        # Rendered on a worker thread into an artifact keyed by the filters
+        # and the data version, so repeats of an unchanged report are free
+        job = start_export_job(
+            'wounds-pdf', {**params, 'version': version}, partial(write_wounds_pdf, params),
+            'wound_cases.pdf', 'application/pdf', user=request.user,
+        )
+        return export_job_response(request, job)
+
+    # Small reports render in the request, as the Excel export does: the
+    # analytics page links here directly and expects a file, and up to
+    # EXPORT_ASYNC_ROW_THRESHOLD rows (5000 by default) a report renders in
+    # about a second. Larger ones answer 202 with the job URLs.
+    tmp = tempfile.TemporaryFile()
+    write_wounds_pdf(params, tmp)
+    tmp.seek(0)
+    return FileResponse(tmp, as_attachment=True, filename='wound_cases.pdf',
+                        content_type='application/pdf')
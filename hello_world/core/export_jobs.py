@@ -0,0 +1,164 @@
+"""
+Background export jobs.
+
+Large exports are rendered on a worker thread into a file under
+settings.EXPORT_DIR. Job state lives in the shared cache so any worker can
+answer status and download requests. Jobs are keyed by export kind,
+filter parameters and the requesting user, so repeating the same export
+while it is running, or shortly after it finished, reuses the existing
+artifact. Only the requesting user can see a job unless it was started
+as shared.
+
+A job holds a lease of EXPORT_JOB_LEASE seconds that a heartbeat thread
+renews while it renders. A pending or running job whose lease ran out
+lost its worker (a restart or a killed process) and is started again by
+the next request for it.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+JOB_CACHE_PREFIX = 'export_job:'
+JOB_ERROR_MESSAGE = 'The export failed. Please try again.'
+
+
+def export_job_id(kind, params, owner=None):
+    """Stable id for an export kind, its filter parameters and its owner (None when shared)"""
+    payload = json.dumps([kind, owner, sorted((k, str(v)) for k, v in params.items() if v not in (None, ''))])
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+
+def get_export_job(job_id, user=None):
+    """
+    The job with ``job_id``, or None. Given a user, jobs that user did not
+    request and that are not shared are None as well.
+    """
+    job = cache.get(JOB_CACHE_PREFIX + job_id)
+    if job and job['status'] == 'done' and not os.path.exists(job['path']):
+        # Artifact was cleaned up or lives on another host
+        cache.delete(JOB_CACHE_PREFIX + job_id)
+        return None
+    if job and user is not None and not job.get('shared') and job.get('requested_by') != user.pk:
+        return None
+    return job
+
+
+def prune_export_artifacts(max_age=None):
+    """Remove artifacts older than EXPORT_ARTIFACT_TTL; returns the count"""
+    max_age = settings.EXPORT_ARTIFACT_TTL if max_age is None else max_age
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(settings.EXPORT_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def _save_job(job):
+    cache.set(JOB_CACHE_PREFIX + job['id'], job, settings.EXPORT_ARTIFACT_TTL)
+
+
+def _renew_lease(job):
+    job['lease_until'] = time.time() + settings.EXPORT_JOB_LEASE
+
+
+def _heartbeat(job, stop):
+    while not stop.wait(settings.EXPORT_JOB_LEASE / 3):
+        _renew_lease(job)
+        _save_job(job)
+
+
+def _run_job(job, render):
+    close_old_connections()
+    tmp_path = f"{job['path']}.{uuid.uuid4().hex}.part"
+    started = time.perf_counter()
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop), name=f"export-{job['id']}-heartbeat",
+                                 daemon=True)
+    heartbeat.start()
+    try:
+        job['status'] = 'running'
+        _save_job(job)
+        with open(tmp_path, 'wb') as fileobj:
+            job['rows'] = render(fileobj)
+        os.replace(tmp_path, job['path'])
+        job['status'] = 'done'
+    except Exception:
+        logger.exception('Export job %s failed', job['id'])
+        job['status'] = 'failed'
+        # Details stay in the log; they can include SQL and file paths
+        job['error'] = JOB_ERROR_MESSAGE
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    finally:
+        stop.set()
+        heartbeat.join()
+        job['seconds'] = round(time.perf_counter() - started, 2)
+        _save_job(job)
+        connection.close()
+
+
+def start_export_job(kind, params, render, filename, content_type, user=None, shared=False):
+    """
+    Return the job for (kind, params, user), starting it on a thread if needed.
+
+    ``render(fileobj)`` writes the artifact and returns the row count. A
+    ``shared`` job is one artifact for every user who requests it.
+    """
+    owner = None if shared else getattr(user, 'pk', None)
+    job_id = export_job_id(kind, params, owner)
+    previous = get_export_job(job_id)
+    if previous and (previous['status'] == 'done' or (
+            previous['status'] in ('pending', 'running') and previous.get('lease_until', 0) > time.time())):
+        return previous
+    # A failed job, or one whose worker died: only one request restarts it
+    if previous and not cache.add(f"{JOB_CACHE_PREFIX}{job_id}:restart:{previous.get('token')}", 1,
+                                  settings.EXPORT_JOB_LEASE):
+        return previous
+
+    os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+    prune_export_artifacts()
+    job = {
+        'id': job_id,
+        'kind': kind,
+        'params': params,
+        'status': 'pending',
+        'filename': filename,
+        'content_type': content_type,
+        'path': os.path.join(settings.EXPORT_DIR, f'{kind}-{job_id}{os.path.splitext(filename)[1]}'),
+        'requested_by': getattr(user, 'pk', None),
+        'shared': shared,
+        'rows': None,
+        'seconds': None,
+        'error': '',
+        'token': uuid.uuid4().hex,
+    }
+    _renew_lease(job)
+    if previous:
+        if previous['status'] != 'failed':
+            logger.warning('Export job %s lost its worker, restarting', job_id)
+        _save_job(job)
+    # add() is atomic in the shared tier, so only one worker starts the job
+    elif not cache.add(JOB_CACHE_PREFIX + job_id, job, settings.EXPORT_ARTIFACT_TTL):
+        return cache.get(JOB_CACHE_PREFIX + job_id) or job
+
+    threading.Thread(target=_run_job, args=(job, render), name=f'export-{job_id}', daemon=True).start()
+    return job
@@ -0,0 +1,189 @@
+"""
+Concurrent execution of the per-type searches behind global_search.
+
+Patients, wound cases, appointments and prescriptions are searched in
+parallel on a shared thread pool, so a search takes about as long as its
+slowest type instead of the sum of all four. Each type runs against the
+search backend (Elasticsearch or the built-in index, see search.py) and
+falls back to a database query on its own when the backend fails or its
+circuit is open.
+
+Each type has a time budget (TIME_BUDGET seconds, or TIME_BUDGETS[type]).
+Elasticsearch requests are given REQUEST_TIMEOUT, which should be below
+the budget, so a hung cluster releases its pool threads quickly. A
+backend search that misses its budget counts as a backend failure for
+the circuit breaker, and the type is answered from the database with a
+budget of its own. Only a type whose database query misses that too is
+returned empty and listed in ``timed_out``, so the page can say the
+results are partial. A query that ran out of time is not interrupted; it
+finishes on the pool thread and is discarded. If it has not started yet,
+it is cancelled.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+
+from .models import Appointment, Patient, Prescription, WoundCare
+from .search import (
+    elasticsearch_client, get_search_document, record_search_backend_result, search_backend_available,
+)
+
+DEFAULT_OPTIONS = {
+    'TIME_BUDGET': 2.0,
+    'TIME_BUDGETS': {},
+    'REQUEST_TIMEOUT': 1.5,
+    'MAX_WORKERS': 8,
+    'RESULTS': 10,
+}
+
+
+def _patients_from_db(query):
+    return Patient.objects.filter(
+        Q(first_name__icontains=query) |
+        Q(last_name__icontains=query) |
+        Q(medical_record_number__icontains=query) |
+        Q(phone__icontains=query) |
+        Q(email__icontains=query)
+    )
+
+
+def _wound_cases_from_db(query):
+    return WoundCare.objects.filter(
+        Q(wound_id__icontains=query) |
+        Q(appearance__icontains=query) |
+        Q(clinical_notes__icontains=query)
+    ).select_related('patient', 'wound_type')
+
+
+def _appointments_from_db(query):
+    return Appointment.objects.filter(
+        Q(notes__icontains=query)
+    ).select_related('patient', 'doctor')
+
+
+def _prescriptions_from_db(query):
+    return Prescription.objects.filter(
+        Q(diagnosis__icontains=query) |
+        Q(instructions__icontains=query)
+    ).select_related('patient', 'doctor')
+
+
+# Result type -> multi_match fields and the database fallback query
+SEARCH_TYPES = {
+    'patients': {
+        'fields': ['first_name', 'last_name', 'medical_record_number', 'phone', 'email'],
+        'fallback': _patients_from_db,
+    },
+    'wound_cases': {
+        'fields': ['wound_id', 'appearance', 'clinical_notes', 'patient_name', 'wound_type_name'],
+        'fallback': _wound_cases_from_db,
+    },
+    'appointments': {
+        'fields': ['patient_name', 'doctor_name', 'notes'],
+        'fallback': _appointments_from_db,
+    },
+    'prescriptions': {
+        'fields': ['diagnosis', 'instructions', 'patient_name', 'doctor_name'],
+        'fallback': _prescriptions_from_db,
+    },
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def search_options():
+    return {**DEFAULT_OPTIONS, **getattr(settings, 'GLOBAL_SEARCH', {})}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=search_options()['MAX_WORKERS'], thread_name_prefix='global-search',
+                )
+    return _executor
+
+
+def _search_type(search_type, query, use_index, size, request_timeout):
+    """(hits, backend error or None) for one type, evaluated on a pool thread"""
+    spec = SEARCH_TYPES[search_type]
+    try:
+        error = None
+        if use_index:
+            try:
+                document = get_search_document(search_type)
+                search = document.search().query('multi_match', query=query, fields=spec['fields'])
+                if settings.SEARCH_BACKEND == 'elasticsearch':
+                    search = search.using(elasticsearch_client(request_timeout))
+                return search[:size].execute(), None
+            except Exception as index_error:
+                error = index_error
+        # Evaluated here, not lazily in the template on the request thread
+        return list(spec['fallback'](query)[:size]), error
+    finally:
+        close_old_connections()
+
+
+def _wait(futures, started, options):
+    """type -> (hits, error) for the futures done within their budgets, and the types that were not"""
+    done, late = {}, []
+    for search_type, future in futures.items():
+        budget = options['TIME_BUDGETS'].get(search_type, options['TIME_BUDGET'])
+        try:
+            done[search_type] = future.result(timeout=max(0.0, started + budget - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            late.append(search_type)
+    return done, late
+
+
+def run_global_search(query, types):
+    """
+    Search ``types`` (keys of SEARCH_TYPES) concurrently. Returns a dict:
+
+    - results: type -> hits (empty for types that timed out)
+    - timed_out: types that missed their time budget, even from the database
+    - fallback: whether any type was answered from the database
+    """
+    options = search_options()
+    use_index = search_backend_available()
+    executor = _get_executor()
+
+    def submit(search_types, with_index):
+        return {
+            search_type: executor.submit(
+                _search_type, search_type, query, with_index, options['RESULTS'],
+                min(options['REQUEST_TIMEOUT'], options['TIME_BUDGETS'].get(search_type, options['TIME_BUDGET'])),
+            )
+            for search_type in search_types
+        }
+
+    started = time.monotonic()
+    done, late = _wait(submit(types, use_index), started, options)
+    errors = [error for _, error in done.values() if error is not None]
+    if use_index and late:
+        # A backend slower than the budget is as unusable as one that is down
+        errors.append(TimeoutError(f"Search backend exceeded the time budget for {', '.join(late)}"))
+        started = time.monotonic()
+        retried, late = _wait(submit(late, False), started, options)
+        done.update(retried)
+
+    if errors:
+        record_search_backend_result(errors[0])
+    elif use_index and done:
+        record_search_backend_result()
+
+    results = {search_type: [] for search_type in types}
+    results.update({search_type: hits for search_type, (hits, _) in done.items()})
+    return {
+        'results': results,
+        'timed_out': late,
+        'fallback': not use_index or bool(errors),
+    }
@@ -0,0 +1,116 @@
+"""
+Management command to benchmark the export pipelines (rows/sec and memory)
+"""
+import resource
+import time
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from hello_world.core.export import iter_patient_csv, write_wounds_pdf, write_wounds_workbook
+from hello_world.core.models import Patient, WoundCare
+
+
+class Command(BaseCommand):
+    help = 'Benchmark export throughput and peak memory, optionally on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-patients', type=int, default=0,
+                            help='Insert this many synthetic patients first (rolled back afterwards)')
+        parser.add_argument('--seed-wounds', type=int, default=0,
+                            help='Insert this many synthetic wound cases first (rolled back afterwards)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Iterator chunk size used by the export')
+
+    def seed_patients(self, count, batch_size=5000):
+        start = Patient.objects.count()
+        base_dob = date(1950, 1, 1)
+        for offset in range(0, count, batch_size):
+            Patient.objects.bulk_create([
+                Patient(
+                    first_name=f'Bench{i}',
+                    last_name='Patient',
+                    date_of_birth=base_dob + timedelta(days=i % 25000),
+                    gender='MF'[i % 2],
+                    phone=f'07{i:08d}',
+                    medical_record_number=f'BENCH-{start + i:09d}',
+                )
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+        self.stdout.write(f'Seeded {count} synthetic patients')
+
+    def seed_wounds(self, count, batch_size=5000):
+        patient = Patient.objects.order_by('pk').first()
+        if patient is None:
+            self.seed_patients(1)
+            patient = Patient.objects.order_by('pk').first()
+        start = WoundCare.objects.count()
+        statuses = ['active', 'pending', 'resolved']
+        for offset in range(0, count, batch_size):
+            WoundCare.objects.bulk_create([
+                WoundCare(
+                    wound_id=f'BW{start + i:09d}',
+                    patient=patient,
+                    status=statuses[i % len(statuses)],
+                    insurance_covers=bool(i % 2),
+                )
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+        self.stdout.write(f'Seeded {count} synthetic wound cases')
+
+    def measure_render(self, label, render):
+        """Render a file export to a scratch file and report time per 10k rows"""
+        # No tracemalloc here: it slows allocation-heavy renderers several-fold
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        with tempfile.TemporaryFile() as fileobj:
+            rows = render({}, fileobj)
+            size = fileobj.tell()
+        elapsed = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        per_10k = elapsed / rows * 10000 if rows else 0
+        self.stdout.write(
+            f'{label}: {rows} rows in {elapsed:.2f}s ({per_10k:.2f}s per 10k rows, '
+            f'{size / 1024 / 1024:.1f} MiB), peak RSS {rss_after / 1024:.1f} MiB '
+            f'(+{(rss_after - rss_before) / 1024:.1f} MiB)'
+        )
+
+    def measure(self, label, iterable):
+        """Drain ``iterable`` and report throughput and memory"""
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        started = time.perf_counter()
+        lines = 0
+        size = 0
+        for chunk in iterable:
+            lines += 1
+            size += len(chunk)
+        elapsed = time.perf_counter() - started
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        rows = max(lines - 1, 0)  # header line
+        self.stdout.write(
+            f'{label}: {rows} rows in {elapsed:.2f}s '
+            f'({rows / elapsed if elapsed else 0:,.0f} rows/sec, {size / 1024 / 1024:.1f} MiB), '
+            f'python peak {python_peak / 1024 / 1024:.1f} MiB, '
+            f'peak RSS {rss_after / 1024:.1f} MiB (+{(rss_after - rss_before) / 1024:.1f} MiB)'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed_patients']:
+                self.seed_patients(options['seed_patients'])
+            if options['seed_wounds']:
+                self.seed_wounds(options['seed_wounds'])
+
+            self.measure('patients.csv', iter_patient_csv(chunk_size=options['chunk_size']))
+            self.measure_render('wound_cases.xlsx', write_wounds_workbook)
+            self.measure_render('wound_cases.pdf', write_wounds_pdf)
+
+            # Never keep synthetic rows
+            transaction.set_rollback(True)
@@ -0,0 +1,61 @@
+"""
+Management command to measure SQL queries issued per authenticated page
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from hello_world.core.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Report the number of SQL queries per authenticated page and enforce a budget'
+
+    DEFAULT_PAGES = ['dashboard', 'wound_dashboard', 'patient_list']
+    AUTH_TABLES = ('FROM "django_session"', 'FROM "auth_user"', 'FROM "core_userprofile"')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', nargs='+', default=self.DEFAULT_PAGES,
+                            help='URL names to request')
+        parser.add_argument('--role', default='super_admin',
+                            help='Role of the throwaway user making the requests')
+        parser.add_argument('--budget', type=int, default=3,
+                            help='Fail if session/user/profile reads per page exceed this')
+
+    def handle(self, *args, **options):
+        failures = []
+
+        # Everything runs inside a rolled-back transaction so the throwaway
+        # user, its profile and its session never reach the real database.
+        with transaction.atomic():
+            user = User.objects.create_user(username='__benchmark_page_queries__')
+            UserProfile.objects.update_or_create(user=user, defaults={'role': options['role']})
+
+            client = Client(SERVER_NAME='localhost')
+            client.force_login(user)
+
+            for name in options['pages']:
+                with CaptureQueriesContext(connection) as ctx:
+                    response = client.get(reverse(name))
+                sqls = [q['sql'] for q in ctx.captured_queries]
+                # Session + user + profile lookups; anything else is per-view work
+                overhead = sum(
+                    1 for sql in sqls
+                    if sql.startswith('SELECT') and any(t in sql for t in self.AUTH_TABLES)
+                )
+                writes = sum(1 for sql in sqls if not sql.startswith('SELECT'))
+                self.stdout.write(
+                    f'{name:<25} status={response.status_code} queries={len(sqls)} '
+                    f'auth_profile_reads={overhead} writes={writes}'
+                )
+                if overhead > options['budget']:
+                    failures.append(f'{name}: {overhead} auth/profile reads (budget {options["budget"]})')
+
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError('; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Query budget check completed'))
@@ -0,0 +1,122 @@
+"""
+Management command to benchmark front-desk patient lookup latency
+"""
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from hello_world.core.models import Patient
+from hello_world.core.patient_lookup import PatientLookupService
+
+FIRST_NAMES = [
+    'James', 'Mary', 'Peter', 'Alice', 'Carol', 'David', 'Ruth', 'Rose', 'John', 'Grace',
+    'Joseph', 'Ann', 'Samuel', 'Faith', 'Daniel', 'Mercy', 'Brian', 'Esther', 'Kevin', 'Joy',
+    'Dennis', 'Lucy', 'Collins', 'Purity', 'Victor', 'Naomi', 'Felix', 'Sharon', 'Moses', 'Winnie',
+]
+LAST_NAMES = [
+    'Kipchoge', 'Wanjiru', 'Mutunga', 'Ochieng', 'Mwangi', 'Kiplagat', 'Chepkurui', 'Otieno',
+    'Kamau', 'Njoroge', 'Achieng', 'Chebet', 'Kiprop', 'Akinyi', 'Mutua', 'Wambui', 'Odhiambo',
+    'Kariuki', 'Njeri', 'Omondi', 'Wafula', 'Barasa', 'Nyambura', 'Korir', 'Maina', 'Atieno',
+    'Kibet', 'Muthoni', 'Onyango', 'Jepkosgei', 'Kimani', 'Wekesa', 'Gathoni', 'Rotich', 'Anyango',
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark patient lookup latency by query kind, optionally on synthetic patients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-patients', type=int, default=0,
+                            help='Insert this many synthetic patients first (rolled back unless --keep)')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the synthetic patients')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Queries per kind')
+        parser.add_argument('--limit', type=int, default=10)
+
+    def seed_patients(self, count, rng, batch_size=10000):
+        started = time.perf_counter()
+        start = Patient.objects.count()
+        base_dob = date(1940, 1, 1)
+        for offset in range(0, count, batch_size):
+            Patient.objects.bulk_create([
+                Patient(
+                    first_name=rng.choice(FIRST_NAMES),
+                    middle_name=rng.choice(LAST_NAMES) if i % 3 == 0 else '',
+                    last_name=f'{rng.choice(LAST_NAMES)}{rng.choice(["", "", "a", "i", "o"])}',
+                    date_of_birth=base_dob + timedelta(days=rng.randrange(30000)),
+                    gender='MF'[i % 2],
+                    phone=f'07{rng.randrange(10 ** 8):08d}',
+                    medical_record_number=f'SYN{start + i:08d}',
+                    national_id=f'{rng.randrange(10 ** 8):08d}',
+                )
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+        self.stdout.write(f'Seeded {count} synthetic patients in {time.perf_counter() - started:.1f}s')
+
+    def queries(self, rng, count):
+        """
+        (kind, query, expected) samples drawn from stored patients. ``expected``
+        is the patient id, or the name words to find where synthetic names
+        repeat, or None.
+        """
+        total = Patient.objects.count()
+        samples = []
+        for _ in range(count):
+            patient = Patient.objects.only(
+                'first_name', 'last_name', 'phone', 'medical_record_number', 'national_id',
+            ).order_by('pk')[rng.randrange(total)]
+            last = patient.last_name
+            position = rng.randrange(1, len(last) - 1) if len(last) > 2 else 0
+            typo = last[:position] + last[position + 1] + last[position] + last[position + 2:] if position else last
+            samples += [
+                ('mrn prefix', patient.medical_record_number[:-2], None),
+                ('mrn exact', patient.medical_record_number, patient.pk),
+                ('phone suffix', patient.phone[-4:], None),
+                ('phone full', patient.phone, patient.pk),
+                ('national id', patient.national_id, patient.pk),
+                ('partial name', f'{patient.first_name[:4]} {last[:4]}', None),
+                ('typo name', f'{patient.first_name} {typo}', {patient.first_name, last}),
+            ]
+        return samples
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        with transaction.atomic():
+            if options['seed_patients']:
+                self.seed_patients(options['seed_patients'], rng)
+                started = time.perf_counter()
+                PatientLookupService.rebuild()
+                self.stdout.write(f'Rebuilt lookup keys in {time.perf_counter() - started:.1f}s')
+
+            by_kind = {}
+            for kind, query, expected in self.queries(rng, options['queries']):
+                started = time.perf_counter()
+                results = PatientLookupService.lookup(query, limit=options['limit'])
+                elapsed = (time.perf_counter() - started) * 1000
+                stats = by_kind.setdefault(kind, {'times': [], 'hits': 0, 'expected': 0, 'empty': 0})
+                stats['times'].append(elapsed)
+                stats['empty'] += not results
+                if expected is not None:
+                    stats['expected'] += 1
+                    stats['hits'] += any(
+                        expected <= set(result['name'].split()) if isinstance(expected, set) else result['id'] == expected
+                        for result in results
+                    )
+
+            self.stdout.write(f'{Patient.objects.count()} patients, limit {options["limit"]}:')
+            for kind, stats in by_kind.items():
+                times = sorted(stats['times'])
+                recall = f', found {stats["hits"]}/{stats["expected"]}' if stats['expected'] else ''
+                self.stdout.write(
+                    f'  {kind:<13} p50 {statistics.median(times):6.2f} ms, '
+                    f'p95 {times[int(len(times) * 0.95) - 1]:6.2f} ms, max {times[-1]:6.2f} ms'
+                    f'{recall}, {stats["empty"]} empty'
+                )
+
+            if options['seed_patients'] and not options['keep']:
+                # Never keep synthetic rows unless asked
+                transaction.set_rollback(True)
@@ -0,0 +1,87 @@
+"""
+Management command to health-check the channel layer and measure delivery latency
+"""
+import asyncio
+import subprocess
+import sys
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+from hello_world.core.channel_layers import measure_latency, summarize_latencies
+
+
+class Command(BaseCommand):
+    help = ('Measure publish-to-deliver latency of the configured channel layer, '
+            'within this process and (with --cross-process) to a second process')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=50)
+        parser.add_argument('--cross-process', action='store_true',
+                            help='Also deliver to a child process, as between server workers')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Seconds to wait for the child process')
+        # Internal: run as the echoing child process
+        parser.add_argument('--echo', help='Echo pings received on this channel (internal)')
+        parser.add_argument('--reply', help='Channel to answer on (internal)')
+
+    def handle(self, *args, **options):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            raise CommandError('No channel layer configured (CHANNEL_LAYERS).')
+        if options['echo']:
+            async_to_sync(self.echo)(channel_layer, options['echo'], options['reply'], options['samples'])
+            return
+
+        backend = type(channel_layer).__name__
+        local = async_to_sync(measure_latency)(channel_layer, options['samples'])
+        self.stdout.write(f'{backend} in-process: {self.format(local)}')
+
+        if options['cross_process']:
+            try:
+                remote = async_to_sync(self.cross_process)(channel_layer, options['samples'], options['timeout'])
+            except asyncio.TimeoutError:
+                raise CommandError(
+                    f'{backend} did not deliver to another process within {options["timeout"]:.0f}s; '
+                    'notifications will not reach sockets held by other workers.'
+                )
+            self.stdout.write(f'{backend} cross-process one-way: {self.format(remote["one_way"])}')
+            self.stdout.write(f'{backend} cross-process round trip: {self.format(remote["round_trip"])}')
+        self.stdout.write(self.style.SUCCESS(f'{backend} OK'))
+
+    def format(self, result):
+        return (f'{result["samples"]} samples, p50 {result["p50_ms"]:.2f} ms, '
+                f'p95 {result["p95_ms"]:.2f} ms, max {result["max_ms"]:.2f} ms')
+
+    async def cross_process(self, channel_layer, samples, timeout):
+        request_channel = f'health.echo.{uuid.uuid4().hex}'
+        reply_channel = await channel_layer.new_channel()
+        child = subprocess.Popen([
+            sys.executable, sys.argv[0], 'check_channel_layer',
+            '--echo', request_channel, '--reply', reply_channel, '--samples', str(samples),
+        ])
+        try:
+            await asyncio.wait_for(channel_layer.receive(reply_channel), timeout)  # ready
+            one_way, round_trip = [], []
+            for _ in range(samples):
+                sent = time.time()
+                await channel_layer.send(request_channel, {'type': 'health.ping', 'sent': sent})
+                pong = await asyncio.wait_for(channel_layer.receive(reply_channel), timeout)
+                round_trip.append((time.time() - sent) * 1000)
+                one_way.append((pong['received'] - sent) * 1000)
+            return {'one_way': summarize_latencies(one_way), 'round_trip': summarize_latencies(round_trip)}
+        finally:
+            if child.poll() is None:
+                child.terminate()
+            child.wait()
+
+    async def echo(self, channel_layer, request_channel, reply_channel, samples):
+        await channel_layer.send(reply_channel, {'type': 'health.ready'})
+        for _ in range(samples):
+            ping = await channel_layer.receive(request_channel)
+            await channel_layer.send(reply_channel, {
+                'type': 'health.pong', 'sent': ping['sent'], 'received': time.time(),
+            })
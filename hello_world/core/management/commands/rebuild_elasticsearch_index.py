@@ -0,0 +1,123 @@
+"""
+Management command to rebuild Elasticsearch indexes without downtime.
+
+Each document's index name (``patients``, ``wound_cases``...) is used as
+an alias. A rebuild creates a new timestamped index, loads it in
+parallel chunks of primary keys with refresh disabled, then moves the
+alias to it in one update_aliases call and drops the old index. Searches
+keep using the old index until the swap. Updates queued while the
+rebuild runs are written to both indexes (see search_indexing.py); the
+loader only creates documents, so a row it read before such an update
+never overwrites the fresher copy.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    help = ('Rebuild Elasticsearch indexes into new indexes and swap their aliases, '
+            'loading chunks in parallel')
+
+    def add_arguments(self, parser):
+        parser.add_argument('indexes', nargs='*', help='Index names (patients, wound_cases, ...), default all')
+        parser.add_argument('--parallel', type=int, default=4,
+                            help='Chunks indexed concurrently')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Objects per chunk and bulk request')
+        parser.add_argument('--keep-old', action='store_true',
+                            help='Keep the previous indexes after the alias swap')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'ELASTICSEARCH_DSL', None):
+            raise CommandError('Elasticsearch is not configured')
+
+        from django_elasticsearch_dsl.registries import registry
+
+        documents = {document._index._name: document for document in registry.get_documents()}
+        names = options['indexes'] or sorted(documents)
+        unknown = set(names) - set(documents)
+        if unknown:
+            raise CommandError(f"Unknown index: {', '.join(sorted(unknown))}")
+
+        for name in names:
+            started = time.perf_counter()
+            count = self.rebuild(documents[name], options)
+            self.stdout.write(f'{name}: {count} documents in {time.perf_counter() - started:.1f}s')
+        self.stdout.write(self.style.SUCCESS('Elasticsearch indexes rebuilt'))
+
+    def rebuild(self, document, options):
+        from elasticsearch_dsl.connections import connections
+
+        from hello_world.core.search_indexing import set_extra_target
+
+        client = connections.get_connection()
+        alias = document._index._name
+        new_name = f'{alias}-{time.strftime("%Y%m%d%H%M%S")}'
+
+        new_index = document._index.clone(name=new_name)
+        new_index.settings(refresh_interval='-1')
+        new_index.create()
+        set_extra_target(alias, new_name)
+        try:
+            count = self.load(document, new_name, options)
+            client.indices.put_settings(index=new_name, settings={'index': {'refresh_interval': '1s'}})
+            client.indices.refresh(index=new_name)
+            old_indexes = self.swap_alias(client, alias, new_name)
+        except Exception:
+            client.indices.delete(index=new_name, ignore_unavailable=True)
+            raise
+        finally:
+            set_extra_target(alias, None)
+
+        if old_indexes and not options['keep_old']:
+            client.indices.delete(index=','.join(old_indexes), ignore_unavailable=True)
+        return count
+
+    def load(self, document, index_name, options):
+        pks = list(document.django.model.objects.order_by('pk').values_list('pk', flat=True))
+        chunk_size = options['chunk_size']
+        chunks = [(pks[start], pks[min(start + chunk_size, len(pks)) - 1])
+                  for start in range(0, len(pks), chunk_size)]
+        with ThreadPoolExecutor(max_workers=max(1, options['parallel'])) as executor:
+            return sum(executor.map(lambda bounds: self.load_chunk(document, index_name, *bounds), chunks))
+
+    def load_chunk(self, document, index_name, first_pk, last_pk):
+        from elasticsearch.helpers import bulk
+        from elasticsearch_dsl.connections import connections
+
+        from hello_world.core.search_indexing import document_actions
+
+        try:
+            objects = document().get_queryset().filter(pk__gte=first_pk, pk__lte=last_pk).order_by('pk')
+            indexed, errors = bulk(
+                connections.get_connection(), document_actions(document, objects, index_name, op_type='create'),
+                raise_on_error=False,
+            )
+            # 409: the live indexer already wrote a newer version
+            errors = [error for error in errors if error.get('create', {}).get('status') != 409]
+            if errors:
+                raise CommandError(f'{index_name}: {len(errors)} documents failed, first: {errors[0]!r}')
+            return indexed
+        finally:
+            close_old_connections()
+
+    def swap_alias(self, client, alias, new_name):
+        """Point ``alias`` at ``new_name`` atomically; returns the indexes it left"""
+        actions = [{'add': {'index': new_name, 'alias': alias}}]
+        if client.indices.exists_alias(name=alias):
+            old_indexes = list(client.indices.get_alias(name=alias))
+            actions += [{'remove': {'index': index, 'alias': alias}} for index in old_indexes]
+        else:
+            old_indexes = []
+            if client.indices.exists(index=alias):
+                # First rebuild: a concrete index holds the alias name. Dropping
+                # it in the same call leaves no moment in which a write could
+                # auto-create it again
+                self.stdout.write(self.style.WARNING(f'Replacing concrete index {alias} with an alias'))
+                actions.append({'remove_index': {'index': alias}})
+        client.indices.update_aliases(actions=actions)
+        return old_indexes
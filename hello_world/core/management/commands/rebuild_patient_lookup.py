@@ -0,0 +1,48 @@
+"""
+Management command to rebuild the front-desk patient lookup keys.
+
+The deploy and startup scripts run it with ``--if-empty`` after
+``migrate``, so existing patients are indexed once, after the migration
+that introduced the keys, and later deploys skip it. The rebuild is
+claimed in SearchIndexBuild, so two deploy steps running together do
+not build it twice.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from hello_world.core.patient_lookup import BUILD_NAME, PatientLookupService
+from hello_world.core.search import claim_build, finish_build, is_built, release_build
+
+# Seconds a rebuild holds its claim; a process that died mid-build frees it after this
+REBUILD_LEASE_SECONDS = 3600
+
+
+class Command(BaseCommand):
+    help = 'Rebuild normalized patient lookup keys and the name vocabulary used for typo-tolerant search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Patients written per transaction')
+        parser.add_argument('--if-empty', action='store_true',
+                            help='Only build when no rebuild has finished yet')
+
+    def handle(self, *args, **options):
+        if options['if_empty'] and is_built(BUILD_NAME):
+            self.stdout.write('Patient lookup keys already built')
+            return
+
+        token = claim_build(BUILD_NAME, REBUILD_LEASE_SECONDS, unbuilt_only=options['if_empty'])
+        if token is None:
+            self.stdout.write(self.style.WARNING('Built or being rebuilt elsewhere, skipping'))
+            return
+        try:
+            started = time.perf_counter()
+            count = PatientLookupService.rebuild(batch_size=options['batch_size'])
+        except BaseException:
+            release_build(BUILD_NAME, token)
+            raise
+        finish_build(BUILD_NAME, token)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} patients in {time.perf_counter() - started:.1f}s'
+        ))
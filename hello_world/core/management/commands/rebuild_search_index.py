@@ -0,0 +1,68 @@
+"""
+Management command to rebuild the built-in full-text search index.
+
+The deploy and startup scripts run it with ``--if-empty`` after
+``migrate``, so each index is built once, after the migration that
+introduced it, and later deploys skip it. Each index is claimed in
+SearchIndexBuild while it is rebuilt, so two deploy steps running
+together do not build the same index twice.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from hello_world.core.search import SEARCH_INDEXES, claim_build, finish_build, is_built, release_build
+
+# Seconds a rebuild holds its claim; a process that died mid-build frees it after this
+REBUILD_LEASE_SECONDS = 3600
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the built-in search index (SEARCH_BACKEND = local) for all or '
+            'the given indexes: ' + ', '.join(SEARCH_INDEXES))
+
+    def add_arguments(self, parser):
+        parser.add_argument('indexes', nargs='*', help='Index names, default all')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Objects indexed per transaction')
+        parser.add_argument('--if-empty', action='store_true',
+                            help='Only build indexes that no rebuild has finished for yet')
+
+    def handle(self, *args, **options):
+        names = options['indexes'] or list(SEARCH_INDEXES)
+        unknown = set(names) - set(SEARCH_INDEXES)
+        if unknown:
+            raise CommandError(f"Unknown index: {', '.join(sorted(unknown))}")
+
+        if options['if_empty']:
+            names = [name for name in names if not is_built(name)]
+            if not names:
+                self.stdout.write('Search indexes already built')
+                return
+
+        rebuilt = 0
+        for name in names:
+            token = claim_build(name, REBUILD_LEASE_SECONDS, unbuilt_only=options['if_empty'])
+            if token is None:
+                self.stdout.write(self.style.WARNING(f'{name}: built or being rebuilt elsewhere, skipping'))
+                continue
+            try:
+                started = time.perf_counter()
+                count = SEARCH_INDEXES[name].rebuild(batch_size=options['batch_size'])
+            except BaseException:
+                release_build(name, token)
+                raise
+            finish_build(name, token)
+            rebuilt += 1
+            self.stdout.write(f'{name}: {count} objects in {time.perf_counter() - started:.1f}s')
+        if not rebuilt:
+            return
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                # Merge the FTS5 b-trees written by the bulk inserts
+                cursor.execute("INSERT INTO core_searchentry_fts(core_searchentry_fts) VALUES ('optimize')")
+            elif connection.vendor == 'postgresql':
+                cursor.execute('ANALYZE core_searchentry')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -118,6 +118,20 @@ class Command(BaseCommand):
             # Don't fail completely - app can still run without this data
             return False
 
+    def build_search_indexes(self):
+        """Index existing data for search the first time"""
+        self.log("▶ Building empty search indexes...")
+        try:
+            call_command('rebuild_search_index', '--if-empty')
+            call_command('rebuild_patient_lookup', '--if-empty')
+            self.log("✓ Search indexes ready")
+            return True
+        except Exception as e:
+            self.log(f"✗ Search index build failed: {str(e)}", 'error')
+            logger.exception("Detailed search index error:")
+            # Searches fall back to the database until the index is built
+            return False
+
     def handle(self, *args, **options):
         """Main startup handler"""
         is_production = os.environ.get('DATABASE_URL') is not None
@@ -145,6 +159,9 @@ class Command(BaseCommand):
         # Step 3: Load initial data
         self.load_initial_data()
 
+        # Step 4: Index existing data for search
+        self.build_search_indexes()
+
         self.log("=" * 70)
         self.log("✓ STARTUP COMPLETE - App ready to serve requests")
         self.log("=" * 70)
@@ -1,7 +1,231 @@
+import logging
+import threading
+import time
+
 from django.contrib import messages
 from django.shortcuts import redirect
 from django.urls import reverse
 
+logger = logging.getLogger(__name__)
+
+
+def get_client_ip(request):
+    """Best-effort client IP, honouring X-Forwarded-For from the proxy"""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+class AvoidedWriteCounter:
+    """
+    Per-process counter of UserProfile writes the request path no longer makes.
+
+    Each (profile, reason) pair is counted once per wall-clock minute, matching
+    the single write the old middleware would have issued for it. When a
+    minute rolls over the finished bucket is logged and kept as ``last_minute``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._minute = int(time.time() // 60)
+        self._seen = set()
+        self.last_minute = 0
+        self.total = 0
+
+    def record(self, key):
+        minute = int(time.time() // 60)
+        with self._lock:
+            if minute != self._minute:
+                finished = len(self._seen)
+                self.last_minute = finished if minute == self._minute + 1 else 0
+                if finished:
+                    logger.info('UserProfile writes avoided in the last minute: %d', finished)
+                self._minute = minute
+                self._seen = set()
+            if key not in self._seen:
+                self._seen.add(key)
+                self.total += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'current_minute': len(self._seen),
+                'last_minute': self.last_minute,
+                'total': self.total,
+            }
+
+
+avoided_profile_writes = AvoidedWriteCounter()
+
+
+def get_request_profile(request):
+    """
+    Return the UserProfile for the current request, loading it at most once.
+
+    The profile and its department are fetched in a single select_related
+    query, wired back onto the already-authenticated user instance and
+    cached on the request so middleware, decorators, context processors and
+    views all share the same object. Returns None for anonymous users or
+    users without a profile.
+    """
+    try:
+        return request._cached_user_profile
+    except AttributeError:
+        pass
+
+    profile = None
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        from .models import UserProfile
+
+        profile = (
+            UserProfile.objects
+            .select_related('department')
+            .filter(user_id=user.pk)
+            .first()
+        )
+        if profile is not None:
+            # Populates both sides of the one-to-one cache, so
+            # request.user.userprofile and profile.user cost no queries.
+            user.userprofile = profile
+
+    request._cached_user_profile = profile
+    return profile
+
+
+# URL name -> required permission for routes in hello_world.core.urls.
+# ALLOW_ANY_PROFILE marks routes open to every authenticated user; a route
+# that appears in neither this table nor a require_permission decorator is
+# denied (fail closed).
+ALLOW_ANY_PROFILE = None
+
+URL_PERMISSIONS = {
+    'dashboard': ALLOW_ANY_PROFILE,
+
+    # Patient management
+    'patient_list': 'view_patient',
+    'patient_create': 'add_patient',
+    'patient_lookup': 'view_patient',
+    'patient_update': 'change_patient',
+
+    # Appointments
+    'appointment_list': 'view_appointment',
+    'appointment_create': 'add_appointment',
+
+    # Wound care
+    'wound_list': 'view_wound_case',
+    'wound_dashboard': 'view_wound_case',
+    'wound_detail': 'view_wound_case',
+    'wound_create': 'add_wound_case',
+    'wound_update': 'change_wound_case',
+    'wound_treatment_create': 'treat_wound',
+    'wound_followup_create': 'treat_wound',
+    'wound_billing': 'manage_wound_billing',
+
+    # Laboratory
+    'lab_request_list': 'view_lab_request',
+    'lab_request_create': 'create_lab_request',
+
+    # Pharmacy
+    'prescription_list': 'view_prescription',
+    'prescription_create': 'create_prescription',
+
+    # Out patient and nursing
+    'outpatient_visit_list': 'view_medical_history',
+    'outpatient_visit_create': 'add_medical_record',
+    'vital_signs_list': 'view_medical_history',
+    'vital_signs_create': 'add_medical_record',
+
+    # Billing
+    'billing_dashboard': 'view_invoice',
+
+    # Reports and exports
+    'advanced_analytics': 'view_analytics_dashboard',
+    'export_patients_csv': 'export_data',
+    'export_wounds_excel': 'export_data',
+    'export_wounds_pdf': 'export_data',
+    'export_job_status': 'export_data',
+    'export_job_download': 'export_data',
+
+    # Search
+    'global_search': ALLOW_ANY_PROFILE,
+    'advanced_search': ALLOW_ANY_PROFILE,
+
+    # Admin functions
+    'backup_database': 'backup_system',
+    'audit_trail': 'view_audit_logs',
+    'notification_queue_metrics': 'system_configuration',
+    'search_backend_metrics': 'system_configuration',
+
+    # REST API (DRF router names)
+    'api-root': ALLOW_ANY_PROFILE,
+    'patient-list': 'view_patient',
+    'patient-detail': 'view_patient',
+    'patient-stats': 'view_patient',
+    'woundcare-list': 'view_wound_case',
+    'woundcare-detail': 'view_wound_case',
+    'woundcare-stats': 'view_wound_case',
+    'appointment-list': 'view_appointment',
+    'appointment-detail': 'view_appointment',
+    'prescription-list': 'view_prescription',
+    'prescription-detail': 'view_prescription',
+    # Scoped to the requesting user's own notifications
+    'notification-list': ALLOW_ANY_PROFILE,
+    'notification-detail': ALLOW_ANY_PROFILE,
+    'notification-mark-read': ALLOW_ANY_PROFILE,
+}
+
+# Table value for protected routes with no known permission
+DENY = object()
+
+
+def _iter_named_patterns(patterns, namespace=None):
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            nested = namespace
+            if pattern.namespace:
+                nested = f'{namespace}:{pattern.namespace}' if namespace else pattern.namespace
+            yield from _iter_named_patterns(pattern.url_patterns, nested)
+        elif pattern.name:
+            view_name = f'{namespace}:{pattern.name}' if namespace else pattern.name
+            yield view_name, pattern.callback
+
+
+def compile_route_permissions(urlconf='hello_world.core.urls', url_permissions=None):
+    """
+    Build the view_name -> permission table enforced by RBACMiddleware.
+
+    Every named route in ``urlconf`` is protected. A require_permission
+    decorator on the view wins over the static URL_PERMISSIONS entry;
+    routes covered by neither map to DENY.
+    """
+    from importlib import import_module
+
+    if url_permissions is None:
+        url_permissions = URL_PERMISSIONS
+    module = import_module(urlconf) if isinstance(urlconf, str) else urlconf
+
+    table = {}
+    unmapped = []
+    for view_name, callback in _iter_named_patterns(module.urlpatterns):
+        if view_name in table:
+            continue
+        decorated = getattr(callback, 'required_permission', None)
+        if decorated:
+            table[view_name] = decorated
+        elif view_name in url_permissions:
+            table[view_name] = url_permissions[view_name]
+        else:
+            table[view_name] = DENY
+            unmapped.append(view_name)
+
+    if unmapped:
+        logger.warning('RBAC: no permission mapped for %s; access will be denied',
+                       ', '.join(sorted(unmapped)))
+    return table
+
+
 class RBACMiddleware:
     """
     Middleware to enforce Role-Based Access Control
@@ -9,82 +233,32 @@ class RBACMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.route_permissions = compile_route_permissions()
 
     def __call__(self, request):
-        # Process request before view
-        self.process_view(request, None, (), {})
-
-        # Get response from next middleware/view
-        response = self.get_response(request)
-
-        # Process response after view (if needed)
-        return response
+        return self.get_response(request)
 
     def process_view(self, request, view_func, view_args, view_kwargs):
         """
         Check permissions before view execution
         """
-        if not request.user.is_authenticated:
-            return None
-
-        # Check if user has a profile - if not, skip permission checks
-        try:
-            if not hasattr(request.user, 'userprofile') or request.user.userprofile is None:
-                return None
-        except:
-            # If there's any issue accessing userprofile, skip permission checks
+        view_name = getattr(request.resolver_match, 'view_name', None)
+        required_permission = self.route_permissions.get(view_name, ALLOW_ANY_PROFILE)
+        if required_permission is ALLOW_ANY_PROFILE:
             return None
 
-        # Get the URL name
-        url_name = getattr(request.resolver_match, 'url_name', None)
-        if not url_name:
+        # Anonymous users are left to the view's login_required redirect
+        if not request.user.is_authenticated:
             return None
 
-        # Define URL-based permission requirements
-        url_permissions = {
-            # Patient management
-            'patient_list': 'view_patient',
-            'patient_create': 'add_patient',
-            'patient_update': 'change_patient',
-
-            # Appointments
-            'appointment_list': 'view_appointment',
-            'appointment_create': 'add_appointment',
-
-            # Wound care
-            'wound_list': 'view_wound_case',
-            'wound_create': 'add_wound_case',
-            'wound_update': 'change_wound_case',
-            'wound_treatment_create': 'treat_wound',
-            'wound_billing': 'manage_wound_billing',
-
-            # Laboratory
-            'lab_request_list': 'view_lab_request',
-            'lab_request_create': 'create_lab_request',
-
-            # Pharmacy
-            'prescription_list': 'view_prescription',
-            'prescription_create': 'create_prescription',
-
-            # Billing
-            'billing_dashboard': 'view_invoice',
-
-            # Reports
-            'advanced_analytics': 'view_analytics_dashboard',
-
-            # Admin functions
-            'backup_database': 'backup_system',
-            'audit_trail': 'view_audit_logs',
-        }
-
-        required_permission = url_permissions.get(url_name)
-        if required_permission:
-            if not request.user.userprofile.has_permission(required_permission):
-                messages.error(
-                    request,
-                    f'Access denied. You do not have permission to access this feature.'
-                )
-                return redirect('dashboard')
+        profile = get_request_profile(request)
+        if (required_permission is DENY or profile is None
+                or not profile.has_permission(required_permission)):
+            messages.error(
+                request,
+                f'Access denied. You do not have permission to access this feature.'
+            )
+            return redirect('dashboard')
 
         return None
 
@@ -112,21 +286,15 @@ class SecurityMiddleware:
         """
         if request.user.is_authenticated:
             try:
-                if hasattr(request.user, 'userprofile') and request.user.userprofile is not None:
-                    profile = request.user.userprofile
-
-                    # Check for expired lockouts
-                    profile.has_expired_lockout
-
-                    # Record IP address for security
+                profile = get_request_profile(request)
+                if profile is not None:
+                    # Lockout expiry and IP tracking are persisted by the
+                    # user_logged_in signal, so this path stays read-only.
+                    # Count the writes the old per-request path would make.
+                    if profile.has_expired_lockout:
+                        avoided_profile_writes.record((profile.pk, 'lockout'))
                     if not profile.last_login_ip:
-                        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-                        if x_forwarded_for:
-                            ip = x_forwarded_for.split(',')[0]
-                        else:
-                            ip = request.META.get('REMOTE_ADDR')
-                        profile.last_login_ip = ip
-                        profile.save(update_fields=['last_login_ip'])
+                        avoided_profile_writes.record((profile.pk, 'last_login_ip'))
             except Exception:
                 # If there's any issue with userprofile, skip security checks
                 pass
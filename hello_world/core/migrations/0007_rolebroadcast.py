@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_notificationoutbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoleBroadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('super_admin', 'Super Administrator'), ('admin', 'System Administrator'), ('doctor', 'Doctor'), ('nurse', 'Nurse'), ('cashier', 'Cashier'), ('lab_tech', 'Laboratory Technician'), ('pharmacist', 'Pharmacist'), ('receptionist', 'Receptionist'), ('radiologist', 'Radiologist'), ('hr_manager', 'HR Manager'), ('accountant', 'Accountant'), ('it_support', 'IT Support'), ('guest', 'Guest/Read-Only')], max_length=50)),
+                ('title', models.CharField(max_length=200)),
+                ('message', models.TextField()),
+                ('notification_type', models.CharField(choices=[('info', 'Information'), ('success', 'Success'), ('warning', 'Warning'), ('error', 'Error'), ('appointment', 'Appointment'), ('wound_care', 'Wound Care'), ('lab_result', 'Lab Result'), ('billing', 'Billing'), ('system', 'System')], default='system', max_length=20)),
+                ('priority', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('urgent', 'Urgent')], default='medium', max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('action_url', models.URLField(blank=True)),
+                ('action_text', models.CharField(blank=True, max_length=50)),
+                ('related_appointment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.appointment')),
+                ('related_patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.patient')),
+                ('related_wound', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.woundcare')),
+                ('sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sent_broadcasts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RoleBroadcastRead',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reads', to='core.rolebroadcast')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcast_reads', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='rolebroadcast',
+            index=models.Index(fields=['role', '-created_at'], name='core_rolebr_role_f268af_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rolebroadcastread',
+            unique_together={('broadcast', 'user')},
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE core_searchentry_fts USING fts5(
+        text, content='core_searchentry', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER core_searchentry_ai AFTER INSERT ON core_searchentry BEGIN
+        INSERT INTO core_searchentry_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER core_searchentry_ad AFTER DELETE ON core_searchentry BEGIN
+        INSERT INTO core_searchentry_fts(core_searchentry_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER core_searchentry_au AFTER UPDATE OF text ON core_searchentry BEGIN
+        INSERT INTO core_searchentry_fts(core_searchentry_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO core_searchentry_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+]
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS core_searchentry_au',
+    'DROP TRIGGER IF EXISTS core_searchentry_ad',
+    'DROP TRIGGER IF EXISTS core_searchentry_ai',
+    'DROP TABLE IF EXISTS core_searchentry_fts',
+]
+POSTGRES_FORWARD = [
+    """ALTER TABLE core_searchentry ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED""",
+    'CREATE INDEX core_searchentry_vector_gin ON core_searchentry USING gin (search_vector)',
+]
+POSTGRES_REVERSE = [
+    'DROP INDEX IF EXISTS core_searchentry_vector_gin',
+    'ALTER TABLE core_searchentry DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run_vendor_sql(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgresql}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_rolebroadcast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index_name', models.CharField(max_length=30)),
+                ('object_id', models.PositiveIntegerField()),
+                ('field', models.CharField(max_length=50)),
+                ('text', models.TextField()),
+            ],
+            options={
+                'verbose_name_plural': 'Search entries',
+                'unique_together': {('index_name', 'object_id', 'field')},
+            },
+        ),
+        # Full-text index; other databases fall back to LIKE over core_searchentry
+        migrations.RunPython(
+            run_vendor_sql(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_vendor_sql(SQLITE_REVERSE, POSTGRES_REVERSE),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SQLITE_FORWARD = [
+    # detail='none': only single-trigram terms are queried, which keeps the indexes small
+    """CREATE VIRTUAL TABLE core_patientlookup_trgm USING fts5(
+        name_key, content='core_patientlookup', content_rowid='patient_id',
+        tokenize='trigram', detail='none'
+    )""",
+    """CREATE TRIGGER core_patientlookup_ai AFTER INSERT ON core_patientlookup BEGIN
+        INSERT INTO core_patientlookup_trgm(rowid, name_key) VALUES (new.patient_id, new.name_key);
+    END""",
+    """CREATE TRIGGER core_patientlookup_ad AFTER DELETE ON core_patientlookup BEGIN
+        INSERT INTO core_patientlookup_trgm(core_patientlookup_trgm, rowid, name_key)
+        VALUES ('delete', old.patient_id, old.name_key);
+    END""",
+    """CREATE TRIGGER core_patientlookup_au AFTER UPDATE OF name_key ON core_patientlookup BEGIN
+        INSERT INTO core_patientlookup_trgm(core_patientlookup_trgm, rowid, name_key)
+        VALUES ('delete', old.patient_id, old.name_key);
+        INSERT INTO core_patientlookup_trgm(rowid, name_key) VALUES (new.patient_id, new.name_key);
+    END""",
+    """CREATE VIRTUAL TABLE core_patientnameword_trgm USING fts5(
+        word, content='core_patientnameword', content_rowid='rowid',
+        tokenize='trigram', detail='none'
+    )""",
+    """CREATE TRIGGER core_patientnameword_ai AFTER INSERT ON core_patientnameword BEGIN
+        INSERT INTO core_patientnameword_trgm(rowid, word) VALUES (new.rowid, new.word);
+    END""",
+    """CREATE TRIGGER core_patientnameword_ad AFTER DELETE ON core_patientnameword BEGIN
+        INSERT INTO core_patientnameword_trgm(core_patientnameword_trgm, rowid, word)
+        VALUES ('delete', old.rowid, old.word);
+    END""",
+]
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS core_patientnameword_ad',
+    'DROP TRIGGER IF EXISTS core_patientnameword_ai',
+    'DROP TABLE IF EXISTS core_patientnameword_trgm',
+    'DROP TRIGGER IF EXISTS core_patientlookup_au',
+    'DROP TRIGGER IF EXISTS core_patientlookup_ad',
+    'DROP TRIGGER IF EXISTS core_patientlookup_ai',
+    'DROP TABLE IF EXISTS core_patientlookup_trgm',
+]
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX core_patientlookup_name_trgm ON core_patientlookup USING gin (name_key gin_trgm_ops)',
+]
+POSTGRES_REVERSE = [
+    'DROP INDEX IF EXISTS core_patientlookup_name_trgm',
+]
+
+
+def run_vendor_sql(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgresql}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_searchentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientNameWord',
+            fields=[
+                ('word', models.CharField(max_length=60, primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PatientLookup',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lookup', serialize=False, to='core.patient')),
+                ('name_key', models.CharField(max_length=160)),
+                ('mrn_key', models.CharField(max_length=20)),
+                ('phone_key', models.CharField(blank=True, max_length=20)),
+                ('phone_suffix_key', models.CharField(blank=True, help_text='phone_key reversed', max_length=20)),
+                ('national_id_key', models.CharField(blank=True, max_length=20)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mrn_key'], name='patientlookup_mrn_idx', opclasses=['varchar_pattern_ops']), models.Index(fields=['phone_key'], name='patientlookup_phone_idx', opclasses=['varchar_pattern_ops']), models.Index(fields=['phone_suffix_key'], name='patientlookup_phone_sfx_idx', opclasses=['varchar_pattern_ops']), models.Index(fields=['national_id_key'], name='patientlookup_natid_idx', opclasses=['varchar_pattern_ops'])],
+            },
+        ),
+        # Trigram indexes; other databases fall back to LIKE
+        migrations.RunPython(
+            run_vendor_sql(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_vendor_sql(SQLITE_REVERSE, POSTGRES_REVERSE),
+        ),
+    ]
@@ -0,0 +1,80 @@
+from django.db import migrations, models
+
+# The trigram index of migration 0009 was keyed on the implicit rowid of a
+# table whose primary key was the word itself; VACUUM may renumber such
+# rowids and leave the index pointing at other words. The vocabulary is
+# re-created with an integer primary key and the index keyed on it.
+SQLITE_DROP_OLD = [
+    'DROP TRIGGER IF EXISTS core_patientnameword_ad',
+    'DROP TRIGGER IF EXISTS core_patientnameword_ai',
+    'DROP TABLE IF EXISTS core_patientnameword_trgm',
+]
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE core_patientnameword_trgm USING fts5(
+        word, content='core_patientnameword', content_rowid='id',
+        tokenize='trigram', detail='none'
+    )""",
+    """CREATE TRIGGER core_patientnameword_ai AFTER INSERT ON core_patientnameword BEGIN
+        INSERT INTO core_patientnameword_trgm(rowid, word) VALUES (new.id, new.word);
+    END""",
+    """CREATE TRIGGER core_patientnameword_ad AFTER DELETE ON core_patientnameword BEGIN
+        INSERT INTO core_patientnameword_trgm(core_patientnameword_trgm, rowid, word)
+        VALUES ('delete', old.id, old.word);
+    END""",
+]
+SQLITE_RESTORE_OLD = [
+    """CREATE VIRTUAL TABLE core_patientnameword_trgm USING fts5(
+        word, content='core_patientnameword', content_rowid='rowid',
+        tokenize='trigram', detail='none'
+    )""",
+    """CREATE TRIGGER core_patientnameword_ai AFTER INSERT ON core_patientnameword BEGIN
+        INSERT INTO core_patientnameword_trgm(rowid, word) VALUES (new.rowid, new.word);
+    END""",
+    """CREATE TRIGGER core_patientnameword_ad AFTER DELETE ON core_patientnameword BEGIN
+        INSERT INTO core_patientnameword_trgm(core_patientnameword_trgm, rowid, word)
+        VALUES ('delete', old.rowid, old.word);
+    END""",
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+def fill_vocabulary(apps, schema_editor):
+    """Re-create the name words from the lookup rows (the triggers index them)"""
+    PatientLookup = apps.get_model('core', 'PatientLookup')
+    PatientNameWord = apps.get_model('core', 'PatientNameWord')
+    words = set()
+    for name_key in PatientLookup.objects.values_list('name_key', flat=True).iterator(chunk_size=5000):
+        words.update(word[:60] for word in name_key.split())
+    PatientNameWord.objects.bulk_create(
+        [PatientNameWord(word=word) for word in sorted(words)], batch_size=5000, ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_searchindexbacklog'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(SQLITE_DROP_OLD), run_sqlite(SQLITE_RESTORE_OLD)),
+        migrations.DeleteModel(
+            name='PatientNameWord',
+        ),
+        migrations.CreateModel(
+            name='PatientNameWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=60, unique=True)),
+            ],
+        ),
+        migrations.RunPython(run_sqlite(SQLITE_FORWARD), run_sqlite(SQLITE_DROP_OLD)),
+        migrations.RunPython(fill_vocabulary, migrations.RunPython.noop),
+    ]
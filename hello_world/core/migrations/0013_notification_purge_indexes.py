@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_searchindexbuild'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['expires_at'], name='core_notifi_expires_084cc5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['is_read', 'read_at'], name='core_notifi_is_read_06c8e1_idx'),
+        ),
+    ]
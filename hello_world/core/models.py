@@ -3,6 +3,18 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 
+
+def build_role_permission_sets(role_permissions, permission_groups):
+    """Flatten role -> permission groups -> permissions into frozensets"""
+    return {
+        role: frozenset(
+            perm
+            for group in groups
+            for perm in permission_groups.get(group, [])
+        )
+        for role, groups in role_permissions.items()
+    }
+
 # System Administration Models
 class Department(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -126,6 +138,12 @@ class UserProfile(models.Model):
         'guest': ['reporting_analytics'],  # Basic read-only access
     }
 
+    # Precomputed lookup tables, built once at import
+    ROLE_PERMISSION_SETS = build_role_permission_sets(ROLE_PERMISSIONS, PERMISSION_GROUPS)
+    MODULE_PERMISSION_SETS = {
+        module: frozenset(perms) for module, perms in PERMISSION_GROUPS.items()
+    }
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True)
 
@@ -240,43 +258,74 @@ class UserProfile(models.Model):
 
     @property
     def is_active(self):
-        return self.user.is_active and not self.account_locked
+        return self.user.is_active and not self.is_locked
 
     @property
     def has_expired_lockout(self):
-        if self.lockout_until and timezone.now() > self.lockout_until:
-            self.account_locked = False
-            self.lockout_until = None
-            self.login_attempts = 0
-            self.save()
-            return True
-        return False
+        """True when a lockout was set and its window has passed (read-only)"""
+        return bool(self.lockout_until and timezone.now() > self.lockout_until)
+
+    @property
+    def is_locked(self):
+        """Locked out right now; an expired lockout no longer counts"""
+        return self.account_locked and not self.has_expired_lockout
+
+    def clear_expired_lockout(self, commit=True):
+        """Reset an expired lockout. Returns True if anything changed."""
+        if not self.has_expired_lockout:
+            return False
+        self.account_locked = False
+        self.lockout_until = None
+        self.login_attempts = 0
+        if commit:
+            self.save(update_fields=['account_locked', 'lockout_until', 'login_attempts'])
+        return True
 
     def get_all_permissions(self):
         """Get all permissions for this user (role-based + custom)"""
-        permissions = set()
+        # The cache is keyed on the current role and custom_permissions object,
+        # so reassigning either field invalidates it; save() and
+        # refresh_from_db() clear it to cover in-place edits of the JSON dict.
+        cached = self.__dict__.get('_permission_cache')
+        if cached and cached[0] == self.role and cached[1] is self.custom_permissions:
+            return cached[2]
 
-        # Add role-based permissions
-        role_permission_groups = self.ROLE_PERMISSIONS.get(self.role, [])
-        for group in role_permission_groups:
-            group_permissions = self.PERMISSION_GROUPS.get(group, [])
-            permissions.update(group_permissions)
+        permissions = self.ROLE_PERMISSION_SETS.get(self.role, frozenset())
 
         # Add custom permissions
         if self.custom_permissions:
+            extra = set()
             for perm_list in self.custom_permissions.values():
-                permissions.update(perm_list)
+                extra.update(perm_list)
+            permissions = permissions | extra
 
+        self._permission_cache = (self.role, self.custom_permissions, permissions)
         return permissions
 
+    def invalidate_permission_cache(self):
+        """Drop the memoized permission set"""
+        self.__dict__.pop('_permission_cache', None)
+
+    def save(self, *args, **kwargs):
+        self.invalidate_permission_cache()
+        super().save(*args, **kwargs)
+
+    def refresh_from_db(self, *args, **kwargs):
+        self.invalidate_permission_cache()
+        super().refresh_from_db(*args, **kwargs)
+
     def has_permission(self, permission):
         """Check if user has specific permission"""
         return permission in self.get_all_permissions()
 
+    def has_any_permission(self, permissions):
+        """Check if user has at least one of the given permissions"""
+        return not self.get_all_permissions().isdisjoint(permissions)
+
     def can_access_module(self, module_name):
         """Check if user can access a specific module"""
-        module_permissions = self.PERMISSION_GROUPS.get(module_name, [])
-        return any(perm in self.get_all_permissions() for perm in module_permissions)
+        module_permissions = self.MODULE_PERMISSION_SETS.get(module_name, frozenset())
+        return self.has_any_permission(module_permissions)
 
     def record_login_attempt(self, success=False, ip_address=None):
         """Record login attempt and handle account locking"""
@@ -295,14 +344,15 @@ class UserProfile(models.Model):
 
     def get_dashboard_permissions(self):
         """Get permissions relevant to dashboard access"""
+        permissions = self.get_all_permissions()
         return {
-            'can_view_patients': self.has_permission('view_patient'),
-            'can_manage_appointments': self.has_permission('view_appointment'),
-            'can_access_wound_care': self.has_permission('view_wound_case'),
-            'can_manage_billing': self.has_permission('view_invoice'),
-            'can_view_reports': self.has_permission('view_basic_reports'),
-            'can_admin_system': self.has_permission('manage_users'),
-            'can_backup_system': self.has_permission('backup_system'),
+            'can_view_patients': 'view_patient' in permissions,
+            'can_manage_appointments': 'view_appointment' in permissions,
+            'can_access_wound_care': 'view_wound_case' in permissions,
+            'can_manage_billing': 'view_invoice' in permissions,
+            'can_view_reports': 'view_basic_reports' in permissions,
+            'can_admin_system': 'manage_users' in permissions,
+            'can_backup_system': 'backup_system' in permissions,
         }
 
 # Patient Register Models
@@ -1118,6 +1168,9 @@ class Notification(models.Model):
             models.Index(fields=['recipient', '-created_at']),
             models.Index(fields=['is_read', 'recipient']),
             models.Index(fields=['notification_type']),
+            # Used by purge_notifications
+            models.Index(fields=['expires_at']),
+            models.Index(fields=['is_read', 'read_at']),
         ]
 
     def __str__(self):
@@ -1126,9 +1179,11 @@ class Notification(models.Model):
     def mark_as_read(self):
         """Mark notification as read"""
         if not self.is_read:
+            from .services import NotificationService
             self.is_read = True
             self.read_at = timezone.now()
             self.save(update_fields=['is_read', 'read_at'])
+            NotificationService.adjust_unread_count([self.recipient_id], -1)
 
     def is_expired(self):
         """Check if notification has expired"""
@@ -1150,6 +1205,201 @@ class Notification(models.Model):
             return "Just now"
 
 
+class RoleBroadcast(models.Model):
+    """
+    A notification addressed to everyone holding a role.
+
+    One row per role per broadcast acts as the delivery ledger: nothing is
+    written per recipient at send time. Recipients are users with the role
+    who joined before the broadcast; read state is kept sparsely in
+    RoleBroadcastRead as users open them.
+    """
+    role = models.CharField(max_length=50, choices=UserProfile.ROLE_CHOICES)
+    sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='sent_broadcasts')
+
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES, default='system')
+    priority = models.CharField(max_length=10, choices=Notification.PRIORITY_LEVELS, default='medium')
+
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(blank=True, null=True)
+
+    related_patient = models.ForeignKey('Patient', on_delete=models.SET_NULL, null=True, blank=True)
+    related_appointment = models.ForeignKey('Appointment', on_delete=models.SET_NULL, null=True, blank=True)
+    related_wound = models.ForeignKey('WoundCare', on_delete=models.SET_NULL, null=True, blank=True)
+
+    action_url = models.URLField(blank=True)
+    action_text = models.CharField(max_length=50, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['role', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.get_role_display()}"
+
+    @property
+    def group_name(self):
+        return f'role_{self.role}'
+
+
+class RoleBroadcastRead(models.Model):
+    """Marks a role broadcast as read by one user"""
+    broadcast = models.ForeignKey(RoleBroadcast, on_delete=models.CASCADE, related_name='reads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='broadcast_reads')
+    read_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ['broadcast', 'user']
+
+    def __str__(self):
+        return f"{self.user.username} read {self.broadcast_id}"
+
+
+class NotificationOutbox(models.Model):
+    """
+    Durable queue of pending WebSocket pushes, drained by the dispatcher in
+    core/dispatch.py. Delivered rows are deleted; rows that exhaust their
+    retries stay behind as dead letters.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('dead', 'Dead Letter'),
+    ]
+
+    group_name = models.CharField(max_length=200)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.group_name} ({self.get_status_display()}, {self.attempts} attempts)"
+
+
+class SearchIndexBacklog(models.Model):
+    """
+    Elasticsearch updates the search indexer (core/search_indexing.py) has
+    not applied yet: entries of failed bulk requests, retried with
+    backoff, and entries that did not fit its queue. Applied rows are
+    deleted; rows that exhaust their retries stay behind as dead letters.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('dead', 'Dead Letter'),
+    ]
+
+    kind = models.CharField(max_length=10)  # 'index' or 'related'
+    target = models.CharField(max_length=100)  # index alias or model label
+    object_id = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at']
+        unique_together = ['kind', 'target', 'object_id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.target} {self.object_id} ({self.get_status_display()}, {self.attempts} attempts)"
+
+
+class SearchEntry(models.Model):
+    """
+    One indexed text field of a searchable object, for the built-in search
+    backend (hello_world/core/search.py). Migration 0008 adds the full-text
+    index: an FTS5 table on SQLite, a tsvector column with a GIN index on
+    PostgreSQL.
+    """
+    index_name = models.CharField(max_length=30)
+    object_id = models.PositiveIntegerField()
+    field = models.CharField(max_length=50)
+    text = models.TextField()
+
+    class Meta:
+        unique_together = ['index_name', 'object_id', 'field']
+        verbose_name_plural = 'Search entries'
+
+    def __str__(self):
+        return f"{self.index_name}:{self.object_id}.{self.field}"
+
+
+class SearchIndexBuild(models.Model):
+    """
+    Build state of a derived search index: a built-in search index by
+    name, or 'patient_lookup'. built_at is set when a full rebuild
+    finishes; save signals write entries before that, so having entries
+    does not mean the index is built. A rebuild claims the row with a
+    lease (claim_token, lease_until) so only one process builds at a time.
+    """
+    name = models.CharField(max_length=30, unique=True)
+    built_at = models.DateTimeField(null=True, blank=True)
+    claim_token = models.CharField(max_length=32, blank=True)
+    lease_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({'built' if self.built_at else 'not built'})"
+
+
+class PatientLookup(models.Model):
+    """
+    Normalized lookup keys of a patient for front-desk search
+    (hello_world/core/patient_lookup.py). Migration 0009 adds a trigram
+    index over name_key: FTS5 on SQLite, pg_trgm GIN on PostgreSQL.
+    """
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='lookup')
+    name_key = models.CharField(max_length=160)
+    mrn_key = models.CharField(max_length=20)
+    phone_key = models.CharField(max_length=20, blank=True)
+    phone_suffix_key = models.CharField(max_length=20, blank=True, help_text="phone_key reversed")
+    national_id_key = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        # Pattern opclasses (PostgreSQL only) let startswith use the index
+        indexes = [
+            models.Index(fields=['mrn_key'], name='patientlookup_mrn_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['phone_key'], name='patientlookup_phone_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['phone_suffix_key'], name='patientlookup_phone_sfx_idx',
+                         opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['national_id_key'], name='patientlookup_natid_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f"Lookup keys for patient {self.patient_id}"
+
+
+class PatientNameWord(models.Model):
+    """
+    Distinct words of patient names, the vocabulary misspelt lookup words
+    are corrected against. Migration 0011 keys its trigram index on the
+    integer id; an implicit SQLite rowid can change on VACUUM.
+    """
+    word = models.CharField(max_length=60, unique=True)
+
+    def __str__(self):
+        return self.word
+
+
 class InsuranceClaim(models.Model):
     """Track insurance claims for wound care services"""
     CLAIM_STATUS = [
@@ -0,0 +1,408 @@
+"""
+Patient lookup for the front desk: MRN and national ID prefixes, phone
+numbers by prefix or suffix, and partial, misspelled names.
+
+Each patient has a PatientLookup row of normalized keys, kept current by
+a post_save signal and rebuilt with ``manage.py rebuild_patient_lookup``
+(run with ``--if-empty`` on deploy; until a rebuild has finished, lookups
+use plain substring matches on Patient):
+
+- identifiers upper-cased with separators removed, matched by prefix on
+  a b-tree index;
+- phone numbers as digits in international form (PHONE_COUNTRY_CODE
+  replaces a leading 0), indexed forwards for prefixes and reversed for
+  suffixes;
+- the name lower-cased without accents, under a trigram index.
+
+Names are looked up in two tiers. Rows containing every trigram of every
+query word (a substring match) come first. If that finds too few, each
+query word is corrected against the vocabulary of name words
+(PatientNameWord): words sharing its trigrams, or, for short words whose
+trigrams a single transposition destroys, words with the same initial
+and a similar length, are kept when within MAX_EDITS edits or
+MIN_SIMILARITY. Rows containing any correction of every word are added. On PostgreSQL, pg_trgm's word similarity over
+name_key provides both tiers. All candidates are re-ranked in Python by
+how well each query word matches a name word: exact, prefix, substring,
+then trigram similarity or edit distance, whichever is closer. Corrected matches below
+MIN_SIMILARITY are dropped.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.functions import Length
+
+from .models import Patient, PatientLookup, PatientNameWord
+from .search import is_built
+
+DEFAULT_OPTIONS = {
+    'PHONE_COUNTRY_CODE': '254',
+    'MIN_SIMILARITY': 0.3,
+    'MAX_RESULTS': 50,
+    'CANDIDATES': 200,
+    'CORRECTIONS': 3,
+    'MAX_EDITS': 2,
+}
+
+# SearchIndexBuild name of the lookup keys
+BUILD_NAME = 'patient_lookup'
+
+# Set once lookup keys are known to be built, per process
+_keys_ready = False
+
+NON_ALNUM_RE = re.compile(r'[^0-9a-z]+')
+NON_IDENT_RE = re.compile(r'[^0-9A-Z]+')
+NON_DIGIT_RE = re.compile(r'\D+')
+
+
+def lookup_options():
+    return {**DEFAULT_OPTIONS, **getattr(settings, 'PATIENT_LOOKUP', {})}
+
+
+# Normalization
+
+def normalize_name(*parts):
+    """'Wanjirũ  O'Brien' -> 'wanjiru o brien'"""
+    text = unicodedata.normalize('NFKD', ' '.join(part for part in parts if part))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return NON_ALNUM_RE.sub(' ', text).strip()
+
+
+def normalize_identifier(value):
+    """'mrn-00 12' -> 'MRN0012'"""
+    return NON_IDENT_RE.sub('', (value or '').upper())
+
+
+def normalize_phone(value, country_code=None):
+    """'0712 345 678' -> '254712345678'; digits only, international form"""
+    digits = NON_DIGIT_RE.sub('', value or '')
+    country_code = lookup_options()['PHONE_COUNTRY_CODE'] if country_code is None else country_code
+    if country_code and digits.startswith('0') and not digits.startswith('00'):
+        digits = country_code + digits[1:]
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    return digits
+
+
+def lookup_keys(patient, country_code=None):
+    """Field values of the PatientLookup row for ``patient``"""
+    phone = normalize_phone(patient.phone, country_code)[:20]
+    return {
+        'name_key': normalize_name(patient.first_name, patient.middle_name, patient.last_name)[:160],
+        'mrn_key': normalize_identifier(patient.medical_record_number)[:20],
+        'phone_key': phone,
+        'phone_suffix_key': phone[::-1],
+        'national_id_key': normalize_identifier(patient.national_id)[:20],
+    }
+
+
+# Scoring
+
+def word_trigrams(word):
+    """pg_trgm-style trigrams: the word padded with two spaces before, one after"""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_similarity(a, b):
+    ta, tb = word_trigrams(a), word_trigrams(b)
+    return len(ta & tb) / len(ta | tb)
+
+
+def edit_distance(a, b):
+    """Levenshtein distance counting an adjacent transposition as one edit"""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def allowed_edits(word, max_edits):
+    """One edit for short words, up to ``max_edits`` for words of eight or more letters"""
+    return min(max_edits, 1 if len(word) < 8 else 2)
+
+
+def word_similarity(a, b):
+    similarity = trigram_similarity(a, b)
+    longest = max(len(a), len(b))
+    # The length difference bounds the edit distance from below
+    if 1 - abs(len(a) - len(b)) / longest <= similarity or a[0] != b[0]:
+        return similarity
+    return max(similarity, 1 - edit_distance(a, b) / longest)
+
+
+def name_score(query_words, name_key):
+    """Mean over query words of the best match against any name word, 0..1"""
+    name_words = name_key.split()
+    if not query_words or not name_words:
+        return 0.0
+    total = 0.0
+    for query_word in query_words:
+        best = 0.0
+        for name_word in name_words:
+            if name_word == query_word:
+                best = 1.0
+                break
+            if name_word.startswith(query_word):
+                score = 0.7 + 0.3 * len(query_word) / len(name_word)
+            elif query_word in name_word:
+                score = 0.5 + 0.3 * len(query_word) / len(name_word)
+            else:
+                score = 0.9 * word_similarity(query_word, name_word)
+            best = max(best, score)
+        total += best
+    return total / len(query_words)
+
+
+def _prefix_filter(field, prefix):
+    """Index-friendly prefix match: LIKE 'x%' with pattern ops, else a key range"""
+    if connection.vendor == 'postgresql':
+        return Q(**{f'{field}__startswith': prefix})
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': upper})
+
+
+def _fts_terms(word):
+    # Trigram tokenizer terms: every 3-character window of the word
+    return [f'"{word[i:i + 3]}"' for i in range(len(word) - 2)]
+
+
+def _fts_all(word):
+    return '(' + ' AND '.join(_fts_terms(word)) + ')'
+
+
+class PatientLookupService:
+    """Front-desk patient search over PatientLookup keys"""
+
+    # Maintenance
+
+    @staticmethod
+    def update(patient):
+        keys = lookup_keys(patient)
+        PatientLookup.objects.update_or_create(patient=patient, defaults=keys)
+        PatientNameWord.objects.bulk_create(
+            [PatientNameWord(word=word) for word in set(keys['name_key'].split())],
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def rebuild(batch_size=5000):
+        """Re-create every lookup row and the name vocabulary; returns the number of patients"""
+        country_code = lookup_options()['PHONE_COUNTRY_CODE']
+        PatientLookup.objects.all().delete()
+        PatientNameWord.objects.all().delete()
+        patients = Patient.objects.only(
+            'first_name', 'middle_name', 'last_name', 'phone', 'medical_record_number', 'national_id',
+        ).order_by('pk')
+        words = set()
+        count = 0
+        batch = []
+        for patient in patients.iterator(chunk_size=batch_size):
+            row = PatientLookup(patient_id=patient.pk, **lookup_keys(patient, country_code))
+            words.update(row.name_key.split())
+            batch.append(row)
+            count += 1
+            if len(batch) >= batch_size:
+                with transaction.atomic():
+                    PatientLookup.objects.bulk_create(batch)
+                batch = []
+        with transaction.atomic():
+            PatientLookup.objects.bulk_create(batch)
+            PatientNameWord.objects.bulk_create(
+                [PatientNameWord(word=word[:60]) for word in sorted(words)], batch_size=batch_size,
+            )
+        return count
+
+    # Lookup
+
+    @staticmethod
+    def lookup(query, limit=10):
+        """
+        Ranked matches for ``query`` as dicts: id, name, medical_record_number,
+        phone, national_id, date_of_birth, score (0..1) and matched (the
+        key that matched best).
+        """
+        options = lookup_options()
+        limit = max(1, min(limit, options['MAX_RESULTS']))
+        query = (query or '').strip()
+        if len(query) < 2:
+            return []
+
+        scores = {}
+
+        def add(patient_id, score, matched):
+            if score > scores.get(patient_id, (0.0, ''))[0]:
+                scores[patient_id] = (score, matched)
+
+        if not PatientLookupService.is_ready():
+            # Keys not built yet (rebuild_patient_lookup --if-empty runs on deploy)
+            for patient_id in PatientLookupService._unindexed_ids(query, limit):
+                add(patient_id, 0.5, 'unindexed')
+        else:
+            identifier = normalize_identifier(query)
+            if len(identifier) >= 2 and any(char.isdigit() for char in identifier):
+                for field, matched in (('mrn_key', 'medical_record_number'), ('national_id_key', 'national_id')):
+                    for patient_id, key in PatientLookupService._by_prefix(field, identifier, limit):
+                        add(patient_id, 1.0 if key == identifier else 0.8 + 0.2 * len(identifier) / len(key), matched)
+
+            digits = NON_DIGIT_RE.sub('', query)
+            if len(digits) >= 3 and not any(char.isalpha() for char in query):
+                phone = normalize_phone(digits, options['PHONE_COUNTRY_CODE'])
+                for patient_id, key in PatientLookupService._by_prefix('phone_key', phone, limit):
+                    add(patient_id, 1.0 if key == phone else 0.6 + 0.4 * len(phone) / len(key), 'phone')
+                for patient_id, key in PatientLookupService._by_prefix('phone_suffix_key', digits[::-1], limit):
+                    add(patient_id, 0.6 + 0.4 * len(digits) / len(key), 'phone')
+
+            # Name words never contain digits; short words only help re-ranking
+            words = [word for word in normalize_name(query).split() if not any(char.isdigit() for char in word)]
+            if any(len(word) >= 3 for word in words):
+                for patient_id, score in PatientLookupService._by_name(words, limit, options):
+                    add(patient_id, score, 'name')
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        patients = Patient.objects.only(
+            'first_name', 'middle_name', 'last_name', 'phone', 'medical_record_number',
+            'national_id', 'date_of_birth',
+        ).in_bulk([patient_id for patient_id, _ in ranked])
+        results = []
+        for patient_id, (score, matched) in ranked:
+            patient = patients.get(patient_id)
+            if patient is None:
+                continue
+            results.append({
+                'id': patient.pk,
+                'name': patient.full_name,
+                'medical_record_number': patient.medical_record_number,
+                'phone': patient.phone,
+                'national_id': patient.national_id,
+                'date_of_birth': patient.date_of_birth.isoformat() if patient.date_of_birth else None,
+                'score': round(score, 3),
+                'matched': matched,
+            })
+        return results
+
+    @staticmethod
+    def search_patients(query, limit=20):
+        """Patients for ``query`` in lookup rank order"""
+        ids = [result['id'] for result in PatientLookupService.lookup(query, limit=limit)]
+        patients = Patient.objects.in_bulk(ids)
+        return [patients[pk] for pk in ids if pk in patients]
+
+    @staticmethod
+    def is_ready():
+        """Whether a rebuild has finished; remembered once true, as the signal keeps the keys current"""
+        global _keys_ready
+        if not _keys_ready:
+            _keys_ready = is_built(BUILD_NAME) or not Patient.objects.exists()
+        return _keys_ready
+
+    @staticmethod
+    def _unindexed_ids(query, limit):
+        condition = Q()
+        for field in ('first_name', 'middle_name', 'last_name', 'medical_record_number', 'phone', 'national_id'):
+            condition |= Q(**{f'{field}__icontains': query})
+        return list(Patient.objects.filter(condition).order_by('pk').values_list('pk', flat=True)[:limit])
+
+    @staticmethod
+    def _by_prefix(field, prefix, limit):
+        if not prefix:
+            return []
+        return list(
+            PatientLookup.objects.filter(_prefix_filter(field, prefix))
+            .order_by(field).values_list('patient_id', field)[:limit]
+        )
+
+    @staticmethod
+    def _by_name(words, limit, options):
+        """(patient_id, score) for name matches, best first"""
+        candidates = options['CANDIDATES']
+        vendor = connection.vendor
+        if vendor == 'sqlite':
+            searchable = [word for word in words if len(word) >= 3]
+            ids = PatientLookupService._fts_ids(
+                'core_patientlookup_trgm', ' AND '.join(_fts_all(word) for word in searchable), candidates,
+            )
+            typo_ids = []
+            if len(ids) < limit:
+                corrected = []
+                for word in searchable:
+                    alternatives = [word] + PatientLookupService._corrections(word, options)
+                    corrected.append('(' + ' OR '.join(_fts_all(alt) for alt in dict.fromkeys(alternatives)) + ')')
+                typo_ids = PatientLookupService._fts_ids('core_patientlookup_trgm', ' AND '.join(corrected), candidates)
+        elif vendor == 'postgresql':
+            text = ' '.join(words)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT patient_id, name_key LIKE %s FROM core_patientlookup
+                    WHERE name_key LIKE %s OR %s <%% name_key
+                    ORDER BY word_similarity(%s, name_key) DESC LIMIT %s
+                    """,
+                    ['%' + '%'.join(words) + '%'] * 2 + [text, text, candidates],
+                )
+                rows = cursor.fetchall()
+            ids = [patient_id for patient_id, is_substring in rows if is_substring]
+            typo_ids = [patient_id for patient_id, is_substring in rows if not is_substring]
+        else:
+            lookups = PatientLookup.objects.filter(*[Q(name_key__contains=word) for word in words])
+            ids = list(lookups.values_list('patient_id', flat=True)[:candidates])
+            typo_ids = []
+
+        substring_ids = set(ids)
+        names = dict(
+            PatientLookup.objects.filter(pk__in=substring_ids | set(typo_ids)).values_list('patient_id', 'name_key')
+        )
+        scored = []
+        for patient_id, name_key in names.items():
+            score = name_score(words, name_key)
+            if patient_id in substring_ids or score >= options['MIN_SIMILARITY']:
+                scored.append((patient_id, score))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored
+
+    @staticmethod
+    def _corrections(word, options):
+        """Vocabulary words closest to a possibly misspelt ``word``"""
+        max_edits = allowed_edits(word, options['MAX_EDITS'])
+
+        def closest(candidates):
+            scored = []
+            for candidate in set(candidates) - {word}:
+                distance = edit_distance(word, candidate)
+                similarity = trigram_similarity(word, candidate)
+                if distance <= max_edits or similarity >= options['MIN_SIMILARITY']:
+                    scored.append((distance, -similarity, candidate))
+            return [candidate for _, _, candidate in sorted(scored)[:options['CORRECTIONS']]]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT word FROM core_patientnameword_trgm WHERE core_patientnameword_trgm MATCH %s '
+                'ORDER BY rank LIMIT %s',
+                [' OR '.join(_fts_terms(word)), options['CANDIDATES']],
+            )
+            corrections = closest(row[0] for row in cursor.fetchall())
+        if corrections and edit_distance(word, corrections[0]) <= max_edits:
+            return corrections
+        # A transposition in a short word leaves few or no shared trigrams
+        words = (
+            PatientNameWord.objects.filter(_prefix_filter('word', word[0]))
+            .annotate(length=Length('word'))
+            .filter(length__range=(len(word) - max_edits, len(word) + max_edits))
+            .values_list('word', flat=True)[:options['CANDIDATES'] * 20]
+        )
+        return closest([*corrections, *words])
+
+    @staticmethod
+    def _fts_ids(table, match, limit):
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {table} WHERE {table} MATCH %s LIMIT %s', [match, limit])
+            return [row[0] for row in cursor.fetchall()]
@@ -2,6 +2,9 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
+    # All feeds over one connection, subscribed by topic
+    re_path(r'ws/live/$', consumers.LiveFeedConsumer.as_asgi()),
+
     # User-specific notifications
     re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
 
@@ -0,0 +1,448 @@
+"""
+Built-in full-text search, used by global_search when Elasticsearch is
+not configured.
+
+Every indexed field of a patient, wound case, appointment or prescription
+is a SearchEntry row. Migration 0008 puts a full-text index over the rows:
+FTS5 on SQLite, a tsvector column with a GIN index on PostgreSQL; other
+databases fall back to LIKE. Entries are kept current by signals and
+rebuilt with ``manage.py rebuild_search_index``; the deploy scripts run it
+with ``--if-empty`` after migrating. Until a full rebuild of an index has
+finished (recorded in SearchIndexBuild), searching it raises
+SearchIndexNotReady and global_search answers from the database instead.
+
+The query interface mirrors the documents.py calls::
+
+    PatientIndex.search().query('multi_match', query=q, fields=[...])[:10].execute()
+
+Like Elasticsearch's default multi_match, any query word may match any
+listed field (``field^2`` boosts a field). Words are matched as prefixes,
+and words such as ``WC-2024`` are matched as phrases. An object scores its
+best field plus 0.3 of its other fields' scores. Hits are model instances
+in score order, carrying the same derived fields as the documents
+(``patient_name``, ``doctor_name``...) and ``meta.score``.
+"""
+import re
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .circuit_breaker import CircuitBreaker
+from .models import Appointment, Patient, Prescription, SearchEntry, SearchIndexBuild, WoundCare
+
+TIE_BREAKER = 0.3
+MAX_QUERY_WORDS = 8
+WORD_RE = re.compile(r'\w+')
+
+
+class SearchIndexNotReady(Exception):
+    """The index has not been built for the objects that already exist"""
+
+
+def _full_name(user):
+    return user.get_full_name() if user else ''
+
+
+# Names of indexes known to be built, per process
+_ready_indexes = set()
+
+
+# Build state
+
+def is_built(name):
+    """Whether a full rebuild of ``name`` has finished"""
+    return SearchIndexBuild.objects.filter(name=name, built_at__isnull=False).exists()
+
+
+def claim_build(name, lease_seconds, unbuilt_only=False):
+    """
+    Claim the rebuild of ``name`` for ``lease_seconds``; returns a token
+    for finish_build/release_build, or None when another process holds
+    the claim (or, with ``unbuilt_only``, the index is already built).
+
+    As in the notification dispatcher, the claim is a single UPDATE on the
+    build row, so processes starting together serialise on the database.
+    """
+    SearchIndexBuild.objects.get_or_create(name=name)
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    rows = SearchIndexBuild.objects.filter(name=name).filter(Q(lease_until__isnull=True) | Q(lease_until__lte=now))
+    if unbuilt_only:
+        rows = rows.filter(built_at__isnull=True)
+    # Not built while its entries are being replaced
+    claimed = rows.update(claim_token=token, lease_until=now + timedelta(seconds=lease_seconds), built_at=None)
+    return token if claimed else None
+
+
+def finish_build(name, token):
+    """Record a finished rebuild and release its claim"""
+    SearchIndexBuild.objects.filter(name=name, claim_token=token).update(
+        built_at=timezone.now(), claim_token='', lease_until=None,
+    )
+
+
+def release_build(name, token):
+    """Release the claim of a rebuild that did not finish"""
+    SearchIndexBuild.objects.filter(name=name, claim_token=token).update(claim_token='', lease_until=None)
+
+
+class SearchIndex:
+    """Declares how one model is indexed; subclasses mirror documents.py"""
+    name = None
+    model = None
+    fields = []
+    select_related = ()
+
+    @classmethod
+    def get_queryset(cls):
+        return cls.model.objects.select_related(*cls.select_related)
+
+    @classmethod
+    def prepare(cls, instance):
+        """Derived fields, the ``prepare_<field>`` methods of a Document"""
+        return {}
+
+    @classmethod
+    def document(cls, instance):
+        """Field name -> indexed text for one instance; empty fields are left out"""
+        values = {field: getattr(instance, field) for field in cls.fields}
+        values.update(cls.prepare(instance))
+        return {field: str(value) for field, value in values.items() if value not in (None, '')}
+
+    @classmethod
+    def search(cls):
+        return LocalSearch(cls)
+
+    @classmethod
+    def is_ready(cls):
+        """Whether a rebuild has finished; remembered once true, as signals keep the index filled"""
+        if cls.name not in _ready_indexes:
+            if is_built(cls.name) or not cls.model.objects.exists():
+                _ready_indexes.add(cls.name)
+        return cls.name in _ready_indexes
+
+    # Maintenance
+
+    @classmethod
+    def update(cls, instance):
+        """Write the entries of one instance, touching only changed fields"""
+        if cls.select_related:
+            # One joined query instead of a query per related name
+            instance = cls.get_queryset().get(pk=instance.pk)
+        document = cls.document(instance)
+        existing = {
+            field: (pk, text) for field, pk, text in SearchEntry.objects.filter(
+                index_name=cls.name, object_id=instance.pk,
+            ).values_list('field', 'pk', 'text')
+        }
+        stale = [pk for field, (pk, _) in existing.items() if field not in document]
+        changed = [
+            SearchEntry(pk=existing[field][0], text=text)
+            for field, text in document.items() if field in existing and existing[field][1] != text
+        ]
+        new = [
+            SearchEntry(index_name=cls.name, object_id=instance.pk, field=field, text=text)
+            for field, text in document.items() if field not in existing
+        ]
+        if stale:
+            SearchEntry.objects.filter(pk__in=stale).delete()
+        if changed:
+            SearchEntry.objects.bulk_update(changed, ['text'])
+        if new:
+            SearchEntry.objects.bulk_create(new)
+
+    @classmethod
+    def remove(cls, object_id):
+        SearchEntry.objects.filter(index_name=cls.name, object_id=object_id).delete()
+
+    @classmethod
+    def rebuild(cls, batch_size=2000):
+        """Re-index every object in batches; returns the number indexed"""
+        SearchEntry.objects.filter(index_name=cls.name).delete()
+        count = 0
+        batch = []
+        for instance in cls.get_queryset().order_by('pk').iterator(chunk_size=batch_size):
+            batch.extend(
+                SearchEntry(index_name=cls.name, object_id=instance.pk, field=field, text=text)
+                for field, text in cls.document(instance).items()
+            )
+            count += 1
+            if count % batch_size == 0:
+                with transaction.atomic():
+                    SearchEntry.objects.bulk_create(batch, batch_size=1000)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                SearchEntry.objects.bulk_create(batch, batch_size=1000)
+        return count
+
+
+class PatientIndex(SearchIndex):
+    name = 'patients'
+    model = Patient
+    fields = [
+        'first_name', 'last_name', 'middle_name', 'phone', 'email',
+        'address', 'medical_record_number', 'national_id',
+    ]
+
+
+class WoundCareIndex(SearchIndex):
+    name = 'wound_cases'
+    model = WoundCare
+    fields = ['wound_id', 'appearance', 'clinical_notes', 'treatment_plan', 'status']
+    select_related = ('patient', 'wound_type', 'body_part')
+
+    @classmethod
+    def prepare(cls, instance):
+        return {
+            'patient_name': instance.patient.full_name,
+            'wound_type_name': instance.wound_type.name if instance.wound_type else '',
+            'body_part_name': instance.body_part.name if instance.body_part else '',
+        }
+
+
+class AppointmentIndex(SearchIndex):
+    name = 'appointments'
+    model = Appointment
+    fields = ['status', 'appointment_type', 'notes']
+    select_related = ('patient', 'doctor', 'clinic')
+
+    @classmethod
+    def prepare(cls, instance):
+        return {
+            'patient_name': instance.patient.full_name,
+            'doctor_name': _full_name(instance.doctor),
+            'clinic_name': instance.clinic.name,
+        }
+
+
+class PrescriptionIndex(SearchIndex):
+    name = 'prescriptions'
+    model = Prescription
+    fields = ['diagnosis', 'instructions']
+    select_related = ('patient', 'doctor')
+
+    @classmethod
+    def prepare(cls, instance):
+        return {
+            'patient_name': instance.patient.full_name,
+            'doctor_name': _full_name(instance.doctor),
+        }
+
+
+SEARCH_INDEXES = {index.name: index for index in (PatientIndex, WoundCareIndex, AppointmentIndex, PrescriptionIndex)}
+INDEX_FOR_MODEL = {index.model: index for index in SEARCH_INDEXES.values()}
+
+
+def get_search_document(index_name):
+    """
+    The class global_search queries for ``index_name``: the Elasticsearch
+    document when SEARCH_BACKEND is 'elasticsearch', else the local index.
+    Both answer ``.search().query('multi_match', ...)[:n].execute()``.
+    """
+    if settings.SEARCH_BACKEND == 'elasticsearch':
+        from . import documents
+        return {
+            'patients': documents.PatientDocument,
+            'wound_cases': documents.WoundCareDocument,
+            'appointments': documents.AppointmentDocument,
+            'prescriptions': documents.PrescriptionDocument,
+        }[index_name]
+    return SEARCH_INDEXES[index_name]
+
+
+def elasticsearch_client(request_timeout):
+    """The default Elasticsearch connection with a per-request timeout in seconds"""
+    from elasticsearch_dsl.connections import connections
+    return connections.get_connection().options(request_timeout=request_timeout)
+
+
+def _elasticsearch_healthy(timeout):
+    health = elasticsearch_client(timeout).cluster.health()
+    return health['status'] != 'red'
+
+
+# Shared by all workers; see circuit_breaker.py
+search_breaker = CircuitBreaker(
+    'elasticsearch',
+    probe=_elasticsearch_healthy,
+    options=lambda: getattr(settings, 'SEARCH_CIRCUIT_BREAKER', {}),
+)
+
+
+def search_backend_available():
+    """False while the Elasticsearch circuit is open; the local index is always available"""
+    return settings.SEARCH_BACKEND != 'elasticsearch' or search_breaker.allow()
+
+
+def record_search_backend_result(error=None):
+    if settings.SEARCH_BACKEND != 'elasticsearch':
+        return
+    if error is None:
+        search_breaker.record_success()
+    else:
+        search_breaker.record_failure(error)
+
+
+def update_related_patient_names(patient):
+    """Refresh ``patient_name`` of the patient's wounds, appointments and prescriptions"""
+    for index in (WoundCareIndex, AppointmentIndex, PrescriptionIndex):
+        SearchEntry.objects.filter(
+            index_name=index.name, field='patient_name',
+            object_id__in=index.model.objects.filter(patient=patient).values('pk'),
+        ).exclude(text=patient.full_name).update(text=patient.full_name)
+
+
+# Querying
+
+def query_phrases(text):
+    """Split a query into word phrases: ``WC-2024 ulcer`` -> [['wc', '2024'], ['ulcer']]"""
+    phrases = []
+    for word in text.lower().split()[:MAX_QUERY_WORDS]:
+        tokens = WORD_RE.findall(word)
+        if tokens:
+            phrases.append(tokens)
+    return phrases
+
+
+class LocalSearch:
+    """The subset of elasticsearch_dsl.Search that global_search uses"""
+
+    def __init__(self, index, text='', fields=None, start=0, stop=10):
+        self.index = index
+        self.text = text
+        self.fields = fields
+        self.start = start
+        self.stop = stop
+
+    def _clone(self, **changes):
+        options = {'text': self.text, 'fields': self.fields, 'start': self.start, 'stop': self.stop}
+        options.update(changes)
+        return LocalSearch(self.index, **options)
+
+    def query(self, query_type, query='', fields=None, **kwargs):
+        if query_type != 'multi_match':
+            raise ValueError(f"Local search supports only 'multi_match' queries, not {query_type!r}")
+        return self._clone(text=query, fields=fields)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('Local search results can only be sliced')
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else start + 10
+        return self._clone(start=start, stop=stop)
+
+    def _boosts(self):
+        """Requested field -> boost; ``name^2`` doubles a field's score"""
+        boosts = {}
+        for spec in self.fields or self.index.fields:
+            field, _, boost = spec.partition('^')
+            boosts[field] = float(boost) if boost else 1.0
+        return boosts
+
+    def execute(self):
+        phrases = query_phrases(self.text)
+        if not phrases or self.stop <= self.start:
+            return SearchResponse([])
+        if not self.index.is_ready():
+            raise SearchIndexNotReady(f'Search index {self.index.name!r} has not been built')
+        boosts = self._boosts()
+        vendor = connection.vendor
+        if vendor == 'sqlite':
+            scores = self._scores_sql(_sqlite_sql, _sqlite_match(phrases), boosts)
+        elif vendor == 'postgresql':
+            scores = self._scores_sql(_postgres_sql, _postgres_tsquery(phrases), boosts)
+        else:
+            scores = self._scores_like(phrases, boosts)
+
+        objects = self.index.get_queryset().in_bulk([object_id for object_id, _ in scores])
+        hits = []
+        for object_id, score in scores:
+            instance = objects.get(object_id)
+            if instance is None:
+                continue  # entry outlived its object; the next rebuild drops it
+            for field, value in self.index.prepare(instance).items():
+                setattr(instance, field, value)
+            instance.meta = SimpleNamespace(id=object_id, index=self.index.name, score=score)
+            hits.append(instance)
+        return SearchResponse(hits)
+
+    def _scores_sql(self, build_sql, match, boosts):
+        fields = list(boosts)
+        boost_case = 'CASE field ' + ' '.join('WHEN %s THEN %s' for _ in fields) + ' ELSE 1.0 END'
+        boost_params = [value for field in fields for value in (field, boosts[field])]
+        sql = build_sql(boost_case, ', '.join(['%s'] * len(fields)))
+        params = [match, self.index.name, *fields, TIE_BREAKER, *boost_params, *boost_params,
+                  self.stop - self.start, self.start]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(object_id, float(score)) for object_id, score in cursor.fetchall()]
+
+    def _scores_like(self, phrases, boosts):
+        condition = Q()
+        for tokens in phrases:
+            condition |= Q(text__icontains=' '.join(tokens))
+        rows = (
+            SearchEntry.objects.filter(condition, index_name=self.index.name, field__in=list(boosts))
+            .values('object_id').annotate(score=Count('pk')).order_by('-score', 'object_id')
+        )[self.start:self.stop]
+        return [(row['object_id'], float(row['score'])) for row in rows]
+
+
+def _sqlite_match(phrases):
+    # "wc 2024"* OR "ulcer"*: each word a prefix phrase
+    return ' OR '.join('"{}"*'.format(' '.join(tokens)) for tokens in phrases)
+
+
+def _sqlite_sql(boost_case, field_placeholders):
+    # bm25() cannot sit inside an aggregate, so matches are materialized
+    # first; it is lower for better matches and is negated into a score.
+    # CROSS JOIN keeps the FTS lookup as the outer loop.
+    return f"""
+        WITH matches AS MATERIALIZED (
+            SELECT e.object_id AS object_id, e.field AS field, -bm25(core_searchentry_fts) AS rank
+            FROM core_searchentry_fts
+            CROSS JOIN core_searchentry e ON e.id = core_searchentry_fts.rowid
+            WHERE core_searchentry_fts MATCH %s AND e.index_name = %s AND e.field IN ({field_placeholders})
+        )
+        SELECT object_id, best + %s * (total - best) AS score FROM (
+            SELECT object_id, MAX(rank * {boost_case}) AS best, SUM(rank * {boost_case}) AS total
+            FROM matches GROUP BY object_id
+        ) ORDER BY score DESC, object_id LIMIT %s OFFSET %s
+    """
+
+
+def _postgres_tsquery(phrases):
+    # (wc <-> 2024:*) | (ulcer:*)
+    return ' | '.join('({}:*)'.format(' <-> '.join(tokens)) for tokens in phrases)
+
+
+def _postgres_sql(boost_case, field_placeholders):
+    return f"""
+        WITH matches AS (
+            SELECT e.object_id AS object_id, e.field AS field, ts_rank(e.search_vector, q.query) AS rank
+            FROM core_searchentry e, to_tsquery('simple', %s) AS q(query)
+            WHERE e.search_vector @@ q.query AND e.index_name = %s AND e.field IN ({field_placeholders})
+        )
+        SELECT object_id, best + %s * (total - best) AS score FROM (
+            SELECT object_id, MAX(rank * {boost_case}) AS best, SUM(rank * {boost_case}) AS total
+            FROM matches GROUP BY object_id
+        ) ranked ORDER BY score DESC, object_id LIMIT %s OFFSET %s
+    """
+
+
+class SearchResponse(list):
+    """Hits in score order; ``hits`` and ``total`` as on an Elasticsearch response"""
+
+    @property
+    def hits(self):
+        return self
+
+    @property
+    def total(self):
+        return len(self)
@@ -0,0 +1,471 @@
+"""
+Queued Elasticsearch indexing for the documents in documents.py.
+
+django_elasticsearch_dsl's default signal processor re-indexes every
+saved instance, and the instances of documents that list its model in
+``related_models``, synchronously inside the request, one HTTP call per
+document. QueuedSignalProcessor (ELASTICSEARCH_DSL_SIGNAL_PROCESSOR)
+replaces that with dirty ids:
+
+- saves and deletes mark (document, id) pairs. Documents that list the
+  saved model in ``related_models`` are resolved by the worker, through
+  ``get_instances_from_related`` when the document defines it,
+  otherwise through the foreign key from the document's model (before a
+  delete they are resolved in the request, while the row still exists);
+- the ids are handed over with transaction.on_commit, so a request
+  that saves a patient and ten wounds, or rolls back, costs nothing
+  until it commits;
+- a worker thread collects ids for WINDOW seconds, loads each document's
+  rows with its ``get_queryset()`` in batches of BATCH_SIZE and sends
+  one bulk request per batch. Ids whose row is gone become deletes;
+- entries of a failed bulk request, or failed items within one, are
+  written to the SearchIndexBacklog table and retried with exponential
+  backoff until MAX_ATTEMPTS, after which they stay there as dead
+  letters (visible in the admin). When the in-memory queue is full,
+  entries go straight to that table. The worker sweeps it for due rows
+  every POLL_INTERVAL seconds, as the notification dispatcher sweeps its
+  outbox.
+
+While ``manage.py rebuild_elasticsearch_index`` builds a new index behind
+an alias, the worker writes to the new index as well (see
+``set_extra_target``), so the swap loses no updates.
+"""
+import functools
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'WINDOW': 0.5,
+    'BATCH_SIZE': 500,
+    'QUEUE_SIZE': 10000,
+    'MAX_ATTEMPTS': 8,
+    'BACKOFF_BASE': 2,
+    'BACKOFF_MAX': 600,
+    'POLL_INTERVAL': 5,
+    'LEASE_SECONDS': 120,
+}
+
+EXTRA_TARGET_KEY = 'search-indexing:extra-target:{}'
+EXTRA_TARGET_TIMEOUT = 24 * 3600
+
+
+def set_extra_target(alias, index_name):
+    """Also write updates for ``alias`` to ``index_name`` (None to stop)"""
+    cache = caches['shared']
+    if index_name is None:
+        cache.delete(EXTRA_TARGET_KEY.format(alias))
+    else:
+        cache.set(EXTRA_TARGET_KEY.format(alias), index_name, EXTRA_TARGET_TIMEOUT)
+
+
+def _related_ids(document, instance):
+    """Ids of ``document``'s model affected by a change to a related ``instance``"""
+    if 'get_instances_from_related' in vars(document):
+        related = document().get_instances_from_related(instance)
+        if related is None:
+            return []
+        if hasattr(related, '_meta'):
+            return [related.pk]
+        return [obj.pk for obj in related]
+    model = document.django.model
+    lookups = [
+        field.name for field in model._meta.concrete_fields
+        if field.is_relation and field.related_model is instance.__class__
+    ]
+    ids = []
+    for lookup in lookups:
+        ids += model.objects.filter(**{lookup: instance.pk}).values_list('pk', flat=True)
+    return ids
+
+
+def _backlog_key(entry):
+    """(kind, target, object_id) columns of a SearchIndexBacklog row for a queue entry"""
+    kind, target, pk = entry
+    label = target._index._name if kind == 'index' else target._meta.label
+    return kind, label, str(pk)
+
+
+def _backlog_entry(row):
+    """Queue entry for a SearchIndexBacklog row, or None if its document or model is gone"""
+    if row.kind == 'index':
+        from django_elasticsearch_dsl.registries import registry
+
+        target = next((d for d in registry.get_documents() if d._index._name == row.target), None)
+        model = target.django.model if target is not None else None
+    else:
+        try:
+            target = model = apps.get_model(row.target)
+        except LookupError:
+            return None
+    if target is None:
+        return None
+    return row.kind, target, model._meta.pk.to_python(row.object_id)
+
+
+def document_actions(document, objects, index_name=None, op_type='index'):
+    """
+    Bulk actions for model instances, into ``index_name`` or the document's
+    alias. 'create' actions leave documents that already exist alone.
+    """
+    doc = document()
+    index_name = index_name or document._index._name
+    should_index = getattr(doc, 'should_index_object', None)
+    for obj in objects:
+        if should_index is not None and not should_index(obj):
+            continue
+        yield {
+            '_op_type': op_type,
+            '_index': index_name,
+            '_id': doc.generate_id(obj),
+            '_source': doc.prepare(obj),
+        }
+
+
+class SearchIndexer:
+    """Collects dirty document ids and writes them to Elasticsearch in bulk"""
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'marked': 0, 'indexed': 0, 'deleted': 0, 'errors': 0,
+            'deferred': 0, 'retried': 0, 'dead': 0, 'dropped': 0,
+            'bulk_requests': 0, 'last_batch_size': 0, 'last_flush_ms': 0.0,
+        }
+
+    @property
+    def options(self):
+        return {**DEFAULT_OPTIONS, **getattr(settings, 'SEARCH_INDEXING', {})}
+
+    # Capture
+
+    def mark_saved(self, instance):
+        from django_elasticsearch_dsl.registries import registry
+
+        model = instance.__class__
+        entries = [
+            ('index', document, instance.pk) for document in registry.get_documents([model])
+            if not document.django.ignore_signals
+        ]
+        if any(model in document.django.related_models for document in registry.get_documents()):
+            entries.append(('related', model, instance.pk))
+        self._mark(entries)
+
+    def mark_deleted(self, instance):
+        from django_elasticsearch_dsl.registries import registry
+
+        self._mark([
+            ('index', document, instance.pk) for document in registry.get_documents([instance.__class__])
+            if not document.django.ignore_signals
+        ])
+
+    def mark_related(self, instance):
+        """Before a delete: mark related documents while the relations still exist"""
+        self._mark([('index', document, pk) for document, pk in self._related_pairs(instance)])
+
+    @staticmethod
+    def _related_pairs(instance):
+        from django_elasticsearch_dsl.registries import registry
+
+        pairs = []
+        for document in registry.get_documents():
+            if instance.__class__ in document.django.related_models and not document.django.ignore_signals:
+                pairs += [(document, pk) for pk in _related_ids(document, instance)]
+        return pairs
+
+    def _mark(self, entries):
+        if entries:
+            transaction.on_commit(functools.partial(self._offer, entries))
+
+    def _offer(self, entries):
+        self.start()
+        try:
+            self._queue.put_nowait(entries)
+        except queue.Full:
+            # Backpressure: the backlog sweep picks them up instead
+            self._defer(entries)
+        else:
+            self._count('marked', len(entries))
+
+    def _defer(self, entries):
+        from .models import SearchIndexBacklog
+
+        try:
+            SearchIndexBacklog.objects.bulk_create([
+                SearchIndexBacklog(kind=kind, target=target, object_id=object_id)
+                for kind, target, object_id in map(_backlog_key, entries)
+            ], ignore_conflicts=True)
+        except Exception:
+            # Picked up by the next rebuild_elasticsearch_index
+            self._count('dropped', len(entries))
+            logger.exception('Search indexing queue full and backlog unavailable, %d updates dropped',
+                             len(entries))
+        else:
+            self._count('deferred', len(entries))
+
+    # Worker
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._queue is None:
+                self._queue = queue.Queue(maxsize=self.options['QUEUE_SIZE'])
+            self._thread = threading.Thread(target=self._run, name='search-indexing', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        next_sweep = 0.0
+        while True:
+            entries = self._collect()
+            close_old_connections()
+            claimed = {}
+            try:
+                if not entries or time.monotonic() >= next_sweep:
+                    claimed = self._claim_due()
+                    entries |= set(claimed)
+                    next_sweep = time.monotonic() + self.options['POLL_INTERVAL']
+                if entries:
+                    self._settle(self.flush(entries), claimed)
+            except Exception as error:
+                logger.exception('Search indexing of %d documents failed', len(entries))
+                self._count('errors', len(entries))
+                connection.close()
+                try:
+                    self._settle(dict.fromkeys(entries, repr(error)), claimed)
+                except Exception:
+                    # Claimed rows become due again when their lease ends
+                    logger.exception('Could not record %d failed search updates for retry', len(entries))
+                time.sleep(1)
+
+    def _collect(self):
+        """Wait up to POLL_INTERVAL for an update, then gather more for up to WINDOW seconds"""
+        options = self.options
+        try:
+            entries = set(self._queue.get(timeout=options['POLL_INTERVAL']))
+        except queue.Empty:
+            return set()
+        deadline = time.monotonic() + options['WINDOW']
+        while len(entries) < options['BATCH_SIZE'] * 10:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entries.update(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return entries
+
+    # Backlog
+
+    def _claim_due(self):
+        """
+        Entry -> SearchIndexBacklog row for up to BATCH_SIZE due rows. As in
+        the notification dispatcher, claiming sets a lease and a token in
+        one UPDATE, so other processes skip the rows until the lease ends.
+        """
+        from .models import SearchIndexBacklog
+
+        options = self.options
+        now = timezone.now()
+        due = (
+            SearchIndexBacklog.objects
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('pk', flat=True)[:options['BATCH_SIZE']]
+        )
+        token = uuid.uuid4().hex
+        SearchIndexBacklog.objects.filter(
+            pk__in=list(due), status='pending', next_attempt_at__lte=now,
+        ).update(claim_token=token, next_attempt_at=now + timedelta(seconds=options['LEASE_SECONDS']))
+
+        claimed, orphans = {}, []
+        for row in SearchIndexBacklog.objects.filter(claim_token=token, status='pending'):
+            entry = _backlog_entry(row)
+            if entry is None:
+                orphans.append(row.pk)
+            else:
+                claimed[entry] = row
+        if orphans:
+            SearchIndexBacklog.objects.filter(pk__in=orphans).delete()
+        return claimed
+
+    def _settle(self, failed, claimed):
+        """
+        Delete the claimed backlog rows that went through and schedule a
+        retry for each failed entry (entry -> error), with exponential
+        backoff, or make it a dead letter after MAX_ATTEMPTS.
+        """
+        from .models import SearchIndexBacklog
+
+        options = self.options
+        done = [row.pk for entry, row in claimed.items() if entry not in failed]
+        if done:
+            SearchIndexBacklog.objects.filter(pk__in=done).delete()
+        if not failed:
+            return
+
+        now = timezone.now()
+        new, retried = [], []
+        for entry, error in failed.items():
+            row = claimed.get(entry)
+            if row is None:
+                kind, target, object_id = _backlog_key(entry)
+                row = SearchIndexBacklog(kind=kind, target=target, object_id=object_id)
+                new.append(row)
+            else:
+                retried.append(row)
+            row.attempts += 1
+            row.claim_token = ''
+            row.last_error = error[:1000]
+            if row.attempts >= options['MAX_ATTEMPTS']:
+                row.status = 'dead'
+            else:
+                delay = min(options['BACKOFF_BASE'] ** row.attempts, options['BACKOFF_MAX'])
+                row.next_attempt_at = now + timedelta(seconds=delay)
+        # A conflict means the entry is already waiting in the backlog
+        SearchIndexBacklog.objects.bulk_create(new, ignore_conflicts=True)
+        SearchIndexBacklog.objects.bulk_update(
+            retried, ['attempts', 'claim_token', 'last_error', 'status', 'next_attempt_at'],
+        )
+        dead = sum(1 for row in new + retried if row.status == 'dead')
+        with self._stats_lock:
+            self._stats['retried'] += len(failed) - dead
+            self._stats['dead'] += dead
+        logger.warning('Search indexing: %d updates failed, %d of them dead letters', len(failed), dead)
+
+    def requeue(self, queryset):
+        """Reset dead letters for another round of attempts"""
+        return queryset.update(status='pending', attempts=0, claim_token='', next_attempt_at=timezone.now())
+
+    # Indexing
+
+    def flush(self, entries):
+        """
+        Index or delete ('index', document, id) entries, after resolving
+        ('related', model, id) entries to the documents that depend on them.
+
+        Returns the entries that failed, mapped to their error.
+        """
+        from elasticsearch.helpers import bulk
+        from elasticsearch_dsl.connections import connections
+
+        started = time.perf_counter()
+        client = connections.get_connection()
+        cache = caches['shared']
+        batch_size = self.options['BATCH_SIZE']
+
+        by_document, related = {}, {}
+        for kind, target, pk in entries:
+            group = by_document if kind == 'index' else related
+            group.setdefault(target, set()).add(pk)
+        for model, ids in related.items():
+            for instance in model.objects.filter(pk__in=ids):
+                for document, pk in self._related_pairs(instance):
+                    by_document.setdefault(document, set()).add(pk)
+
+        failed = {}
+        for document, ids in by_document.items():
+            alias = document._index._name
+            targets = [alias]
+            extra = cache.get(EXTRA_TARGET_KEY.format(alias))
+            if extra:
+                targets.append(extra)
+            ids = sorted(ids)
+            for start in range(0, len(ids), batch_size):
+                chunk = ids[start:start + batch_size]
+                objects = list(document().get_queryset().filter(pk__in=chunk))
+                missing = set(chunk) - {obj.pk for obj in objects}
+                doc = document()
+                pks = {str(doc.generate_id(obj)): obj.pk for obj in objects}
+                pks.update((str(pk), pk) for pk in missing)
+                actions = []
+                for target in targets:
+                    actions += document_actions(document, objects, target)
+                    actions += [{'_op_type': 'delete', '_index': target, '_id': pk} for pk in missing]
+                try:
+                    _, errors = bulk(client, actions, raise_on_error=False, raise_on_exception=False)
+                except Exception as error:
+                    errors = [{'bulk': {'_id': pk, 'error': repr(error)}} for pk in pks]
+                # Deleting a document that was never indexed is not an error
+                errors = [error for error in errors if error.get('delete', {}).get('status') != 404]
+                for error in errors:
+                    (item,) = error.values()
+                    pk = pks.get(str(item.get('_id')))
+                    if pk is not None:
+                        failed[('index', document, pk)] = repr(item.get('error', item))
+                if errors:
+                    logger.warning('Bulk indexing into %s: %d errors, first: %r', alias, len(errors), errors[0])
+                with self._stats_lock:
+                    self._stats['indexed'] += len(objects)
+                    self._stats['deleted'] += len(missing)
+                    self._stats['errors'] += len(errors)
+                    self._stats['bulk_requests'] += 1
+
+        with self._stats_lock:
+            self._stats['last_batch_size'] = len(entries)
+            self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return failed
+
+    # Metrics
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        from django.db.models import Count, Q
+        from .models import SearchIndexBacklog
+
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot.update(SearchIndexBacklog.objects.aggregate(
+            backlog=Count('pk', filter=Q(status='pending')),
+            dead_letters=Count('pk', filter=Q(status='dead')),
+        ))
+        snapshot['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        snapshot['worker_alive'] = self._thread is not None and self._thread.is_alive()
+        return snapshot
+
+
+search_indexer = SearchIndexer()
+
+
+try:
+    from django_elasticsearch_dsl.apps import DEDConfig
+    from django_elasticsearch_dsl.signals import RealTimeSignalProcessor
+
+    class QueuedSignalProcessor(RealTimeSignalProcessor):
+        """Marks dirty documents for search_indexer instead of indexing in the request"""
+
+        def handle_save(self, sender, instance, **kwargs):
+            if DEDConfig.autosync_enabled():
+                search_indexer.mark_saved(instance)
+
+        def handle_pre_delete(self, sender, instance, **kwargs):
+            if DEDConfig.autosync_enabled():
+                search_indexer.mark_related(instance)
+
+        def handle_delete(self, sender, instance, **kwargs):
+            if DEDConfig.autosync_enabled():
+                search_indexer.mark_deleted(instance)
+
+except ImportError:
+    # Elasticsearch is not available, nothing to index
+    pass
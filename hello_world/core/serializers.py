@@ -51,4 +51,38 @@ class PrescriptionSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'patient', 'patient_name', 'doctor', 'doctor_name',
             'diagnosis', 'instructions', 'prescribed_date'
-        ]
\ No newline at end of file
+        ]
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = [
+            'id', 'title', 'message', 'notification_type', 'priority',
+            'is_read', 'read_at', 'created_at', 'expires_at',
+            'action_url', 'action_text'
+        ]
+
+class RoleBroadcastSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RoleBroadcast
+        fields = [
+            'id', 'role', 'title', 'message', 'notification_type', 'priority',
+            'created_at', 'expires_at', 'action_url', 'action_text'
+        ]
+
+class MarkReadSerializer(serializers.Serializer):
+    """Batch mark-as-read: ids, broadcast ids and/or everything before a time"""
+    notification_ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    broadcast_ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    before = serializers.DateTimeField(required=False)
+    # Single-id forms, folded into the lists
+    notification_id = serializers.IntegerField(required=False, write_only=True)
+    broadcast_id = serializers.IntegerField(required=False, write_only=True)
+
+    def validate(self, attrs):
+        for single, many in (('notification_id', 'notification_ids'), ('broadcast_id', 'broadcast_ids')):
+            if single in attrs:
+                attrs[many] = [*attrs.get(many, []), attrs.pop(single)]
+        if not any(key in attrs for key in ('notification_ids', 'broadcast_ids', 'before')):
+            raise serializers.ValidationError('Provide notification_ids, broadcast_ids or before.')
+        return attrs
@@ -1,8 +1,15 @@
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+import logging
+import time
+from datetime import timedelta
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
 from django.utils import timezone
-from .models import Notification
+from .dispatch import dispatcher
+from .models import Notification, RoleBroadcast, RoleBroadcastRead, WoundCare
+
+logger = logging.getLogger(__name__)
 
 class NotificationService:
     """
@@ -12,30 +19,33 @@ class NotificationService:
     @staticmethod
     def send_notification_to_user(user_id, data):
         """
-        Send notification to specific user via WebSocket
+        Queue a WebSocket notification for a specific user
         """
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'notifications_{user_id}',
-            {
-                'type': 'send_notification',
-                'data': data
-            }
-        )
+        NotificationService.send_notification_to_group(f'notifications_{user_id}', data)
 
     @staticmethod
     def send_notification_to_group(group_name, data):
         """
-        Send notification to a group via WebSocket
+        Queue a WebSocket notification for a group; delivery happens on the
+        dispatcher thread after the current transaction commits
         """
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                'type': 'send_notification',
-                'data': data
-            }
-        )
+        dispatcher.enqueue([(group_name, {'type': 'send_notification', 'data': data})])
+
+    @staticmethod
+    def notification_payload(notification):
+        """
+        WebSocket payload for a notification
+        """
+        return {
+            'id': notification.id,
+            'title': notification.title,
+            'message': notification.message,
+            'type': notification.notification_type,
+            'priority': notification.priority,
+            'created_at': notification.created_at.isoformat(),
+            'action_url': notification.action_url or '',
+            'action_text': notification.action_text or '',
+        }
 
     @staticmethod
     def create_and_send_notification(recipient, title, message, notification_type='info',
@@ -54,42 +64,155 @@ class NotificationService:
             **kwargs
         )
 
-        # Prepare data for WebSocket
-        notification_data = {
-            'id': notification.id,
-            'title': notification.title,
-            'message': notification.message,
-            'type': notification.notification_type,
-            'priority': notification.priority,
-            'created_at': notification.created_at.isoformat(),
-            'action_url': notification.action_url or '',
-            'action_text': notification.action_text or '',
-        }
-
         # Send via WebSocket
-        NotificationService.send_notification_to_user(recipient.id, notification_data)
+        NotificationService.send_notification_to_user(
+            recipient.id, NotificationService.notification_payload(notification)
+        )
 
         return notification
 
+    # Unread state
+
+    UNREAD_CACHE_TIMEOUT = 600
+    SYNC_BACKLOG_SIZE = 20
+
+    @staticmethod
+    def _unread_cache_key(user_id):
+        return f'notifications:unread:{user_id}'
+
+    @staticmethod
+    def _broadcast_version_key(role):
+        return f'notifications:broadcasts:{role}:version'
+
+    @staticmethod
+    def _unread_broadcasts_cache_key(user_id):
+        return f'notifications:unread-broadcasts:{user_id}'
+
+    @staticmethod
+    def unread_notification_count(user_id):
+        """
+        Unread notifications for a user, from a cached counter that is
+        adjusted on create and mark-as-read and recounted when missing
+        """
+        key = NotificationService._unread_cache_key(user_id)
+        count = cache.get(key)
+        if count is None or count < 0:
+            count = Notification.objects.filter(is_read=False, recipient_id=user_id).count()
+            cache.set(key, count, NotificationService.UNREAD_CACHE_TIMEOUT)
+        return count
+
+    @staticmethod
+    def unread_broadcast_count(user, role=None):
+        """
+        Unread role broadcasts for a user. The cached count is tagged with
+        the role and its broadcast version, which broadcast_to_roles bumps,
+        and dropped by mark_broadcasts_read; broadcasts that expire are
+        noticed within UNREAD_CACHE_TIMEOUT.
+        """
+        if role is None:
+            from .models import UserProfile
+            role = UserProfile.objects.filter(user=user).values_list('role', flat=True).first()
+        if not role:
+            return 0
+        key = NotificationService._unread_broadcasts_cache_key(user.id)
+        version = (role, cache.get(NotificationService._broadcast_version_key(role), 0))
+        cached = cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        count = NotificationService.unread_broadcasts(user, role=role).count()
+        cache.set(key, (version, count), NotificationService.UNREAD_CACHE_TIMEOUT)
+        return count
+
+    @staticmethod
+    def unread_count(user, role=None):
+        """
+        Everything unread for a user: their notifications plus the role
+        broadcasts addressed to them
+        """
+        return (
+            NotificationService.unread_notification_count(user.id)
+            + NotificationService.unread_broadcast_count(user, role=role)
+        )
+
+    @staticmethod
+    def adjust_unread_count(user_ids, delta):
+        """
+        Apply ``delta`` to the cached counters once the transaction commits.
+        Counters that are not cached are left to be recounted on next read.
+        """
+        user_ids = list(user_ids)
+
+        def apply():
+            for user_id in user_ids:
+                try:
+                    cache.incr(NotificationService._unread_cache_key(user_id), delta)
+                except ValueError:
+                    pass
+                except Exception:
+                    # Counter is advisory; drop it rather than fail the write
+                    cache.delete(NotificationService._unread_cache_key(user_id))
+
+        transaction.on_commit(apply)
+
+    @staticmethod
+    def mark_read(user, notification_ids=None, broadcast_ids=None, before=None):
+        """
+        Mark many notifications read in one UPDATE.
+
+        Targets the given ids, everything created up to ``before``, or
+        both (either one matches); role broadcasts are matched the same
+        way. Returns how many notifications and broadcasts changed.
+        """
+        def matching(ids):
+            condition = Q(pk__in=ids) if ids is not None else Q(pk__in=[])
+            if before is not None:
+                condition |= Q(created_at__lte=before)
+            return condition
+
+        updated = 0
+        if notification_ids is not None or before is not None:
+            unread = Notification.objects.filter(recipient=user, is_read=False).filter(matching(notification_ids))
+            updated = unread.update(is_read=True, read_at=timezone.now())
+            if updated:
+                NotificationService.adjust_unread_count([user.id], -updated)
+
+        broadcasts = 0
+        if broadcast_ids is not None or before is not None:
+            unread = NotificationService.unread_broadcasts(user).filter(matching(broadcast_ids))
+            broadcasts = NotificationService.mark_broadcasts_read(user, unread.values_list('pk', flat=True))
+        return {'notifications': updated, 'broadcasts': broadcasts}
+
+    @staticmethod
+    def unread_sync_payload(user, role=None, limit=None):
+        """
+        Unread count plus the most recent unread notifications and role
+        broadcasts, sent to a client when its websocket connects
+        """
+        limit = limit or NotificationService.SYNC_BACKLOG_SIZE
+        unread = Notification.objects.filter(is_read=False, recipient=user).order_by('-created_at')[:limit]
+        broadcasts = NotificationService.unread_broadcasts(user, role=role)[:limit]
+        return {
+            'type': 'unread_sync',
+            'unread_count': NotificationService.unread_count(user, role=role),
+            'notifications': [NotificationService.notification_payload(n) for n in unread],
+            'broadcasts': [NotificationService.broadcast_payload(b) for b in broadcasts],
+        }
+
     @staticmethod
     def notify_doctors_new_wound_case(wound_case):
         """
         Notify all doctors about new wound case
         """
-        from .models import UserProfile
-
-        doctors = UserProfile.objects.filter(role='doctor').select_related('user')
-        for doctor_profile in doctors:
-            NotificationService.create_and_send_notification(
-                recipient=doctor_profile.user,
-                title=f'New Wound Case: {wound_case.wound_id}',
-                message=f'Patient: {wound_case.patient.full_name} - {wound_case.wound_type.name}',
-                notification_type='wound_care',
-                priority='high',
-                related_wound=wound_case,
-                action_url=f'/core/wounds/{wound_case.id}/',
-                action_text='View Case'
-            )
+        NotificationService.broadcast_to_roles(
+            ['doctor'],
+            title=f'New Wound Case: {wound_case.wound_id}',
+            message=f'Patient: {wound_case.patient.full_name} - {wound_case.wound_type.name}',
+            notification_type='wound_care',
+            priority='high',
+            related_wound=wound_case,
+            action_url=f'/core/wounds/{wound_case.id}/',
+            action_text='View Case'
+        )
 
     @staticmethod
     def notify_patient_appointment_reminder(appointment):
@@ -114,47 +237,33 @@ class NotificationService:
         """
         Notify relevant staff about completed lab results
         """
-        from .models import UserProfile
-
         # Notify doctors and lab techs
-        medical_staff = UserProfile.objects.filter(
-            role__in=['doctor', 'lab_tech']
-        ).select_related('user')
-
-        for staff_profile in medical_staff:
-            NotificationService.create_and_send_notification(
-                recipient=staff_profile.user,
-                title=f'Lab Results Ready: {lab_request.patient.full_name}',
-                message=f'{lab_request.tests} results are now available',
-                notification_type='lab_result',
-                priority='high',
-                related_patient=lab_request.patient,
-                action_url=f'/core/lab/requests/{lab_request.id}/',
-                action_text='View Results'
-            )
+        NotificationService.broadcast_to_roles(
+            ['doctor', 'lab_tech'],
+            title=f'Lab Results Ready: {lab_request.patient.full_name}',
+            message=f'{lab_request.tests} results are now available',
+            notification_type='lab_result',
+            priority='high',
+            related_patient=lab_request.patient,
+            action_url=f'/core/lab/requests/{lab_request.id}/',
+            action_text='View Results'
+        )
 
     @staticmethod
     def notify_billing_update(billing):
         """
         Notify about billing updates
         """
-        from .models import UserProfile
-
         # Notify cashiers and admins
-        finance_staff = UserProfile.objects.filter(
-            role__in=['cashier', 'admin', 'super_admin']
-        ).select_related('user')
-
-        for staff_profile in finance_staff:
-            NotificationService.create_and_send_notification(
-                recipient=staff_profile.user,
-                title=f'Billing Update: {billing.wound.wound_id}',
-                message=f'Payment status: {billing.get_payment_status_display()} - Balance: ${billing.balance}',
-                notification_type='billing',
-                priority='medium' if billing.balance > 0 else 'high',
-                action_url=f'/core/wounds/{billing.wound.id}/billing/',
-                action_text='View Billing'
-            )
+        NotificationService.broadcast_to_roles(
+            ['cashier', 'admin', 'super_admin'],
+            title=f'Billing Update: {billing.wound.wound_id}',
+            message=f'Payment status: {billing.get_payment_status_display()} - Balance: ${billing.balance}',
+            notification_type='billing',
+            priority='medium' if billing.balance > 0 else 'high',
+            action_url=f'/core/wounds/{billing.wound.id}/billing/',
+            action_text='View Billing'
+        )
 
     @staticmethod
     def broadcast_system_notification(title, message, user_roles=None):
@@ -163,19 +272,102 @@ class NotificationService:
         """
         from .models import UserProfile
 
-        if user_roles:
-            recipients = UserProfile.objects.filter(role__in=user_roles).select_related('user')
-        else:
-            recipients = UserProfile.objects.all().select_related('user')
+        NotificationService.broadcast_to_roles(
+            user_roles or [role for role, _ in UserProfile.ROLE_CHOICES],
+            title=title,
+            message=message,
+            notification_type='system',
+            priority='medium'
+        )
+
+    # Role broadcasts
 
-        for profile in recipients:
-            NotificationService.create_and_send_notification(
-                recipient=profile.user,
+    @staticmethod
+    def broadcast_payload(broadcast):
+        """
+        WebSocket payload for a role broadcast; ``broadcast`` tells clients
+        to acknowledge it with broadcast_id rather than notification_id
+        """
+        return {
+            **NotificationService.notification_payload(broadcast),
+            'broadcast': True,
+            'role': broadcast.role,
+        }
+
+    @staticmethod
+    def broadcast_to_roles(roles, title, message, notification_type='system',
+                           priority='medium', sender=None, **kwargs):
+        """
+        Notify everyone holding any of ``roles``.
+
+        Writes one RoleBroadcast row and queues one group_send to the
+        ``role_<role>`` group per role, so the cost does not grow with the
+        number of staff in the role.
+        """
+        broadcasts = RoleBroadcast.objects.bulk_create([
+            RoleBroadcast(
+                role=role,
+                sender=sender,
                 title=title,
                 message=message,
-                notification_type='system',
-                priority='medium'
+                notification_type=notification_type,
+                priority=priority,
+                **kwargs
             )
+            for role in dict.fromkeys(roles)
+        ])
+        dispatcher.enqueue([
+            (broadcast.group_name,
+             {'type': 'send_notification', 'data': NotificationService.broadcast_payload(broadcast)})
+            for broadcast in broadcasts
+        ])
+
+        NotificationService.bump_broadcast_versions(b.role for b in broadcasts)
+        return broadcasts
+
+    @staticmethod
+    def bump_broadcast_versions(roles):
+        """
+        Invalidate the cached unread broadcast counts of everyone in ``roles``
+        once the current transaction commits; call after adding or removing
+        role broadcasts
+        """
+        version_keys = [NotificationService._broadcast_version_key(role) for role in set(roles)]
+        transaction.on_commit(lambda: cache.set_many(dict.fromkeys(version_keys, time.time_ns()), None))
+
+    @staticmethod
+    def unread_broadcasts(user, role=None):
+        """
+        Role broadcasts addressed to ``user`` that they have not read
+        """
+        if role is None:
+            from .models import UserProfile
+            role = UserProfile.objects.filter(user=user).values_list('role', flat=True).first()
+        now = timezone.now()
+        return (
+            RoleBroadcast.objects
+            .filter(role=role, created_at__gte=user.date_joined)
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+            .exclude(reads__user=user)
+        )
+
+    @staticmethod
+    def mark_broadcasts_read(user, broadcast_ids):
+        """
+        Record role broadcasts as read by ``user``; returns how many were new
+        """
+        ids = list(
+            NotificationService.unread_broadcasts(user)
+            .filter(pk__in=broadcast_ids)
+            .values_list('pk', flat=True)
+        )
+        RoleBroadcastRead.objects.bulk_create(
+            [RoleBroadcastRead(broadcast_id=pk, user=user) for pk in ids],
+            ignore_conflicts=True,
+        )
+        if ids:
+            transaction.on_commit(lambda: cache.delete(NotificationService._unread_broadcasts_cache_key(user.id)))
+        return len(ids)
 
 class AuditService:
     """
@@ -224,4 +416,52 @@ class AuditService:
                 timestamp__gte=since_date
             ).order_by('-timestamp')
         except ContentType.DoesNotExist:
-            return LogEntry.objects.none()
\ No newline at end of file
+            return LogEntry.objects.none()
+
+class WoundStatisticsService:
+    """
+    Cached wound care statistics shared by the dashboard and the REST API
+    """
+
+    CACHE_KEY = 'wound_statistics:v1'
+    CACHE_TIMEOUT = 300  # Also bounds drift of the rolling 30-day count
+    RECENT_DAYS = 30
+
+    @staticmethod
+    def compute_stats():
+        """
+        Compute every wound figure in a single conditional-aggregation query
+        """
+        recent_since = timezone.now() - timedelta(days=WoundStatisticsService.RECENT_DAYS)
+        stats = WoundCare.objects.aggregate(
+            all_cases=Count('id'),
+            total_cases=Count('id', filter=Q(is_active=True)),
+            active_cases=Count('id', filter=Q(status='active')),
+            pending_cases=Count('id', filter=Q(status='pending')),
+            resolved_cases=Count('id', filter=Q(status='resolved')),
+            insured_cases=Count('id', filter=Q(insurance_covers=True)),
+            uninsured_cases=Count('id', filter=Q(insurance_covers=False)),
+            recent_cases=Count('id', filter=Q(assessment_date__gte=recent_since)),
+            # billing is one-to-one, so the LEFT JOIN never duplicates rows
+            pending_payments=Sum('billing__balance', filter=Q(billing__payment_status='pending')),
+        )
+        stats['pending_payments'] = stats['pending_payments'] or 0
+        return stats
+
+    @staticmethod
+    def get_stats():
+        """
+        Return cached statistics, recomputing them on a cache miss
+        """
+        stats = cache.get(WoundStatisticsService.CACHE_KEY)
+        if stats is None:
+            stats = WoundStatisticsService.compute_stats()
+            cache.set(WoundStatisticsService.CACHE_KEY, stats, WoundStatisticsService.CACHE_TIMEOUT)
+        return stats
+
+    @staticmethod
+    def invalidate():
+        """
+        Drop cached statistics; called from WoundCare/WoundBilling signals
+        """
+        cache.delete(WoundStatisticsService.CACHE_KEY)
@@ -2,9 +2,12 @@
 Signals for the core app
 """
 import logging
-from django.db.models.signals import post_migrate, post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.core.signals import request_started
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +33,47 @@ def create_user_profile(sender, instance, created, **kwargs):
         logger.error(f"Failed to create UserProfile for {instance.username}: {e}")
 
 
+@receiver([post_save, post_delete], sender='core.WoundCare')
+@receiver([post_save, post_delete], sender='core.WoundBilling')
+def invalidate_wound_statistics(sender, **kwargs):
+    """
+    Drop cached wound statistics once the surrounding transaction commits
+    """
+    from .services import WoundStatisticsService
+    transaction.on_commit(WoundStatisticsService.invalidate)
+
+
+@receiver(user_logged_in)
+def record_login_security_state(sender, request, user, **kwargs):
+    """
+    Persist login IP and clear expired lockouts once per login.
+
+    This replaces the per-request writes SecurityMiddleware used to make, so
+    ordinary page views never write to core_userprofile.
+    """
+    try:
+        from .models import UserProfile
+        from .middleware import get_client_ip
+
+        profile = UserProfile.objects.filter(user=user).first()
+        if profile is None:
+            return
+
+        update_fields = []
+        if profile.clear_expired_lockout(commit=False):
+            update_fields += ['account_locked', 'lockout_until', 'login_attempts']
+
+        ip = get_client_ip(request) if request is not None else None
+        if ip and ip != profile.last_login_ip:
+            profile.last_login_ip = ip
+            update_fields.append('last_login_ip')
+
+        if update_fields:
+            profile.save(update_fields=update_fields)
+    except Exception as e:
+        logger.error(f"Failed to record login state for {user.username}: {e}")
+
+
 @receiver(post_migrate)
 def create_initial_data(sender, **kwargs):
     """
@@ -104,4 +148,92 @@ def create_initial_data(sender, **kwargs):
 
     except Exception as e:
         logger.error(f"✗ Failed to create initial data: {str(e)}")
-        # Don't raise exception - app should still work without initial data
\ No newline at end of file
+        # Don't raise exception - app should still work without initial data
+
+@receiver(request_started)
+def start_notification_dispatcher(sender, **kwargs):
+    """
+    Start the dispatcher in serving processes so outbox rows left over from
+    a restart are delivered without waiting for the next notification
+    """
+    from .dispatch import dispatcher
+    dispatcher.start()
+
+
+@receiver(post_save, sender='core.Notification')
+def count_new_unread_notification(sender, instance, created, **kwargs):
+    """Keep the cached unread counter in step with single inserts"""
+    if created and not instance.is_read:
+        from .services import NotificationService
+        NotificationService.adjust_unread_count([instance.recipient_id], 1)
+
+
+# Change feed: live wound and appointment updates
+
+@receiver(pre_save, sender='core.WoundCare')
+@receiver(pre_save, sender='core.WoundTreatment')
+@receiver(pre_save, sender='core.WoundFollowUp')
+@receiver(pre_save, sender='core.Appointment')
+def snapshot_change_feed_fields(sender, instance, raw=False, **kwargs):
+    """Read the stored values so the save publishes only what changed"""
+    if raw:
+        return
+    from .change_feed import change_feed
+    change_feed.snapshot(instance)
+
+
+@receiver(post_save, sender='core.WoundCare')
+@receiver(post_save, sender='core.WoundTreatment')
+@receiver(post_save, sender='core.WoundFollowUp')
+@receiver(post_save, sender='core.Appointment')
+def publish_change_feed_save(sender, instance, created, raw=False, **kwargs):
+    """Publish a compact diff to the live feed once the transaction commits"""
+    if raw:
+        return
+    from .change_feed import change_feed
+    change_feed.record_save(instance, created)
+
+
+@receiver(post_delete, sender='core.WoundCare')
+@receiver(post_delete, sender='core.Appointment')
+def publish_change_feed_delete(sender, instance, **kwargs):
+    from .change_feed import change_feed
+    change_feed.record_delete(instance)
+
+
+# Built-in search index (SEARCH_BACKEND = 'local')
+
+@receiver(post_save, sender='core.Patient')
+@receiver(post_save, sender='core.WoundCare')
+@receiver(post_save, sender='core.Appointment')
+@receiver(post_save, sender='core.Prescription')
+def update_search_index(sender, instance, raw=False, **kwargs):
+    """Re-index the saved object in the same transaction"""
+    from django.conf import settings
+    if raw or settings.SEARCH_BACKEND != 'local':
+        return
+    from .search import INDEX_FOR_MODEL, update_related_patient_names
+    INDEX_FOR_MODEL[sender].update(instance)
+    if sender._meta.model_name == 'patient':
+        update_related_patient_names(instance)
+
+
+@receiver(post_delete, sender='core.Patient')
+@receiver(post_delete, sender='core.WoundCare')
+@receiver(post_delete, sender='core.Appointment')
+@receiver(post_delete, sender='core.Prescription')
+def remove_from_search_index(sender, instance, **kwargs):
+    from django.conf import settings
+    if settings.SEARCH_BACKEND != 'local':
+        return
+    from .search import INDEX_FOR_MODEL
+    INDEX_FOR_MODEL[sender].remove(instance.pk)
+
+
+@receiver(post_save, sender='core.Patient')
+def update_patient_lookup(sender, instance, raw=False, **kwargs):
+    """Keep the front-desk lookup keys in step with the patient"""
+    if raw:
+        return
+    from .patient_lookup import PatientLookupService
+    PatientLookupService.update(instance)
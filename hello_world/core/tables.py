@@ -1,61 +1,150 @@
 import django_tables2 as tables
+from django.conf import settings
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.db.models import Count
+from django_tables2 import RequestConfig
+from django_tables2.paginators import LazyPaginator
 from .models import *
 
-class PatientTable(tables.Table):
+
+class PaginatedTable(tables.Table):
+    """
+    Base for list tables: builds an N+1-free queryset and always paginates.
+
+    Shallow pages use offset pagination without a COUNT query. Deeper pages
+    switch to keyset pagination on the primary key (?after=<pk>), which
+    costs the same at page 5 000 as at page 1. Page numbers past
+    TABLE_PAGINATION['MAX_OFFSET_PAGE'] are turned into a keyset cursor with
+    an index-only primary key lookup.
+    """
+    related_fields = ()
+    prefetch_fields = ()
+
+    @classmethod
+    def get_queryset(cls):
+        queryset = cls._meta.model.objects.all()
+        if cls.related_fields:
+            queryset = queryset.select_related(*cls.related_fields)
+        if cls.prefetch_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_fields)
+        return queryset.order_by('-pk')
+
+    @staticmethod
+    def _int_param(request, name, default):
+        try:
+            return int(request.GET.get(name, default))
+        except (TypeError, ValueError):
+            return default
+
+    @classmethod
+    def for_request(cls, request, queryset=None):
+        """Build, order and paginate the table for ``request``"""
+        options = settings.TABLE_PAGINATION
+        if queryset is None:
+            queryset = cls.get_queryset()
+
+        per_page = cls._int_param(request, 'per_page', options['PER_PAGE'])
+        per_page = max(1, min(per_page, options['MAX_PER_PAGE']))
+        page = max(1, cls._int_param(request, 'page', 1))
+        sorted_by_user = bool(request.GET.get(cls._meta.order_by_field))
+
+        after = cls._int_param(request, 'after', None)
+        if after is None and not sorted_by_user and page > options['MAX_OFFSET_PAGE']:
+            # Seek to the page boundary on the primary key index alone, then
+            # fetch the rows (and their joins) by keyset.
+            offset = (page - 1) * per_page
+            boundary = list(queryset.values_list('pk', flat=True)[offset - 1:offset])
+            after = boundary[0] if boundary else 0
+
+        if after is not None and not sorted_by_user:
+            rows = list(queryset.filter(pk__lt=after)[:per_page + 1])
+            table = cls(rows[:per_page], orderable=False)
+            table.keyset = True
+            table.next_cursor = rows[per_page - 1].pk if len(rows) > per_page else None
+            return table
+
+        table = cls(queryset)
+        # Ordering comes from the request; pagination is applied here so the
+        # per_page clamp cannot be bypassed through the query string.
+        RequestConfig(request, paginate=False).configure(table)
+        try:
+            table.paginate(LazyPaginator, per_page=per_page, page=page)
+        except (PageNotAnInteger, EmptyPage):
+            table.paginate(LazyPaginator, per_page=per_page, page=1)
+        table.keyset = False
+        table.next_cursor = None
+        return table
+
+
+class PatientTable(PaginatedTable):
     full_name = tables.Column(accessor='full_name', verbose_name='Full Name')
     age = tables.Column(accessor='age', verbose_name='Age')
 
     class Meta:
         model = Patient
-        template_name = "django_tables2/bootstrap5.html"
+        template_name = "django_tables2/bootstrap5_keyset.html"
         fields = ('medical_record_number', 'full_name', 'age', 'phone', 'gender', 'registration_date')
 
-class AppointmentTable(tables.Table):
-    patient = tables.Column(linkify=True, accessor='patient__full_name')
+class AppointmentTable(PaginatedTable):
+    related_fields = ('patient', 'doctor', 'clinic')
+
+    patient = tables.Column(linkify=('patient_update', {'pk': tables.A('patient_id')}), accessor='patient__full_name')
     doctor = tables.Column(accessor='doctor__get_full_name')
     clinic = tables.Column(accessor='clinic__name')
 
     class Meta:
         model = Appointment
-        template_name = "django_tables2/bootstrap5.html"
+        template_name = "django_tables2/bootstrap5_keyset.html"
         fields = ('patient', 'doctor', 'clinic', 'date', 'status', 'appointment_type')
 
-class LabRequestTable(tables.Table):
-    patient = tables.Column(linkify=True, accessor='patient__full_name')
+class LabRequestTable(PaginatedTable):
+    related_fields = ('patient', 'doctor')
+
+    patient = tables.Column(linkify=('patient_update', {'pk': tables.A('patient_id')}), accessor='patient__full_name')
     doctor = tables.Column(accessor='doctor__get_full_name')
-    tests_count = tables.Column(verbose_name='Tests', accessor='tests__count')
+    tests_count = tables.Column(verbose_name='Tests', accessor='tests_count')
+
+    @classmethod
+    def get_queryset(cls):
+        return super().get_queryset().annotate(tests_count=Count('tests'))
 
     class Meta:
         model = LabRequest
-        template_name = "django_tables2/bootstrap5.html"
+        template_name = "django_tables2/bootstrap5_keyset.html"
         fields = ('request_number', 'patient', 'doctor', 'priority', 'status', 'requested_at')
 
-class PrescriptionTable(tables.Table):
-    patient = tables.Column(linkify=True, accessor='patient__full_name')
+class PrescriptionTable(PaginatedTable):
+    related_fields = ('patient', 'doctor')
+
+    patient = tables.Column(linkify=('patient_update', {'pk': tables.A('patient_id')}), accessor='patient__full_name')
     doctor = tables.Column(accessor='doctor__get_full_name')
 
     class Meta:
         model = Prescription
-        template_name = "django_tables2/bootstrap5.html"
+        template_name = "django_tables2/bootstrap5_keyset.html"
         fields = ('prescription_number', 'patient', 'doctor', 'diagnosis', 'prescribed_at', 'dispensed_at')
 
-class OutPatientVisitTable(tables.Table):
-    patient = tables.Column(linkify=True, accessor='patient__full_name')
+class OutPatientVisitTable(PaginatedTable):
+    related_fields = ('patient', 'doctor')
+
+    patient = tables.Column(linkify=('patient_update', {'pk': tables.A('patient_id')}), accessor='patient__full_name')
     doctor = tables.Column(accessor='doctor__get_full_name')
 
     class Meta:
         model = OutPatientVisit
-        template_name = "django_tables2/bootstrap5.html"
+        template_name = "django_tables2/bootstrap5_keyset.html"
         fields = ('visit_number', 'patient', 'doctor', 'chief_complaint', 'visit_date')
 
-class VitalSignsTable(tables.Table):
-    patient = tables.Column(linkify=True, accessor='patient__full_name')
+class VitalSignsTable(PaginatedTable):
+    related_fields = ('patient', 'nurse')
+
+    patient = tables.Column(linkify=('patient_update', {'pk': tables.A('patient_id')}), accessor='patient__full_name')
     nurse = tables.Column(accessor='nurse__get_full_name')
     blood_pressure = tables.Column(accessor='blood_pressure', verbose_name='BP')
 
     class Meta:
         model = VitalSigns
-        template_name = "django_tables2/bootstrap5.html"
+        template_name = "django_tables2/bootstrap5_keyset.html"
         fields = ('patient', 'nurse', 'temperature', 'blood_pressure', 'heart_rate', 'recorded_at')
 
 class ServiceTable(tables.Table):
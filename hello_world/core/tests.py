@@ -0,0 +1,451 @@
+import asyncio
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import circuit_breaker, patient_lookup, search
+from .channel_layers import SQLiteChannelLayer
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from .consumers import NotificationConsumer
+from .dispatch import NotificationDispatcher
+from .export import iter_patient_csv
+from .models import (
+    Appointment, Clinic, Department, Notification, NotificationOutbox, Patient, SearchEntry, UserProfile,
+)
+from .patient_lookup import PatientLookupService
+from .search import PatientIndex, SearchIndexNotReady
+from .tables import AppointmentTable
+
+
+@override_settings(TABLE_PAGINATION={'PER_PAGE': 10, 'MAX_PER_PAGE': 100, 'MAX_OFFSET_PAGE': 2})
+class PaginatedTableQueryCountTests(TestCase):
+    """A page of a list table costs the same number of queries however long the table is"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('doctor', first_name='Ada', last_name='Okoth')
+        cls.clinic = Clinic.objects.create(name='Wound Clinic', department=Department.objects.create(name='Surgery'))
+
+    def add_appointments(self, count):
+        start = Patient.objects.count()
+        patients = Patient.objects.bulk_create([
+            Patient(first_name=f'First{n}', last_name=f'Last{n}', date_of_birth=date(1980, 1, 1),
+                    gender='F', marital_status='single', phone=f'0700{n:06d}', medical_record_number=f'T{n:08d}')
+            for n in range(start, start + count)
+        ])
+        Appointment.objects.bulk_create([
+            Appointment(patient=patient, doctor=self.doctor, clinic=self.clinic, date=timezone.now(),
+                        status='scheduled', appointment_type='consultation')
+            for patient in patients
+        ])
+
+    def render_page(self, query):
+        table = AppointmentTable.for_request(RequestFactory().get('/', query))
+        rows = table.page.object_list if getattr(table, 'page', None) else table.rows
+        return [[row.get_cell(column.name) for column in table.columns] for row in rows]
+
+    def assertConstantQueries(self, query, expected):
+        self.add_appointments(30)
+        params = query()
+        with self.assertNumQueries(expected):
+            small = self.render_page(params)
+        self.add_appointments(300)
+        params = query()
+        with self.assertNumQueries(expected):
+            large = self.render_page(params)
+        self.assertEqual(len(small), 10)
+        self.assertEqual(len(large), 10)
+
+    def test_keyset_page(self):
+        # One query for the page, with its joins
+        self.assertConstantQueries(lambda: {'after': Appointment.objects.order_by('-pk')[5].pk}, 1)
+
+    def test_deep_page_number(self):
+        # The page boundary from the primary key index, then the keyset page
+        self.assertConstantQueries(lambda: {'page': 3}, 2)
+
+    def test_offset_page(self):
+        self.assertConstantQueries(lambda: {'page': 2}, 1)
+
+
+class RequestProfileQueryTests(TestCase):
+    """Middlewares and views share one read of the signed-in user's profile"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('admin1')
+        UserProfile.objects.update_or_create(user=cls.user, defaults={'role': 'super_admin'})
+
+    def test_profile_read_once_per_request(self):
+        self.client.force_login(self.user)
+        for name in ('dashboard', 'patient_list'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            sqls = [query['sql'] for query in queries.captured_queries]
+            self.assertEqual(sum('FROM "core_userprofile"' in sql for sql in sqls), 1, name)
+            self.assertEqual(sum('FROM "auth_user"' in sql for sql in sqls), 1, name)
+
+
+class PatientCsvExportTests(TestCase):
+    """The patient CSV streams from one query, with names and ages computed by the database"""
+
+    def add_patients(self, count, **fields):
+        start = Patient.objects.count()
+        Patient.objects.bulk_create([
+            Patient(**{
+                'first_name': f'First{n}', 'last_name': f'Last{n}', 'date_of_birth': date(1980, 1, 1),
+                'gender': 'F', 'marital_status': 'single', 'phone': f'0700{n:06d}',
+                'medical_record_number': f'T{n:08d}', **fields,
+            })
+            for n in range(start, start + count)
+        ])
+
+    def test_streams_from_one_query(self):
+        self.add_patients(25)
+        lines = iter_patient_csv(chunk_size=10)
+        with self.assertNumQueries(0):
+            next(lines)  # the header
+        with self.assertNumQueries(1):
+            rows = list(lines)
+        self.assertEqual(len(rows), 25)
+
+    def test_full_name_and_age(self):
+        today = timezone.now().date()
+        self.add_patients(1, middle_name='Mid', date_of_birth=today.replace(year=today.year - 40))
+        self.add_patients(1, date_of_birth=today.replace(year=today.year - 40) + timedelta(days=1))
+        rows = [line.rstrip('\r\n').split(',') for line in list(iter_patient_csv())[1:]]
+        self.assertEqual((rows[0][1], rows[0][3]), ('First0 Mid Last0', '40'))
+        self.assertEqual((rows[1][1], rows[1][3]), ('First1  Last1', '39'))
+
+
+@override_settings(NOTIFICATION_DISPATCH={'MAX_ATTEMPTS': 2, 'BACKOFF_BASE': 2, 'LEASE_SECONDS': 60})
+class NotificationDispatchTests(TestCase):
+    """Outbox rows are claimed under a lease, retried with backoff and kept as dead letters"""
+
+    def setUp(self):
+        self.dispatcher = NotificationDispatcher()
+        self.sent = []
+
+    def send(self, messages):
+        self.sent.extend(messages)
+        return [None] * len(messages)
+
+    def fail(self, messages):
+        return [ConnectionError('layer down')] * len(messages)
+
+    def add_row(self, **fields):
+        return NotificationOutbox.objects.create(group_name='notifications_1', payload={'type': 'x'}, **fields)
+
+    def test_delivered_rows_are_deleted(self):
+        rows = [self.add_row(), self.add_row()]
+        with mock.patch.object(self.dispatcher, '_send', self.send):
+            self.assertEqual(self.dispatcher.dispatch([row.pk for row in rows]), 2)
+        self.assertEqual(len(self.sent), 2)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_leased_rows_are_skipped_until_the_lease_ends(self):
+        lease_end = timezone.now() + timedelta(seconds=30)
+        row = self.add_row(status='sending', claim_token='other', next_attempt_at=lease_end)
+        with mock.patch.object(self.dispatcher, '_send', self.send):
+            self.assertEqual(self.dispatcher.dispatch([row.pk]), 0)
+            self.assertEqual(self.dispatcher._due_ids(), [])
+            # The claiming worker died: the row is due again once its lease runs out
+            NotificationOutbox.objects.filter(pk=row.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(self.dispatcher._due_ids(), [row.pk])
+            self.assertEqual(self.dispatcher.dispatch([row.pk]), 1)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_failed_sends_back_off_then_become_dead_letters(self):
+        row = self.add_row()
+        with mock.patch.object(self.dispatcher, '_send', self.fail):
+            self.assertEqual(self.dispatcher.dispatch([row.pk]), 0)
+            row.refresh_from_db()
+            self.assertEqual((row.status, row.attempts, row.claim_token), ('pending', 1, ''))
+            self.assertGreater(row.next_attempt_at, timezone.now())
+            self.assertIn('layer down', row.last_error)
+
+            NotificationOutbox.objects.filter(pk=row.pk).update(next_attempt_at=timezone.now())
+            self.dispatcher.dispatch([row.pk])
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ('dead', 2))
+        self.assertEqual(self.dispatcher._due_ids(), [])
+        self.assertEqual(self.dispatcher.stats()['dead'], 1)
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    """Two layers on one file stand in for two worker processes"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'channels.sqlite3')
+        self.worker_a = SQLiteChannelLayer(path, capacity=3)
+        self.worker_b = SQLiteChannelLayer(path, capacity=3)
+
+    def run_async(self, coroutine):
+        return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+    def test_send_to_another_process(self):
+        async def scenario():
+            channel = await self.worker_a.new_channel()
+            await self.worker_b.send(channel, {'type': 'chat.message', 'text': 'hi', 'raw': b'\x00'})
+            return await self.worker_a.receive(channel)
+
+        self.assertEqual(self.run_async(scenario()), {'type': 'chat.message', 'text': 'hi', 'raw': b'\x00'})
+
+    def test_group_send_reaches_members_once(self):
+        async def scenario():
+            first = await self.worker_a.new_channel()
+            second = await self.worker_a.new_channel()
+            left = await self.worker_a.new_channel()
+            for channel in (first, second, left):
+                await self.worker_a.group_add('role_doctor', channel)
+            await self.worker_a.group_discard('role_doctor', left)
+            await self.worker_b.group_send('role_doctor', {'type': 'send_notification', 'n': 1})
+            received = await asyncio.gather(self.worker_a.receive(first), self.worker_a.receive(second))
+            # Nothing was queued for the channel that left, polled or not
+            prefix = self.worker_a._local_prefix
+            return received, left in self.worker_a._buffers, self.worker_a._claim(prefix, prefix + '~')
+
+        received, buffered, queued = self.run_async(scenario())
+        self.assertEqual(received, [{'type': 'send_notification', 'n': 1}] * 2)
+        self.assertFalse(buffered)
+        self.assertEqual(queued, [])
+
+    def test_named_channel_and_capacity(self):
+        async def scenario():
+            for n in range(3):
+                await self.worker_a.send('background.tasks', {'type': 'task', 'n': n})
+            with self.assertRaises(ChannelFull):
+                await self.worker_a.send('background.tasks', {'type': 'task', 'n': 3})
+            return [await self.worker_b.receive('background.tasks') for _ in range(3)]
+
+        self.assertEqual([message['n'] for message in self.run_async(scenario())], [0, 1, 2])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'breaker-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'breaker-shared'},
+})
+class CircuitBreakerTests(SimpleTestCase):
+    """State transitions of the shared circuit breaker, with a controllable clock"""
+
+    def setUp(self):
+        self.now = 1000.0
+        for patch in (mock.patch.object(circuit_breaker, 'time', mock.Mock(time=lambda: self.now)),
+                      mock.patch.object(circuit_breaker, 'logger')):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.healthy = False
+        self.probes = 0
+        self.breaker = CircuitBreaker('test', self.probe, self.options)
+        # Another worker sharing the state
+        self.other = CircuitBreaker('test', self.probe, self.options)
+        self.addCleanup(self.breaker.reset)
+
+    def options(self):
+        return {'FAILURE_THRESHOLD': 3, 'RESET_TIMEOUT': 30}
+
+    def probe(self, timeout):
+        self.probes += 1
+        return self.healthy
+
+    def trip(self):
+        for _ in range(3):
+            self.breaker.record_failure(ConnectionError('refused'))
+
+    def test_opens_after_threshold_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.breaker.record_failure(ConnectionError('refused'))
+        self.assertEqual(self.other.state(), OPEN)
+        self.assertFalse(self.other.allow())
+        self.assertEqual(self.probes, 0)
+        self.assertIn('refused', self.breaker.stats()['last_error'])
+
+    def test_failed_probe_reopens(self):
+        self.trip()
+        self.now += 31
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.probes, 1)
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.probes, 1)
+
+    def test_healthy_probe_closes(self):
+        self.trip()
+        self.now += 31
+        self.healthy = True
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.other.state(), CLOSED)
+        self.assertTrue(self.other.allow())
+        self.assertEqual(self.probes, 1)
+
+    def test_one_worker_probes_at_a_time(self):
+        self.trip()
+        self.now += 31
+        self.other.cache.add(self.other._key('probe'), 1)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.probes, 0)
+        self.assertEqual(self.breaker.stats()['process']['short_circuited'], 1)
+
+
+def create_patient(first_name, last_name, mrn, phone, **fields):
+    return Patient.objects.create(
+        first_name=first_name, last_name=last_name, medical_record_number=mrn, phone=phone,
+        date_of_birth=date(1985, 6, 1), gender='F', marital_status='single', **fields,
+    )
+
+
+@override_settings(SEARCH_BACKEND='local')
+class LocalSearchTests(TestCase):
+    """The built-in search index answers global_search once a rebuild has finished"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mary = create_patient('Mary', 'Wanjiru', 'MRN-2024-001', '0712345678')
+        cls.peter = create_patient('Peter', 'Mutunga', 'MRN-2024-002', '0722000111', address='Mary Street')
+
+    def setUp(self):
+        patch = mock.patch.object(search, '_ready_indexes', set())
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def build(self):
+        call_command('rebuild_search_index', 'patients', '--if-empty', stdout=StringIO())
+
+    def search(self, text, fields=('first_name', 'last_name', 'address', 'medical_record_number')):
+        return PatientIndex.search().query('multi_match', query=text, fields=list(fields))[:10].execute()
+
+    def test_not_ready_until_a_rebuild_finishes(self):
+        # Save signals wrote entries, which alone do not make the index built
+        self.assertTrue(SearchEntry.objects.filter(index_name='patients').exists())
+        with self.assertRaises(SearchIndexNotReady):
+            self.search('mary')
+        self.build()
+        self.assertEqual([hit.pk for hit in self.search('wanj')], [self.mary.pk])
+
+    def test_phrases_and_boosts(self):
+        self.build()
+        self.assertEqual([hit.pk for hit in self.search('MRN-2024-002')], [self.peter.pk])
+        hits = self.search('mary', fields=('first_name^3', 'address'))
+        self.assertEqual([hit.pk for hit in hits], [self.mary.pk, self.peter.pk])
+        self.assertGreater(hits[0].meta.score, hits[1].meta.score)
+
+    def test_queries_do_not_grow_with_matches(self):
+        self.build()
+        self.search('mary')  # is_ready() is remembered from here on
+        with self.assertNumQueries(2):
+            self.search('mary')
+        for n in range(30):
+            create_patient('Mary', f'Other{n}', f'MRN-2025-{n:03d}', f'0733{n:06d}')
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.search('mary')), 10)
+
+
+class PatientLookupTests(TestCase):
+    """Front-desk lookup by identifier prefixes, phone numbers and misspelt names"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mary = create_patient('Mary', 'Wanjiru', 'MRN-2024-001', '0712345678', national_id='12345678')
+        cls.peter = create_patient('Peter', 'Mutunga', 'MRN-2024-002', '0722000111', middle_name='Kamau')
+        cls.joseph = create_patient('Joseph', 'Ochieng', 'OP-7781', '+254733444555')
+        call_command('rebuild_patient_lookup', '--if-empty', stdout=StringIO())
+
+    def setUp(self):
+        patch = mock.patch.object(patient_lookup, '_keys_ready', False)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def ids(self, query):
+        return [result['id'] for result in PatientLookupService.lookup(query)]
+
+    def test_identifiers(self):
+        self.assertEqual(self.ids('mrn-2024-00'), [self.mary.pk, self.peter.pk])
+        self.assertEqual(self.ids('MRN2024002'), [self.peter.pk])
+        self.assertEqual(self.ids('1234567'), [self.mary.pk])
+
+    def test_phone_numbers(self):
+        # Local and international forms, prefixes and suffixes
+        self.assertEqual(self.ids('0733 444'), [self.joseph.pk])
+        self.assertEqual(self.ids('+254712345678'), [self.mary.pk])
+        self.assertEqual(self.ids('0111'), [self.peter.pk])
+
+    def test_partial_and_misspelt_names(self):
+        self.assertEqual(self.ids('wanj'), [self.mary.pk])
+        self.assertEqual(self.ids('Wanjru'), [self.mary.pk])
+        self.assertEqual(self.ids('Mray Wanjiru')[:1], [self.mary.pk])
+        self.assertEqual(self.ids('peter kamu')[:1], [self.peter.pk])
+
+    def test_queries_do_not_grow_with_patients(self):
+        PatientLookupService.lookup('Wanjru')
+        with CaptureQueriesContext(connection) as before:
+            PatientLookupService.lookup('Wanjru')
+        for n in range(50):
+            create_patient('Mary', f'Wanjiku{n}', f'MRN-2025-{n:03d}', f'0744{n:06d}')
+        with CaptureQueriesContext(connection) as after:
+            PatientLookupService.lookup('Wanjru')
+        self.assertEqual(len(after), len(before))
+        self.assertLessEqual(len(after), 5)
+
+
+class NotificationConsumerReceiveTests(TestCase):
+    """Bad client frames get an error reply instead of closing the socket"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('nurse1')
+        cls.notification = Notification.objects.create(recipient=cls.user, title='Lab result', message='Ready')
+
+    def receive(self, text):
+        consumer = NotificationConsumer()
+        consumer.user = self.user
+        consumer.role = None
+        sent = []
+
+        async def send(text_data=None, **kwargs):
+            sent.append(json.loads(text_data))
+
+        consumer.send = send
+        # Database calls come back to this thread, which owns the test database connection
+        async_to_sync(consumer.receive)(text)
+        return sent
+
+    def test_malformed_frames(self):
+        for text in ('{not json', '[1, 2]', '"mark_read"'):
+            [reply] = self.receive(text)
+            self.assertEqual(reply['type'], 'error', text)
+
+    def test_mark_read_is_validated(self):
+        [reply] = self.receive(json.dumps({'type': 'mark_read', 'notification_ids': ['x']}))
+        self.assertEqual(reply['type'], 'error')
+        self.assertIn('notification_ids', reply['errors'])
+        self.notification.refresh_from_db()
+        self.assertFalse(self.notification.is_read)
+
+        [reply] = self.receive(json.dumps({'type': 'mark_read', 'notification_id': self.notification.pk}))
+        self.assertEqual(reply['type'], 'marked_read')
+        self.notification.refresh_from_db()
+        self.assertTrue(self.notification.is_read)
@@ -8,6 +8,7 @@ router.register(r'api/patients', api.PatientViewSet)
 router.register(r'api/wounds', api.WoundCareViewSet)
 router.register(r'api/appointments', api.AppointmentViewSet)
 router.register(r'api/prescriptions', api.PrescriptionViewSet)
+router.register(r'api/notifications', api.NotificationViewSet, basename='notification')
 
 urlpatterns = [
     path("", include(router.urls)),
@@ -17,9 +18,12 @@ urlpatterns = [
     path("export/patients/csv/", export.export_patients_csv, name="export_patients_csv"),
     path("export/wounds/excel/", export.export_wounds_excel, name="export_wounds_excel"),
     path("export/wounds/pdf/", export.export_wounds_pdf, name="export_wounds_pdf"),
+    path("export/jobs/<str:job_id>/", export.export_job_status, name="export_job_status"),
+    path("export/jobs/<str:job_id>/download/", export.export_job_download, name="export_job_download"),
     # Patient Register
     path("patients/", views.patient_list, name="patient_list"),
     path("patients/create/", views.patient_create, name="patient_create"),
+    path("patients/lookup/", views.patient_lookup, name="patient_lookup"),
     path("patients/<int:pk>/update/", views.patient_update, name="patient_update"),
     path("appointments/", views.appointment_list, name="appointment_list"),
     path("appointments/create/", views.appointment_create, name="appointment_create"),
@@ -49,7 +53,9 @@ urlpatterns = [
     # Phase 2 Enhancements
     path("backup/", views.backup_database, name="backup_database"),
     path("audit/<str:model_name>/<int:pk>/", views.audit_trail, name="audit_trail"),
+    path("notifications/queue/", views.notification_queue_metrics, name="notification_queue_metrics"),
     path("analytics/", views.advanced_analytics, name="advanced_analytics"),
     path("search/", views.global_search, name="global_search"),
     path("search/advanced/", views.advanced_search, name="advanced_search"),
+    path("search/backend/", views.search_backend_metrics, name="search_backend_metrics"),
 ]
\ No newline at end of file
@@ -1,12 +1,14 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django_tables2 import RequestConfig
 from django.db.models import Q
 from datetime import datetime
 from .models import *
 from .forms import *
 from .tables import *
+from .middleware import get_request_profile
+from .services import WoundStatisticsService
 
 def index(request):
     context = {
@@ -16,7 +18,9 @@ def index(request):
 
 @login_required
 def dashboard(request):
-    user_profile = get_object_or_404(UserProfile, user=request.user)
+    user_profile = get_request_profile(request)
+    if user_profile is None:
+        raise Http404('No UserProfile matches the given query.')
     context = {
         "title": "Dashboard",
         "user_profile": user_profile,
@@ -26,9 +30,7 @@ def dashboard(request):
 # Patient Register Views
 @login_required
 def patient_list(request):
-    patients = Patient.objects.all()
-    table = PatientTable(patients)
-    RequestConfig(request).configure(table)
+    table = PatientTable.for_request(request)
     return render(request, 'patient_list.html', {'table': table})
 
 @login_required
@@ -43,6 +45,28 @@ def patient_create(request):
         form = PatientForm()
     return render(request, 'patient_form.html', {'form': form, 'title': 'Add Patient'})
 
+@login_required
+def patient_lookup(request):
+    """
+    JSON autocomplete for the front desk: ?q=<name, MRN, phone or national ID>&limit=10
+    """
+    import time
+    from django.http import JsonResponse
+    from .patient_lookup import PatientLookupService
+
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 10
+    started = time.perf_counter()
+    results = PatientLookupService.lookup(query, limit=limit)
+    return JsonResponse({
+        'query': query,
+        'results': results,
+        'took_ms': round((time.perf_counter() - started) * 1000, 1),
+    })
+
 @login_required
 def patient_update(request, pk):
     patient = get_object_or_404(Patient, pk=pk)
@@ -58,9 +82,7 @@ def patient_update(request, pk):
 
 @login_required
 def appointment_list(request):
-    appointments = Appointment.objects.all()
-    table = AppointmentTable(appointments)
-    RequestConfig(request).configure(table)
+    table = AppointmentTable.for_request(request)
     return render(request, 'appointment_list.html', {'table': table})
 
 @login_required
@@ -78,9 +100,7 @@ def appointment_create(request):
 # Laboratory Views
 @login_required
 def lab_request_list(request):
-    requests = LabRequest.objects.all()
-    table = LabRequestTable(requests)
-    RequestConfig(request).configure(table)
+    table = LabRequestTable.for_request(request)
     return render(request, 'lab_request_list.html', {'table': table})
 
 @login_required
@@ -98,9 +118,7 @@ def lab_request_create(request):
 # Pharmacy Views
 @login_required
 def prescription_list(request):
-    prescriptions = Prescription.objects.all()
-    table = PrescriptionTable(prescriptions)
-    RequestConfig(request).configure(table)
+    table = PrescriptionTable.for_request(request)
     return render(request, 'prescription_list.html', {'table': table})
 
 @login_required
@@ -118,9 +136,7 @@ def prescription_create(request):
 # Out Patient Views
 @login_required
 def outpatient_visit_list(request):
-    visits = OutPatientVisit.objects.all()
-    table = OutPatientVisitTable(visits)
-    RequestConfig(request).configure(table)
+    table = OutPatientVisitTable.for_request(request)
     return render(request, 'outpatient_visit_list.html', {'table': table})
 
 @login_required
@@ -138,9 +154,7 @@ def outpatient_visit_create(request):
 # Nursing Views
 @login_required
 def vital_signs_list(request):
-    vitals = VitalSigns.objects.all()
-    table = VitalSignsTable(vitals)
-    RequestConfig(request).configure(table)
+    table = VitalSignsTable.for_request(request)
     return render(request, 'vital_signs_list.html', {'table': table})
 
 @login_required
@@ -353,33 +367,23 @@ def wound_billing(request, wound_id):
 @login_required
 def wound_dashboard(request):
     """Wound care dashboard with analytics"""
-    total_cases = WoundCare.objects.filter(is_active=True).count()
-    active_cases = WoundCare.objects.filter(status='active').count()
-    pending_cases = WoundCare.objects.filter(status='pending').count()
-    resolved_cases = WoundCare.objects.filter(status='resolved').count()
-    
-    # Insurance coverage stats
-    insured_cases = WoundCare.objects.filter(insurance_covers=True).count()
-    uninsured_cases = WoundCare.objects.filter(insurance_covers=False).count()
-    
+    stats = WoundStatisticsService.get_stats()
+
     # Recent cases
-    recent_wounds = WoundCare.objects.filter(is_active=True).order_by('-assessment_date')[:10]
-    
-    # Payment status
-    pending_payments = WoundBilling.objects.filter(payment_status='pending').aggregate(
-        total=models.Sum('balance')
-    )['total'] or 0
+    recent_wounds = WoundCare.objects.filter(is_active=True).select_related(
+        'patient', 'wound_type', 'body_part'
+    ).order_by('-assessment_date')[:10]
     
     context = {
         'title': 'Wound Care Dashboard',
-        'total_cases': total_cases,
-        'active_cases': active_cases,
-        'pending_cases': pending_cases,
-        'resolved_cases': resolved_cases,
-        'insured_cases': insured_cases,
-        'uninsured_cases': uninsured_cases,
+        'total_cases': stats['total_cases'],
+        'active_cases': stats['active_cases'],
+        'pending_cases': stats['pending_cases'],
+        'resolved_cases': stats['resolved_cases'],
+        'insured_cases': stats['insured_cases'],
+        'uninsured_cases': stats['uninsured_cases'],
         'recent_wounds': recent_wounds,
-        'pending_payments': pending_payments,
+        'pending_payments': stats['pending_payments'],
     }
     return render(request, 'wound_dashboard.html', context)
 
@@ -426,6 +430,32 @@ def audit_trail(request, model_name, pk):
         messages.error(request, f'Model {model_name} not found.')
         return redirect('dashboard')
 
+@login_required
+def notification_queue_metrics(request):
+    """Depth, backlog and lag of the notification dispatch queue"""
+    from django.http import JsonResponse
+    from .change_feed import change_feed
+    from .consumers import push_stats
+    from .dispatch import dispatcher
+    return JsonResponse({
+        **dispatcher.stats(),
+        'websocket_push': push_stats.snapshot(),
+        'change_feed': change_feed.stats(),
+    })
+
+@login_required
+def search_backend_metrics(request):
+    """Search backend state: Elasticsearch circuit breaker and indexing queue"""
+    from django.conf import settings
+    from django.http import JsonResponse
+    from .search import search_breaker
+    from .search_indexing import search_indexer
+    return JsonResponse({
+        'backend': settings.SEARCH_BACKEND,
+        'circuit_breaker': search_breaker.stats(),
+        'indexing': search_indexer.stats(),
+    })
+
 @login_required
 def advanced_analytics(request):
     """Advanced analytics dashboard with interactive charts"""
@@ -526,75 +556,23 @@ def global_search(request):
         'prescriptions': [],
     }
 
+    timed_out = []
+
     if query and len(query) >= 2:
-        try:
-            # Try Elasticsearch first
-            if search_type in ['all', 'patients']:
-                from .documents import PatientDocument
-                patient_search = PatientDocument.search().query(
-                    'multi_match',
-                    query=query,
-                    fields=['first_name', 'last_name', 'medical_record_number', 'phone', 'email']
-                )
-                results['patients'] = patient_search[:10].execute()
-
-            if search_type in ['all', 'wound_cases']:
-                from .documents import WoundCareDocument
-                wound_search = WoundCareDocument.search().query(
-                    'multi_match',
-                    query=query,
-                    fields=['wound_id', 'appearance', 'clinical_notes', 'patient_name', 'wound_type_name']
-                )
-                results['wound_cases'] = wound_search[:10].execute()
-
-            if search_type in ['all', 'appointments']:
-                from .documents import AppointmentDocument
-                appointment_search = AppointmentDocument.search().query(
-                    'multi_match',
-                    query=query,
-                    fields=['patient_name', 'doctor_name', 'notes']
-                )
-                results['appointments'] = appointment_search[:10].execute()
-
-            if search_type in ['all', 'prescriptions']:
-                from .documents import PrescriptionDocument
-                prescription_search = PrescriptionDocument.search().query(
-                    'multi_match',
-                    query=query,
-                    fields=['diagnosis', 'instructions', 'patient_name', 'doctor_name']
-                )
-                results['prescriptions'] = prescription_search[:10].execute()
-
-        except Exception as e:
-            # Fallback to database search if Elasticsearch is not available
-            messages.info(request, 'Using database search (Elasticsearch not available)')
-
-            if search_type in ['all', 'patients']:
-                results['patients'] = Patient.objects.filter(
-                    Q(first_name__icontains=query) |
-                    Q(last_name__icontains=query) |
-                    Q(medical_record_number__icontains=query) |
-                    Q(phone__icontains=query) |
-                    Q(email__icontains=query)
-                )[:10]
-
-            if search_type in ['all', 'wound_cases']:
-                results['wound_cases'] = WoundCare.objects.filter(
-                    Q(wound_id__icontains=query) |
-                    Q(appearance__icontains=query) |
-                    Q(clinical_notes__icontains=query)
-                ).select_related('patient', 'wound_type')[:10]
-
-            if search_type in ['all', 'appointments']:
-                results['appointments'] = Appointment.objects.filter(
-                    Q(notes__icontains=query)
-                ).select_related('patient', 'doctor')[:10]
-
-            if search_type in ['all', 'prescriptions']:
-                results['prescriptions'] = Prescription.objects.filter(
-                    Q(diagnosis__icontains=query) |
-                    Q(instructions__icontains=query)
-                ).select_related('patient', 'doctor')[:10]
+        from .global_search import SEARCH_TYPES, run_global_search
+        types = list(SEARCH_TYPES) if search_type == 'all' else [t for t in SEARCH_TYPES if t == search_type]
+        # Types are searched concurrently, each within its time budget
+        search = run_global_search(query, types)
+        results.update(search['results'])
+        timed_out = search['timed_out']
+        if search['fallback']:
+            messages.info(request, 'Using database search (search index not available)')
+        if timed_out:
+            messages.warning(
+                request,
+                'Some results are missing because the search took too long: '
+                + ', '.join(t.replace('_', ' ') for t in timed_out),
+            )
 
     context = {
         'title': 'Global Search',
@@ -602,6 +580,8 @@ def global_search(request):
         'search_type': search_type,
         'results': results,
         'total_results': sum(len(result) for result in results.values()),
+        'timed_out': timed_out,
+        'partial_results': bool(timed_out),
     }
     return render(request, 'global_search.html', context)
 
@@ -632,10 +612,6 @@ def advanced_search(request):
         prescription_filters = Q()
 
         if query:
-            patient_filters &= (Q(first_name__icontains=query) |
-                              Q(last_name__icontains=query) |
-                              Q(phone__icontains=query) |
-                              Q(id_number__icontains=query))
             wound_filters &= (Q(wound_id__icontains=query) |
                             Q(appearance__icontains=query) |
                             Q(clinical_notes__icontains=query))
@@ -679,7 +655,12 @@ def advanced_search(request):
 
         # Apply filters
         if search_type in ['all', 'patients']:
-            results['patients'] = Patient.objects.filter(patient_filters)[:20]
+            if query:
+                # Ranked, typo-tolerant name/MRN/phone/ID lookup
+                from .patient_lookup import PatientLookupService
+                results['patients'] = PatientLookupService.search_patients(query, limit=20)
+            else:
+                results['patients'] = Patient.objects.filter(patient_filters)[:20]
 
         if search_type in ['all', 'wound_cases']:
             results['wound_cases'] = WoundCare.objects.filter(wound_filters).select_related('patient', 'wound_type')[:20]
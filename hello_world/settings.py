@@ -13,8 +13,10 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 from datetime import timedelta
 
 import os
+import tempfile
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 import dj_database_url
 
 
@@ -137,6 +139,7 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
                 "hello_world.context_processors.auth_pages",
+                "hello_world.context_processors.user_profile",
             ],
         },
     },
@@ -216,6 +219,31 @@ MEDIA_ROOT = BASE_DIR / "hello_world" / "media"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# List tables (see PaginatedTable in core/tables.py). Pages beyond
+# MAX_OFFSET_PAGE are served with keyset pagination instead of OFFSET.
+TABLE_PAGINATION = {
+    'PER_PAGE': config("TABLE_PER_PAGE", default=25, cast=int),
+    'MAX_PER_PAGE': 100,
+    'MAX_OFFSET_PAGE': 20,
+}
+
+# Exports larger than this many rows are rendered by a background job
+# (core/export_jobs.py) into EXPORT_DIR and downloaded when finished.
+EXPORT_ASYNC_ROW_THRESHOLD = config("EXPORT_ASYNC_ROW_THRESHOLD", default=5000, cast=int)
+EXPORT_DIR = config("EXPORT_DIR", default=os.path.join(tempfile.gettempdir(), 'neudebri_hmis_exports'))
+EXPORT_ARTIFACT_TTL = 60 * 60
+# Seconds a running export job stays claimed without a heartbeat before
+# the next request for it starts it again
+EXPORT_JOB_LEASE = 60
+
+# Notification retention (manage.py purge_notifications, run daily).
+# Purged rows are archived as gzipped JSONL, one file per creation month.
+NOTIFICATION_RETENTION = {
+    'READ_DAYS': config("NOTIFICATION_READ_RETENTION_DAYS", default=90, cast=int),
+    'UNREAD_DAYS': config("NOTIFICATION_UNREAD_RETENTION_DAYS", default=365, cast=int),
+    'ARCHIVE_DIR': config("NOTIFICATION_ARCHIVE_DIR", default=os.path.join(BASE_DIR, 'archive', 'notifications')),
+}
+
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
@@ -251,15 +279,37 @@ DBBACKUP_STORAGE_OPTIONS = {
     'location': BASE_DIR / 'backups'
 }
 
-# Cache Configuration - Force database cache to avoid Redis issues
+# Cache Configuration
+# Two tiers: a per-worker LRU (L1) in front of a shared cache (L2). L2 is
+# Redis when REDIS_URL is set, otherwise a file cache shared by all workers
+# on the box. See hello_world/core/cache.py.
+REDIS_URL = config("REDIS_URL", default=None)
+if REDIS_URL:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'hmis',
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config("CACHE_DIR", default=os.path.join(tempfile.gettempdir(), 'neudebri_hmis_cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
-        'LOCATION': 'cache_table',
+        'BACKEND': 'hello_world.core.cache.TieredCache',
         'OPTIONS': {
-            'MAX_ENTRIES': 1000,
+            'SHARED_ALIAS': 'shared',
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 30,
+            'GENERATION_CHECK_INTERVAL': 1,
         },
-    }
+    },
+    'shared': SHARED_CACHE,
 }
 
 # Django REST Framework Configuration
@@ -313,9 +363,14 @@ EMAIL_HOST_PASSWORD = 'your-app-password'
 # Channels Configuration (for WebSockets if needed)
 ASGI_APPLICATION = 'hello_world.asgi.application'
 
-# Redis URL for channels (use environment variable or fallback)
-REDIS_URL = config("REDIS_URL", default=None)
-if REDIS_URL:
+# Channel layer, chosen explicitly with CHANNEL_LAYER:
+#   redis  - channels_redis on REDIS_URL (shared with the cache tier)
+#   sqlite - SQLite file shared by every worker process on this host
+#   memory - InMemoryChannelLayer; single process only, for development
+CHANNEL_LAYER = config("CHANNEL_LAYER", default='redis' if REDIS_URL else 'sqlite')
+if CHANNEL_LAYER == 'redis':
+    if not REDIS_URL:
+        raise ImproperlyConfigured("CHANNEL_LAYER=redis requires REDIS_URL")
     CHANNEL_LAYERS = {
         'default': {
             'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -324,13 +379,59 @@ if REDIS_URL:
             },
         },
     }
-else:
-    # Fallback for development or when Redis is not available
+elif CHANNEL_LAYER == 'sqlite':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'hello_world.core.channel_layers.SQLiteChannelLayer',
+            'CONFIG': {
+                'path': config("CHANNEL_LAYER_PATH",
+                               default=os.path.join(tempfile.gettempdir(), 'neudebri_hmis_channels.sqlite3')),
+            },
+        },
+    }
+elif CHANNEL_LAYER == 'memory':
     CHANNEL_LAYERS = {
         'default': {
             'BACKEND': 'channels.layers.InMemoryChannelLayer',
         },
     }
+else:
+    raise ImproperlyConfigured(f"Unknown CHANNEL_LAYER {CHANNEL_LAYER!r}; use redis, sqlite or memory")
+
+# Outbox-backed notification dispatcher (hello_world/core/dispatch.py)
+NOTIFICATION_DISPATCH = {
+    'QUEUE_SIZE': config('NOTIFICATION_QUEUE_SIZE', default=1000, cast=int),
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 6,
+    'BACKOFF_BASE': 2,  # seconds, doubled per attempt
+    'BACKOFF_MAX': 300,
+    'POLL_INTERVAL': 5,
+    'LEASE_SECONDS': 60,
+}
+
+# Coalescing of wound/appointment websocket pushes (hello_world/core/consumers.py)
+WEBSOCKET_COALESCE = {
+    'WINDOW': config('WEBSOCKET_COALESCE_WINDOW', default=0.25, cast=float),
+    'MAX_PENDING': 500,
+    'MAX_TRACKED': 1000,
+}
+
+# Batching of model change events for the live feeds (hello_world/core/change_feed.py)
+CHANGE_FEED = {
+    'WINDOW': config('CHANGE_FEED_WINDOW', default=0.05, cast=float),
+    'BATCH_SIZE': 200,
+    'QUEUE_SIZE': 10000,
+}
+
+# Front-desk patient lookup (hello_world/core/patient_lookup.py)
+PATIENT_LOOKUP = {
+    'PHONE_COUNTRY_CODE': config('PATIENT_LOOKUP_PHONE_COUNTRY_CODE', default='254'),
+    'MIN_SIMILARITY': 0.3,
+    'MAX_RESULTS': 50,
+    'CANDIDATES': 200,
+    'CORRECTIONS': 3,
+    'MAX_EDITS': 2,
+}
 
 # Elasticsearch Configuration (only if available)
 if HAS_ELASTICSEARCH:
@@ -348,8 +449,55 @@ if HAS_ELASTICSEARCH:
                 'hosts': 'http://localhost:9200'  # Will fail gracefully
             },
         }
+    # Saves mark documents dirty; they are sent in bulk after commit
+    # (hello_world/core/search_indexing.py)
+    ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = 'hello_world.core.search_indexing.QueuedSignalProcessor'
 else:
     # No elasticsearch available
     ELASTICSEARCH_DSL = None
 
+# Search backend for global_search: 'elasticsearch', or 'local' for the
+# built-in full-text index (hello_world/core/search.py)
+SEARCH_BACKEND = config(
+    "SEARCH_BACKEND",
+    default='elasticsearch' if HAS_ELASTICSEARCH and ELASTICSEARCH_URL else 'local',
+)
+
+# Queued Elasticsearch indexing: ids changed within WINDOW seconds are
+# indexed together, BATCH_SIZE documents per bulk request
+SEARCH_INDEXING = {
+    'WINDOW': config('SEARCH_INDEXING_WINDOW', default=0.5, cast=float),
+    'BATCH_SIZE': 500,
+    'QUEUE_SIZE': 10000,
+    'MAX_ATTEMPTS': 8,  # failed updates are retried from SearchIndexBacklog
+    'BACKOFF_BASE': 2,  # seconds, doubled per attempt
+    'BACKOFF_MAX': 600,
+    'POLL_INTERVAL': 5,
+    'LEASE_SECONDS': 120,
+}
+
+# global_search runs its per-type searches concurrently
+# (hello_world/core/global_search.py); a type slower than its budget in
+# seconds (TIME_BUDGETS overrides per type) is answered from the database,
+# or left out of the page if that is too slow as well. Elasticsearch
+# requests time out after REQUEST_TIMEOUT, which must stay below the budget
+GLOBAL_SEARCH = {
+    'TIME_BUDGET': config('GLOBAL_SEARCH_TIME_BUDGET', default=2.0, cast=float),
+    'TIME_BUDGETS': {},
+    'REQUEST_TIMEOUT': config('GLOBAL_SEARCH_REQUEST_TIMEOUT', default=1.5, cast=float),
+    'MAX_WORKERS': 8,
+    'RESULTS': 10,
+}
+
+# Elasticsearch circuit breaker (hello_world/core/circuit_breaker.py): after
+# FAILURE_THRESHOLD failed searches within FAILURE_WINDOW seconds,
+# global_search uses the database for RESET_TIMEOUT seconds, then one
+# worker probes cluster health before searches are let through again
+SEARCH_CIRCUIT_BREAKER = {
+    'FAILURE_THRESHOLD': config('SEARCH_CIRCUIT_FAILURE_THRESHOLD', default=3, cast=int),
+    'FAILURE_WINDOW': 60,
+    'RESET_TIMEOUT': config('SEARCH_CIRCUIT_RESET_TIMEOUT', default=30, cast=int),
+    'PROBE_TIMEOUT': 1.0,
+}
+
 SOCIALACCOUNT_AUTO_SIGNUP = True
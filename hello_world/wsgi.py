@@ -124,23 +124,8 @@ def run_startup_migrations():
         except Exception as e:
             logger.error(f"[WSGI] Error ensuring user profiles: {e}")
         
-        # Create cache table if it doesn't exist
-        try:
-            from django.db import connection
-            cursor = connection.cursor()
-            # Check if cache table exists (works for both SQLite and PostgreSQL)
-            if connection.vendor == 'sqlite':
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='cache_table'")
-            else:  # PostgreSQL
-                cursor.execute("SELECT tablename FROM pg_tables WHERE tablename = 'cache_table'")
-            
-            if not cursor.fetchone():
-                call_command('createcachetable', 'cache_table', verbosity=0)
-                logger.info("[WSGI] ✓ Created cache table")
-            else:
-                logger.info("[WSGI] ✓ Cache table already exists")
-        except Exception as e:
-            logger.error(f"[WSGI] Error creating cache table: {e}")
+        # Search indexes are built by the release step (render.yaml, startup.py),
+        # not here: every gunicorn worker loads this module
     
     except Exception as e:
         logger.error(f"[WSGI] Migration error: {e}", exc_info=True)
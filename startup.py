@@ -71,6 +71,20 @@ def run_migrations():
         logger.exception("Detailed error:")
         return False
 
+def build_search_indexes():
+    """Index existing data for search the first time (non-critical)"""
+    from django.core.management import call_command
+
+    logger.info("▶ Building empty search indexes...")
+    try:
+        call_command('rebuild_search_index', '--if-empty')
+        call_command('rebuild_patient_lookup', '--if-empty')
+        logger.info("✓ Search indexes ready")
+    except Exception as e:
+        # Searches fall back to the database until the index is built
+        logger.error(f"✗ Search index build failed: {str(e)}")
+        logger.exception("Detailed error:")
+
 def load_initial_data():
     """Create initial users"""
     from django.contrib.auth.models import User
@@ -185,10 +199,13 @@ def main():
     
     # Step 3: Load initial data (non-critical)
     load_initial_data()
+
+    # Step 4: Index existing data for search (non-critical)
+    build_search_indexes()
     
     banner("✓ STARTUP COMPLETE - Starting server")
     
-    # Step 4: Start gunicorn
+    # Step 5: Start gunicorn
     start_gunicorn()
 
 if __name__ == '__main__':